@@ -1,9 +1,13 @@
-from flask import Flask
+from flask import Flask, jsonify
 from .config import Config
 from .extensions import socketio
 from .utils.db import init_db, init_db_dominio
 from .blueprints.auth import bp_auth
 from .blueprints.core import bp_core
+from .services.camera import register_camera_source, configure_capture
+from .services.camera_registry import start_camera_registry
+from .services.sources import parse_camera_sources
+from .services.engines import preload_engine, engine_status
 
 def create_app():
     app = Flask(__name__, template_folder="../templates", static_folder="../static")
@@ -16,6 +20,24 @@ def create_app():
     init_db()          # usuarios
     init_db_dominio()  # configuraciones, sesiones, métricas
 
+    # Frames reducidos para análisis y streaming (se generan una vez por captura)
+    configure_capture(analysis_width=app.config["ANALYSIS_FRAME_WIDTH"],
+                      preview_width=app.config["PREVIEW_FRAME_WIDTH"],
+                      low_latency=app.config["CAPTURE_LOW_LATENCY"],
+                      open_timeout=app.config["CAMERA_OPEN_TIMEOUT"])
+
+    # Fuentes de reproducción (video, imágenes o sintética) como cámaras virtuales
+    for index, source in parse_camera_sources(app.config["CAMERA_SOURCES"]).items():
+        register_camera_source(index, source)
+
+    # Detección de cámaras en segundo plano (las rutas leen la caché)
+    start_camera_registry(ttl=app.config["CAMERA_PROBE_TTL"],
+                          max_index=app.config["CAMERA_PROBE_MAX_INDEX"])
+
+    # Modelos de inferencia cargados y ejercitados antes de la primera clase
+    if app.config["MODEL_PRELOAD"] != "off":
+        preload_engine(app.config, background=app.config["MODEL_PRELOAD"] != "blocking")
+
     # Blueprints
     app.register_blueprint(bp_auth)
     app.register_blueprint(bp_core)
@@ -24,4 +46,11 @@ def create_app():
     def healthz():
         return "ok"
 
+    @app.route("/readyz")
+    def readyz():
+        # Modelos cargados (503 mientras cargan o si fallaron); sin precarga se cargan en la primera clase
+        models = engine_status()
+        ready = models["ready"] or app.config["MODEL_PRELOAD"] == "off"
+        return jsonify({"status": "ok" if ready else models["status"], "models": models}), 200 if ready else 503
+
     return app
@@ -1,10 +1,18 @@
 import threading, time
-from flask import Blueprint, render_template, request, redirect, url_for, session, Response, jsonify, flash
+from flask import (Blueprint, render_template, request, redirect, url_for, session, Response, jsonify, flash,
+                   current_app, send_from_directory, abort)
+import os
+from flask_socketio import join_room, leave_room
 from ..extensions import socketio
 from ..services.camera import (
-    camera_state, camera_lock, detect_cameras, camera_thread_func,
-    generate_frames, get_camera_info, start_camera_system
+    get_camera_worker, start_camera_worker, switch_camera_worker, list_camera_workers, camera_room,
+    generate_frames, get_snapshot, get_camera_info, list_camera_info, start_camera_system, STREAM_VARIANTS,
+    start_camera_recording, stop_camera_recording
 )
+from ..services.recorder import new_session_id, valid_session_id, load_manifest, list_recorded_sessions
+from ..services.camera_registry import get_available_cameras, get_registry_info, refresh_cameras
+from ..services.frame_push import subscribe_frames, unsubscribe_frames, get_push_info
+from ..services.streaming import mjpeg_chunk, placeholder_jpeg
 from ..services.analysis import analyze_faces_thread, get_temperature_valpo
 from ..utils.authz import roles_required
 from ..utils.db import (
@@ -14,13 +22,24 @@ from ..utils.db import (
     asignar_profesor_a_curso, eliminar_curso
 )
 import traceback
-import cv2
-import numpy as np
 
 bp_core = Blueprint("core", __name__)
 
-camera_thread = None
-analysis_thread = None
+analysis_threads = {}  # índice de cámara -> hilo de análisis
+
+def _camera_index(camera=None):
+    """Cámara pedida explícitamente o, si no, la configurada en la sesión"""
+    if camera is not None:
+        return camera
+    return session.get("camera_index", -1)
+
+def _existing_worker(camera=None):
+    """Worker ya creado de la cámara, o None. Solo /config y /dashboard crean workers:
+    las rutas de lectura no deben registrar uno por cada índice que se pida."""
+    return get_camera_worker(_camera_index(camera), create=False)
+
+def _unknown_camera(camera=None):
+    return jsonify({"success": False, "error": f"Cámara {_camera_index(camera)} no configurada"}), 404
 
 # ========================
 # Configuración
@@ -40,11 +59,15 @@ def config():
 
                 print(f"🎥 Configurando cámara: índice={camera_index}, resolución={resolution}")
 
-                with camera_lock:
-                    camera_state["camera_index"] = camera_index
-                    camera_state["resolution"] = resolution
+                previous = session.get("camera_index")
+                session["camera_index"] = camera_index
+                session["camera_resolution"] = resolution
+
+                # Si la cámara ya tiene worker, el hilo aplica la nueva resolución;
+                # si el aula cambió de cámara, se detiene la anterior
+                worker = switch_camera_worker(previous, camera_index, resolution)
 
-                info = get_camera_info()
+                info = get_camera_info(worker)
                 print(f"📊 Estado después de configurar: {info}")
 
                 session["camera_configured"] = True
@@ -81,7 +104,7 @@ def config():
             return redirect(url_for("core.config"))
 
     try:
-        cameras_detected = detect_cameras()
+        cameras_detected = get_available_cameras()
         print(f"📷 Cámaras detectadas: {cameras_detected}")
     except Exception as e:
         print(f"❌ Error detectando cámaras: {e}")
@@ -102,8 +125,6 @@ def config():
 @bp_core.route("/dashboard")
 @roles_required("admin", "profesor")
 def dashboard():
-    global camera_thread, analysis_thread
-
     if not session.get("logged_in"):
         return redirect(url_for("auth.login"))
 
@@ -115,62 +136,162 @@ def dashboard():
 
     start_camera_system()
 
-    with camera_lock:
-        camera_state["is_running"] = True
+    camera_index = _camera_index()
+    worker = get_camera_worker(camera_index)
+    was_alive = get_camera_info(worker)["thread_alive"]
+    start_camera_worker(camera_index, session.get("camera_resolution"))
 
-    info = get_camera_info()
-    print(f"📊 Estado de cámara en dashboard: {info}")
+    info = get_camera_info(worker)
+    print(f"📊 Estado de cámara {camera_index} en dashboard: {info}")
 
-    if camera_thread is None or not camera_thread.is_alive():
-        print("🎥 Iniciando hilo de cámara")
-        camera_thread = threading.Thread(target=camera_thread_func, daemon=True, name="CameraThread")
-        camera_thread.start()
+    if not was_alive:
+        print(f"🎥 Iniciando hilo de cámara {camera_index}")
         time.sleep(1)
 
+    analysis_thread = analysis_threads.get(camera_index)
     if analysis_thread is None or not analysis_thread.is_alive():
-        print("🧠 Iniciando hilo de análisis de emociones")
+        print(f"🧠 Iniciando hilo de análisis de emociones (cámara {camera_index})")
         analysis_thread = threading.Thread(
             target=analyze_faces_thread,
-            args=(session.get('academic_config', {}),),
+            args=(session.get('academic_config', {}), worker),
+            kwargs={"settings": dict(current_app.config)},
             daemon=True,
-            name="AnalysisThread"
+            name=f"AnalysisThread-{camera_index}"
         )
+        analysis_threads[camera_index] = analysis_thread
         analysis_thread.start()
 
+    # Sin grabación, o la anterior murió por un error de escritura: empezar una nueva
+    recording = get_camera_info(worker)["recording"]
+    if current_app.config["RECORD_SESSIONS"] and (recording is None or not recording["recording"]):
+        _start_recording(camera_index)
+
+    frame_push = request.args.get("push", type=int, default=int(current_app.config["SOCKET_FRAME_PUSH"]))
     return render_template("dashboard_optimized.html",
-                         academic_config=session.get('academic_config', {}))
+                         academic_config=session.get('academic_config', {}),
+                         camera_index=camera_index,
+                         frame_push=bool(frame_push),
+                         frame_push_fps=current_app.config["SOCKET_FRAME_MAX_FPS"])
 
 # ========================
 # Video y APIs de cámara
 # ========================
-@bp_core.route("/video_feed")
-def video_feed():
+@bp_core.route("/video_feed", defaults={"camera": None})
+@bp_core.route("/video_feed/<int(signed=True):camera>")
+def video_feed(camera):
+    variant = request.args.get("variant", "annotated")
+    if variant not in STREAM_VARIANTS:
+        return jsonify({"success": False, "error": f"variant debe ser una de {STREAM_VARIANTS}"}), 400
+    worker = _existing_worker(camera)
+    if worker is None:
+        return _unknown_camera(camera)
     try:
-        print("📹 Solicitando video feed")
-        info = get_camera_info()
+        print(f"📹 Solicitando video feed de cámara {worker.index}")
+        info = get_camera_info(worker)
         print(f"📊 Estado de cámara para video feed: {info}")
 
         if not info["is_running"]:
-            with camera_lock:
-                camera_state["is_running"] = True
+            with worker.lock:
+                worker.state["is_running"] = True
 
-        return Response(generate_frames(),
+        return Response(generate_frames(worker, variant),
                        mimetype='multipart/x-mixed-replace; boundary=frame')
 
     except Exception as e:
         print(f"❌ Error en video feed: {e}")
-        error_frame = np.zeros((480, 640, 3), dtype=np.uint8)
-        cv2.putText(error_frame, f"Error: {str(e)}", (50, 240),
-                   cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+        # Frame de error ya codificado (se cachea por mensaje)
+        error_chunk = mjpeg_chunk(placeholder_jpeg((f"Error: {str(e)[:50]}",), color=(0, 0, 255)))
+        return Response([error_chunk],
+                       mimetype='multipart/x-mixed-replace; boundary=frame')
 
-        def error_generator():
-            ret, buffer = cv2.imencode('.jpg', error_frame)
-            if ret:
-                yield (b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
-                       + buffer.tobytes() + b'\r\n')
+@bp_core.route("/snapshot", defaults={"camera": None})
+@bp_core.route("/snapshot/<int(signed=True):camera>")
+def snapshot(camera):
+    """
+    Imagen fija del último frame (para pantallas que no necesitan el stream).
+    Soporta If-None-Match (304 si el frame no cambió), ?max_width= y
+    ?variant=clean (sin overlays).
+    """
+    worker = _existing_worker(camera)
+    if worker is None:
+        return _unknown_camera(camera)
+    try:
+        max_width = request.args.get("max_width", type=int)
+        if max_width is not None and max_width <= 0:
+            return jsonify({"success": False, "error": "max_width debe ser positivo"}), 400
+        variant = request.args.get("variant", "annotated")
+        if variant not in STREAM_VARIANTS:
+            return jsonify({"success": False, "error": f"variant debe ser una de {STREAM_VARIANTS}"}), 400
+
+        etag, jpeg = get_snapshot(worker, max_width, variant)
+        if jpeg is None:
+            return jsonify({"success": False, "error": "Sin frame disponible"}), 503
+
+        response = Response(jpeg, mimetype="image/jpeg")
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "no-cache"
+        return response.make_conditional(request)
+    except Exception as e:
+        print(f"❌ Error en snapshot: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
 
-        return Response(error_generator(),
-                       mimetype='multipart/x-mixed-replace; boundary=frame')
+# ========================
+# Grabación de sesiones
+# ========================
+def _start_recording(camera, session_id=None):
+    cfg = current_app.config
+    recorder = start_camera_recording(
+        camera, session_id or new_session_id(camera), cfg["RECORDINGS_DIR"],
+        fps=cfg["RECORDING_FPS"], segment_seconds=cfg["RECORDING_SEGMENT_SECONDS"],
+        queue_size=cfg["RECORDING_QUEUE_SIZE"], fourcc=cfg["RECORDING_FOURCC"])
+    print(f"⏺️ Grabando cámara {camera} en la sesión {recorder.session_id}")
+    return recorder
+
+@bp_core.route("/api/recording/start", methods=["POST"])
+@roles_required("admin", "profesor")
+def recording_start_api():
+    data = request.get_json(silent=True) or {}
+    session_id = data.get("session_id")
+    if session_id is not None and not valid_session_id(session_id):
+        return jsonify({"success": False, "error": "session_id inválido (solo letras, números, _ y -)"}), 400
+    try:
+        recorder = _start_recording(_camera_index(data.get("camera")), session_id)
+        return jsonify({"success": True, "recording": recorder.info()})
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@bp_core.route("/api/recording/stop", methods=["POST"])
+@roles_required("admin", "profesor")
+def recording_stop_api():
+    data = request.get_json(silent=True) or {}
+    info = stop_camera_recording(_camera_index(data.get("camera")))
+    if info is None:
+        return jsonify({"success": False, "error": "No hay grabación en curso"}), 404
+    return jsonify({"success": True, "recording": info})
+
+@bp_core.route("/api/recordings")
+@roles_required("admin", "profesor")
+def recordings_api():
+    return jsonify({"success": True, "sessions": list_recorded_sessions(current_app.config["RECORDINGS_DIR"])})
+
+@bp_core.route("/api/recordings/<session_id>")
+@roles_required("admin", "profesor")
+def recording_detail_api(session_id):
+    manifest = load_manifest(current_app.config["RECORDINGS_DIR"], session_id)
+    if manifest is None:
+        return jsonify({"success": False, "error": "Sesión no encontrada"}), 404
+    for segment in manifest["segments"]:
+        segment["url"] = url_for("core.recording_file", session_id=session_id, filename=segment["file"])
+    return jsonify({"success": True, "session": manifest})
+
+@bp_core.route("/recordings/<session_id>/<path:filename>")
+@roles_required("admin", "profesor")
+def recording_file(session_id, filename):
+    if not valid_session_id(session_id):
+        abort(404)
+    # send_from_directory rechaza rutas fuera de la carpeta de la sesión
+    return send_from_directory(os.path.abspath(os.path.join(current_app.config["RECORDINGS_DIR"], session_id)),
+                               filename, conditional=True)
 
 @bp_core.route("/get_temperature")
 def get_temperature_api():
@@ -180,20 +301,29 @@ def get_temperature_api():
     except Exception as e:
         return jsonify({"temperature": 15.0, "error": str(e)})
 
-@bp_core.route("/api/camera/info")
-def camera_info_api():
+@bp_core.route("/api/camera/info", defaults={"camera": None})
+@bp_core.route("/api/camera/<int(signed=True):camera>/info")
+def camera_info_api(camera):
+    camera = request.args.get("camera", camera, type=int)
+    worker = _existing_worker(camera)
+    if worker is None:
+        return _unknown_camera(camera)
     try:
-        info = get_camera_info()
-        return jsonify({"success": True, "info": info})
+        info = get_camera_info(worker)
+        return jsonify({"success": True, "info": info, "cameras": list_camera_info()})
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
 @bp_core.route("/api/camera/test")
 def camera_test_api():
     try:
-        cameras = detect_cameras()
-        info = get_camera_info()
-        return jsonify({"success": True, "cameras_detected": cameras, "camera_info": info})
+        if request.args.get("refresh"):
+            refresh_cameras()
+        cameras = get_available_cameras()
+        worker = _existing_worker()
+        info = get_camera_info(worker) if worker is not None else None
+        return jsonify({"success": True, "cameras_detected": cameras, "camera_info": info,
+                        "registry": get_registry_info()})
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
@@ -205,16 +335,61 @@ def handle_connect():
     print("🔌 Cliente conectado a Socket.IO")
 
 @socketio.on("disconnect")
-def handle_disconnect():
+def handle_disconnect(*args):
+    unsubscribe_frames(request.sid)
     print("🚫 Cliente desconectado de Socket.IO")
 
+@socketio.on("join_camera")
+def handle_join_camera(data=None):
+    """El dashboard se une a la sala de su cámara para recibir emotion_update"""
+    camera = _camera_index((data or {}).get("camera"))
+    for idx, _ in list_camera_workers():
+        leave_room(camera_room(idx))
+    join_room(camera_room(camera))
+
+@socketio.on("subscribe_frames")
+def handle_subscribe_frames(data=None):
+    """
+    Modo opcional: recibir los frames como mensajes binarios "video_frame" por
+    esta misma conexión en lugar de /video_feed. El cliente debe confirmar
+    (ack) cada frame; mientras no lo haga no se le envían más.
+    """
+    def reject(error):
+        socketio.emit("frame_push_error", {"success": False, "error": error}, to=request.sid)
+
+    data = data if isinstance(data, dict) else {}
+    camera = _camera_index(data.get("camera"))
+    if _existing_worker(camera) is None:
+        return reject(f"Cámara {camera} no configurada")
+    try:
+        max_fps = max(1, min(int(data.get("max_fps", 15)), 30))
+    except (TypeError, ValueError):
+        return reject("max_fps debe ser un número entre 1 y 30")
+    variant = data.get("variant", "annotated")
+    if variant not in STREAM_VARIANTS:
+        return reject(f"variant debe ser una de {STREAM_VARIANTS}")
+    join_room(camera_room(camera))
+    subscribe_frames(request.sid, camera, max_fps, variant)
+    print(f"📡 Cliente {request.sid} recibe frames de cámara {camera} por Socket.IO ({max_fps} FPS máx.)")
+
+@socketio.on("unsubscribe_frames")
+def handle_unsubscribe_frames(data=None):
+    unsubscribe_frames(request.sid)
+
 @socketio.on("get_camera_info")
-def handle_get_camera_info():
+def handle_get_camera_info(data=None):
     try:
-        info = get_camera_info()
-        socketio.emit("camera_info_response", {"success": True, "info": info})
+        camera = _camera_index((data or {}).get("camera"))
+        worker = _existing_worker(camera)
+        if worker is None:
+            socketio.emit("camera_info_response", {"success": False, "error": f"Cámara {camera} no configurada"},
+                          to=request.sid)
+            return
+        info = get_camera_info(worker)
+        info["socket_frame_clients"] = get_push_info(info["camera_index"])
+        socketio.emit("camera_info_response", {"success": True, "info": info}, to=request.sid)
     except Exception as e:
-        socketio.emit("camera_info_response", {"success": False, "error": str(e)})
+        socketio.emit("camera_info_response", {"success": False, "error": str(e)}, to=request.sid)
 
 # ========================
 # Métricas
@@ -232,18 +407,21 @@ def on_emotion_update(face_count, dominant_emotion, confidence, emotion_distribu
 @bp_core.route("/debug/camera")
 def debug_camera():
     try:
-        info = get_camera_info()
-        cameras = detect_cameras()
+        worker = _existing_worker()
+        info = get_camera_info(worker) if worker is not None else None
+        cameras = get_available_cameras()
         return jsonify({
             "cameras_detected": cameras,
+            "camera_registry": get_registry_info(),
             "camera_state": info,
+            "cameras": list_camera_info(),
             "session_camera_configured": session.get('camera_configured', False),
             "session_academic_configured": session.get('academic_configured', False),
             "session_academic_config": session.get('academic_config', {}),
             "user_logged_in": session.get('logged_in', False),
             "thread_info": {
-                "camera_thread_alive": camera_thread.is_alive() if camera_thread else False,
-                "analysis_thread_alive": analysis_thread.is_alive() if analysis_thread else False
+                "camera_thread_alive": info["thread_alive"] if info else False,
+                "analysis_threads_alive": {idx: t.is_alive() for idx, t in analysis_threads.items()}
             }
         })
     except Exception as e:
@@ -4,6 +4,61 @@ class Config:
     SECRET_KEY = os.getenv("SECRET_KEY", "clave_secreta_analisis_emociones_2025")
     SOCKETIO_CORS_ALLOWED_ORIGINS = "*"
     CSV_DIR = os.getenv("CSV_DIR", "emociones")
+    CAMERA_PROBE_TTL = int(os.getenv("CAMERA_PROBE_TTL", "60"))
+    CAMERA_PROBE_MAX_INDEX = int(os.getenv("CAMERA_PROBE_MAX_INDEX", "10"))
+    # Fuentes sin cámara: "100=file:/clase.mp4?fps=15;101=dir:/frames?fps=0;102=synthetic:"
+    CAMERA_SOURCES = os.getenv("CAMERA_SOURCES", "")
+    # Frames reducidos generados en la captura (0 = usar resolución completa)
+    ANALYSIS_FRAME_WIDTH = int(os.getenv("ANALYSIS_FRAME_WIDTH", "640"))
+    PREVIEW_FRAME_WIDTH = int(os.getenv("PREVIEW_FRAME_WIDTH", "0"))
+    # Captura de baja latencia: descartar frames encolados en el driver (grab/retrieve)
+    CAPTURE_LOW_LATENCY = os.getenv("CAPTURE_LOW_LATENCY", "0").lower() in ("1", "true", "yes")
+    # Plazo máximo para abrir una cámara en segundo plano (la anterior sigue activa mientras tanto)
+    CAMERA_OPEN_TIMEOUT = float(os.getenv("CAMERA_OPEN_TIMEOUT", "10"))
+    # Filtro de cambios de escena antes de la inferencia (0 = desactivado)
+    MOTION_GATE_THRESHOLD = float(os.getenv("MOTION_GATE_THRESHOLD", "4.0"))
+    MOTION_GATE_MAX_SKIP = float(os.getenv("MOTION_GATE_MAX_SKIP", "5.0"))
+    # Motor de inferencia: "deepface" (TensorFlow) u "onnx" (ONNX Runtime en CPU con modelos exportados)
+    INFERENCE_ENGINE = os.getenv("INFERENCE_ENGINE", "deepface")
+    DEEPFACE_DETECTOR = os.getenv("DEEPFACE_DETECTOR", "opencv")
+    ONNX_EMOTION_MODEL = os.getenv("ONNX_EMOTION_MODEL", "modelos/emotion.onnx")
+    ONNX_GENDER_MODEL = os.getenv("ONNX_GENDER_MODEL", "modelos/gender.onnx")
+    ONNX_DETECTOR_MODEL = os.getenv("ONNX_DETECTOR_MODEL", "")  # YuNet; vacío = Haar de OpenCV
+    ONNX_THREADS = int(os.getenv("ONNX_THREADS", "0"))  # 0 = todos los núcleos
+    # Clasificación en lotes: caras por forward y espera para juntar cámaras (0 = solo simultáneas)
+    INFERENCE_BATCH_SIZE = int(os.getenv("INFERENCE_BATCH_SIZE", "32"))
+    INFERENCE_BATCH_WAIT_MS = float(os.getenv("INFERENCE_BATCH_WAIT_MS", "0"))
+    # Seguimiento de caras: el detector corre cada N ticks de análisis (0 = detectar siempre).
+    # Sin valor: 5 con ONNX y 0 con DeepFace (que solo alinea las caras al detectarlas)
+    FACE_TRACK_DETECT_EVERY = int(os.environ["FACE_TRACK_DETECT_EVERY"]) if os.getenv("FACE_TRACK_DETECT_EVERY") else None
+    FACE_TRACK_IOU = float(os.getenv("FACE_TRACK_IOU", "0.3"))
+    # Género por cara seguida: se reinfiere cada N segundos o si su confianza es baja (0 = siempre)
+    GENDER_REFRESH_SECONDS = float(os.getenv("GENDER_REFRESH_SECONDS", "60"))
+    GENDER_MIN_CONFIDENCE = float(os.getenv("GENDER_MIN_CONFIDENCE", "80"))
+    # Inferencia en procesos aparte (0 = hilo dentro del proceso web); frames por memoria compartida
+    INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "0"))
+    INFERENCE_SHM_SLOT_MB = float(os.getenv("INFERENCE_SHM_SLOT_MB", "8"))
+    INFERENCE_START_TIMEOUT = float(os.getenv("INFERENCE_START_TIMEOUT", "300"))  # Carga de modelos por proceso
+    # Precarga de modelos al iniciar: "background", "blocking" (antes de aceptar conexiones) u "off"
+    MODEL_PRELOAD = os.getenv("MODEL_PRELOAD", "background")
+    # Ritmo adaptativo del análisis (análisis por segundo, por cámara): la inferencia ocupa
+    # a lo sumo ANALYSIS_TARGET_LOAD del tiempo y se frena si la CPU supera ANALYSIS_CPU_CEILING %.
+    # Un ritmo 0 significa sin límite por ese lado
+    ANALYSIS_MIN_RATE = float(os.getenv("ANALYSIS_MIN_RATE", "0.5"))
+    ANALYSIS_MAX_RATE = float(os.getenv("ANALYSIS_MAX_RATE", "10"))
+    ANALYSIS_TARGET_LOAD = float(os.getenv("ANALYSIS_TARGET_LOAD", "0.5"))
+    ANALYSIS_CPU_CEILING = float(os.getenv("ANALYSIS_CPU_CEILING", "85"))
+    # Video por la conexión Socket.IO (mensajes binarios) en lugar de /video_feed.
+    # También se puede activar por vista con /dashboard?push=1
+    SOCKET_FRAME_PUSH = os.getenv("SOCKET_FRAME_PUSH", "0").lower() in ("1", "true", "yes")
+    SOCKET_FRAME_MAX_FPS = int(os.getenv("SOCKET_FRAME_MAX_FPS", "15"))
+    # Grabación de sesiones en segmentos (RECORD_SESSIONS=1 graba desde el dashboard)
+    RECORD_SESSIONS = os.getenv("RECORD_SESSIONS", "0").lower() in ("1", "true", "yes")
+    RECORDINGS_DIR = os.getenv("RECORDINGS_DIR", "grabaciones")
+    RECORDING_FPS = float(os.getenv("RECORDING_FPS", "15"))
+    RECORDING_SEGMENT_SECONDS = int(os.getenv("RECORDING_SEGMENT_SECONDS", "300"))
+    RECORDING_QUEUE_SIZE = int(os.getenv("RECORDING_QUEUE_SIZE", "64"))
+    RECORDING_FOURCC = os.getenv("RECORDING_FOURCC", "MJPG")
     DEBUG = False
     HOST = "0.0.0.0"
     PORT = 5001
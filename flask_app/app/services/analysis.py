@@ -1,18 +1,17 @@
 import os, csv, time, threading, random
 from datetime import datetime
 from ..extensions import socketio
-from .camera import camera_state, camera_lock
+from .camera import camera_room, frame_level, record_frame_age, publish_annotations
+from .annotation import annotation_faces
+from .motion import SceneChangeGate
+from .scheduler import AnalysisScheduler
+from .engines import get_engine, get_batcher, warm_up_engine
+from .tracking import FaceTracker, TrackAttributeCache
 from flask import current_app
 
 emotion_mapping = {"happy":"feliz","sad":"triste","angry":"enojado","neutral":"neutral","surprise":"sorpresa","fear":"miedo","disgust":"asco"}
 ordered_emotions_es = ["feliz","triste","enojado","neutral","sorpresa","miedo","asco"]
 
-try:
-    from deepface import DeepFace
-    DEEPFACE_AVAILABLE = True
-except ImportError:
-    DEEPFACE_AVAILABLE = False
-
 def get_temperature_valpo():
     return round(random.uniform(10.0, 25.0), 1)
 
@@ -33,28 +32,98 @@ def _group_cognitive_load(list_emotions):
         vals.append(max(0, min(100, s)))
     return round(sum(vals)/len(vals), 1)
 
-def analyze_faces_thread(academic_config):
-    last = 0; INTERVAL = 0.5; TH = 70.0
+def _scale_region(region, scale):
+    """Lleva una caja {x,y,w,h} del frame de análisis a resolución completa"""
+    if not region or scale == 1: return region
+    return {k: (int(round(v*scale)) if k in ("x","y","w","h") else v) for k,v in region.items()}
+
+def _rate_interval(rate):
+    """Intervalo (s) de un ritmo en análisis/s. 0 o negativo = sin límite (un análisis cada ~17 min)"""
+    return 1.0 / max(rate, 1e-3)
+
+def _detect_every(settings, engine):
+    """Ticks entre detecciones del tracker. Por defecto no se sigue con DeepFace: sus cajas
+    seguidas se clasificarían sin alinear y cambiarían las emociones guardadas"""
+    every = settings.get("FACE_TRACK_DETECT_EVERY")
+    if every is None:
+        every = 0 if engine.name.startswith("deepface") else 5
+    return every
+
+def analyze_faces_thread(academic_config, worker, settings=None):
+    settings = settings or current_app.config
+    last = 0; TH = 70.0
+    # Ritmo del análisis según la latencia medida de la inferencia y la CPU libre
+    scheduler = AnalysisScheduler(min_interval=_rate_interval(settings.get("ANALYSIS_MAX_RATE", 10.0)),
+                                  max_interval=_rate_interval(settings.get("ANALYSIS_MIN_RATE", 0.5)),
+                                  target_load=settings.get("ANALYSIS_TARGET_LOAD", 0.5),
+                                  cpu_ceiling=settings.get("ANALYSIS_CPU_CEILING", 85.0))
+    engine = get_engine(settings)  # DeepFace u ONNX Runtime según INFERENCE_ENGINE
+    batcher = get_batcher(settings)  # Caras de todas las cámaras en un forward por modelo (no con DeepFace)
+    # Entre detecciones las caras se siguen con flujo óptico y se clasifican directamente
+    every = _detect_every(settings, engine)
+    tracker = FaceTracker(detect_every=every, iou_threshold=settings.get("FACE_TRACK_IOU", 0.3)) if every > 0 else None
+    # El género de cada cara seguida se guarda y solo se reinfiere de vez en cuando
+    attrs = TrackAttributeCache(refresh_seconds=settings.get("GENDER_REFRESH_SECONDS", 60.0),
+                                min_confidence=settings.get("GENDER_MIN_CONFIDENCE", 80.0))
+    room = camera_room(worker.index); sent = {"last": {"face_count": 0}, "age": None, "faces": []}
+    def emit(data):
+        sent["last"] = data
+        socketio.emit("emotion_update", dict(data, camera=worker.index, frame_age_ms=sent["age"], **scheduler.info()), to=room)
+    # Escena casi estática: no llamar al modelo y reenviar el último resultado
+    gate = SceneChangeGate(threshold=settings.get("MOTION_GATE_THRESHOLD", 4.0),
+                           max_skip=settings.get("MOTION_GATE_MAX_SKIP", 5.0))
     date = datetime.now().strftime("%Y-%m-%d")
     fname = f"{date}_{_sanitize(academic_config.get('materia','SinAsignatura'))}_{_sanitize(academic_config.get('grado','SinCurso'))}.csv"
-    csv_dir = current_app.config["CSV_DIR"]; os.makedirs(csv_dir, exist_ok=True)
+    csv_dir = settings["CSV_DIR"]; os.makedirs(csv_dir, exist_ok=True)
     path = os.path.join(csv_dir, fname)
     header = ["fecha","hora","sexo","emocion","porcentaje","curso","grado","materia","temperatura"]
     if not os.path.exists(path):
         with open(path,"w",newline="",encoding="utf-8") as f: csv.writer(f).writerow(header)
 
+    last_seq = 0
     while True:
-        with camera_lock:
-            if not camera_state["is_running"]: break
-            frame = camera_state["current_frame"].copy() if camera_state["current_frame"] is not None and (time.time()-last>INTERVAL) else None
-            if frame is not None: last = time.time()
-        if frame is None: time.sleep(0.1); continue
+        with worker.lock:
+            if not worker.state["is_running"]: break
+        wait = last + scheduler.interval - time.time()
+        if wait > 0: time.sleep(wait); continue
+        # Bloquear hasta que la captura publique un frame nuevo (sin sondeo).
+        # Se espera el nivel de análisis, que se publica después del frame completo
+        if frame_level(worker, "analysis").wait(last_seq, timeout=0.5) <= last_seq: continue
+        previous, last = last, time.time()
 
         try:
-            if not DEEPFACE_AVAILABLE: continue
-            results = DeepFace.analyze(img_path=frame, actions=['emotion','gender'], enforce_detection=False, detector_backend='opencv')
+            # Espera la precarga si sigue en curso (o carga aquí si está desactivada)
+            if not warm_up_engine(settings): continue
+            # Vista de solo lectura del último slot: sin copia ni lock durante la inferencia.
+            # Se analiza la versión reducida generada por la captura (mismo seq)
+            with worker.ring.acquire(after_seq=last_seq) as (seq, full, captured_at), \
+                 frame_level(worker, "analysis").acquire() as (frame_seq, frame, _ts2):
+                if full is None: continue
+                # Reducido de otro frame (la captura avanzó entre ambos acquire): omitir sin gastar el tick
+                if frame is not None and frame_seq != seq: last = previous; continue
+                # Edad del frame al llegar al análisis (captura → consumidor)
+                sent["age"] = round(record_frame_age(worker, "analysis", captured_at), 1)
+                if frame is None: frame = full
+                last_seq = seq; width = full.shape[1]; scale = width / frame.shape[1]
+                changed = gate.should_analyze(frame)
+                if changed:
+                    started = time.time()
+                    if tracker is None: results = engine.analyze(frame, actions=('emotion','gender'))
+                    else:
+                        faces = tracker.update(frame, engine.detect)
+                        results = attrs.classify(batcher, frame, faces, time.time()) if faces else []
+                    scheduler.record(time.time() - started)
+            if not changed:
+                publish_annotations(worker, seq, sent["faces"], width)
+                emit(sent["last"]); continue
+            for face in results or []:
+                face['region'] = _scale_region(face.get('region'), scale)
+            # Cajas y emociones para el stream anotado (se dibujan una vez por frame)
+            detected = results if results and results[0].get('face_confidence',0) > 0 else []
+            sent["faces"] = annotation_faces(detected, emotion_mapping)
+            publish_annotations(worker, seq, sent["faces"], width)
             if not results or results[0].get('face_confidence',0) <= 0:
-                socketio.emit("emotion_update", {"face_count": 0}); continue
+                emit({"face_count": 0}); continue
 
             rows = []; ts = _now()
             for face in results:
@@ -71,7 +140,7 @@ def analyze_faces_thread(academic_config):
 
             high = [f for f in results if f.get('emotion',{}).get(f.get('dominant_emotion'),0)>=TH]
             if not high:
-                socketio.emit("emotion_update", {"face_count": 0}); continue
+                emit({"face_count": 0}); continue
 
             by_type = {e: [] for e in ordered_emotions_es}
             for f in high:
@@ -80,7 +149,7 @@ def analyze_faces_thread(academic_config):
             med = {e: sorted(v)[len(v)//2] for e,v in by_type.items() if v}
             dom = max(med, key=med.get, default="neutral"); conf = med.get(dom,0)
             load = _group_cognitive_load([f['emotion'] for f in high])
-            socketio.emit("emotion_update", {
+            emit({
                 "emotion": dom, "value": float(conf), "cognitive_load": float(load),
                 "emotion_values": {k: float(v) for k,v in med.items()}, "face_count": len(high)
             })
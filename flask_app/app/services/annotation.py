@@ -0,0 +1,61 @@
+import cv2
+
+# Colores BGR por emoción (los mismos del dashboard)
+EMOTION_COLORS = {
+    "feliz": (94, 197, 34),
+    "triste": (246, 130, 59),
+    "enojado": (68, 68, 239),
+    "neutral": (128, 114, 107),
+    "sorpresa": (11, 158, 245),
+    "miedo": (246, 92, 139),
+    "asco": (22, 204, 132)
+}
+DEFAULT_COLOR = (255, 255, 255)
+
+# Resultados más viejos que esto no se dibujan (el análisis se detuvo o falló)
+ANNOTATION_MAX_AGE = 3.0
+
+
+def annotation_faces(results, emotion_mapping):
+    """
+    Convierte la salida de DeepFace (regiones ya en resolución completa) en la
+    lista de caras a dibujar: [{"region", "emotion", "score", "gender"}]
+    """
+    faces = []
+    for face in results or []:
+        region = face.get("region") or {}
+        if not region.get("w") or not region.get("h"):
+            continue
+        dominant = face.get("dominant_emotion")
+        faces.append({
+            "region": {k: int(region.get(k, 0)) for k in ("x", "y", "w", "h")},
+            "emotion": emotion_mapping.get(dominant, dominant),
+            "score": float(face.get("emotion", {}).get(dominant, 0.0)),
+            "gender": face.get("dominant_gender")
+        })
+    return faces
+
+
+def draw_overlays(image, seq, faces=(), scale=1.0):
+    """
+    Dibuja sobre image (en su lugar) el contador de frame y, para cada cara,
+    su caja y la emoción dominante. scale lleva las regiones (en resolución
+    completa) al tamaño de image.
+    """
+    for face in faces:
+        r = face["region"]
+        x, y = int(r["x"] * scale), int(r["y"] * scale)
+        w, h = int(r["w"] * scale), int(r["h"] * scale)
+        color = EMOTION_COLORS.get(face.get("emotion"), DEFAULT_COLOR)
+        cv2.rectangle(image, (x, y), (x + w, y + h), color, 2)
+
+        label = f"{face.get('emotion') or '?'} {face.get('score', 0):.0f}%"
+        (tw, th), baseline = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1)
+        top = max(0, y - th - baseline - 4)
+        cv2.rectangle(image, (x, top), (x + tw + 6, top + th + baseline + 4), color, -1)
+        cv2.putText(image, label, (x + 3, top + th + 2),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+
+    cv2.putText(image, f"Frame: {seq}", (10, 30),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+    return image
@@ -0,0 +1,233 @@
+"""
+Benchmark de detectores y motores de inferencia sobre frames grabados.
+
+Ejecuta cada motor disponible (DeepFace con cada detector, ONNX, o clases
+propias "modulo:Clase") sobre los mismos frames y entrega un JSON con
+latencia por frame (percentiles), caras encontradas, memoria y acuerdo
+entre motores (caras coincidentes por IoU y misma emoción/género), para
+comparar corridas entre equipos y salas.
+
+    python -m app.services.benchmark grabaciones/frames --output bench.json
+    python -m app.services.benchmark clase.avi --engine deepface-opencv --engine onnx --limit 200
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import platform
+import argparse
+import multiprocessing as mp
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from ..config import Config
+from .engines import DeepFaceEngine, create_engine
+from .sources import ImageDirSource, VideoFileSource
+from .tracking import iou
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+logger = logging.getLogger(__name__)
+
+# Backends de detección de DeepFace a comparar (los que falten dependencias reportan error)
+DEEPFACE_DETECTORS = ("opencv", "ssd", "mtcnn", "retinaface", "yunet")
+PERCENTILES = (50, 90, 95, 99)
+
+
+def load_frames(path, width=0, limit=None):
+    """Frames de un directorio de imágenes o de un video, reducidos a width (0 = original)"""
+    source = (ImageDirSource(path, fps=0, loop=False) if os.path.isdir(path)
+              else VideoFileSource(path, fps=0, loop=False))
+    frames = []
+    try:
+        while limit is None or len(frames) < limit:
+            ok, frame = source.read()
+            if not ok:
+                break
+            if width and frame.shape[1] > width:
+                frame = cv2.resize(frame, (width, int(frame.shape[0] * width / frame.shape[1])),
+                                   interpolation=cv2.INTER_AREA)
+            frames.append(frame)
+    finally:
+        source.release()
+    return frames
+
+
+def _rss_mb():
+    return round(psutil.Process().memory_info().rss / (1024 * 1024), 1) if psutil is not None else None
+
+
+def _latency_summary(latencies):
+    if not latencies:
+        return None
+    values = np.asarray(latencies)
+    summary = {f"p{p}": round(float(np.percentile(values, p)), 2) for p in PERCENTILES}
+    summary.update(mean=round(float(values.mean()), 2), max=round(float(values.max()), 2))
+    return summary
+
+
+def benchmark_engine(settings, frames_path, width=0, limit=None):
+    """Carga un motor, lo ejercita y lo mide sobre todos los frames (pensado para un proceso propio)"""
+    frames = load_frames(frames_path, width, limit)
+    baseline = _rss_mb()
+    engine = create_engine(settings)
+    started = time.perf_counter()
+    engine.warm_up()
+    load_s = round(time.perf_counter() - started, 3)
+    after_load = peak = _rss_mb()
+
+    latencies, detections = [], []
+    for frame in frames:
+        started = time.perf_counter()
+        results = engine.analyze(frame, actions=("emotion", "gender"))
+        latencies.append((time.perf_counter() - started) * 1000.0)
+        detections.append([{"region": r["region"], "emotion": r.get("dominant_emotion"),
+                            "gender": r.get("dominant_gender")}
+                           for r in results or [] if r.get("face_confidence", 0) > 0])
+        if peak is not None:
+            peak = max(peak, _rss_mb())
+
+    counts = [len(faces) for faces in detections]
+    mean_ms = float(np.mean(latencies)) if latencies else 0.0
+    return {
+        "engine": engine.name,
+        "load_s": load_s,
+        "frames": len(frames),
+        "latency_ms": _latency_summary(latencies),
+        "fps": round(1000.0 / mean_ms, 2) if mean_ms else None,
+        "faces": {
+            "total": sum(counts),
+            "mean_per_frame": round(sum(counts) / len(counts), 2) if counts else 0.0,
+            "frames_with_faces": sum(1 for c in counts if c)
+        },
+        "memory_mb": {"baseline": baseline, "after_load": after_load, "peak": peak},
+        "detections": detections
+    }
+
+
+def agreement(frames_a, frames_b, iou_threshold=0.5):
+    """Acuerdo entre dos motores: caras emparejadas por IoU y coincidencia de emoción/género"""
+    matched = total_a = total_b = same_emotion = same_gender = 0
+    for faces_a, faces_b in zip(frames_a, frames_b):
+        total_a += len(faces_a)
+        total_b += len(faces_b)
+        pairs = sorted(((iou(a["region"], b["region"]), i, j)
+                        for i, a in enumerate(faces_a) for j, b in enumerate(faces_b)), reverse=True)
+        used_a, used_b = set(), set()
+        for score, i, j in pairs:
+            if score < iou_threshold:
+                break
+            if i in used_a or j in used_b:
+                continue
+            used_a.add(i)
+            used_b.add(j)
+            matched += 1
+            same_emotion += faces_a[i]["emotion"] == faces_b[j]["emotion"]
+            same_gender += faces_a[i]["gender"] == faces_b[j]["gender"]
+    return {
+        "matched_faces": matched,
+        "face_f1": round(2 * matched / (total_a + total_b), 3) if total_a + total_b else None,
+        "emotion_agreement": round(same_emotion / matched, 3) if matched else None,
+        "gender_agreement": round(same_gender / matched, 3) if matched else None
+    }
+
+
+def candidate_engines(settings, names=None):
+    """Configuración por motor a medir: todos los disponibles o los pedidos por nombre"""
+    base = dict(settings, INFERENCE_WORKERS=0)
+    candidates = {}
+    if DeepFaceEngine().available:
+        for detector in DEEPFACE_DETECTORS:
+            candidates[f"deepface-{detector}"] = dict(base, INFERENCE_ENGINE="deepface",
+                                                      DEEPFACE_DETECTOR=detector)
+    onnx = dict(base, INFERENCE_ENGINE="onnx")
+    if create_engine(onnx).available:
+        candidates["onnx"] = onnx
+    if not names:
+        return candidates
+    selected = {}
+    for name in names:
+        if name in candidates:
+            selected[name] = candidates[name]
+        elif ":" in name:
+            selected[name] = dict(base, INFERENCE_ENGINE=name)
+        else:
+            logger.warning(f"Motor no disponible, se omite: {name}")
+    return selected
+
+
+def run_benchmark(frames_path, settings=None, engines=None, width=0, limit=None,
+                  isolate=True, keep_detections=False):
+    """
+    Mide cada motor y calcula el acuerdo entre pares. Con isolate cada motor
+    corre en un proceso nuevo: la memoria reportada es solo la suya y las
+    bibliotecas de un motor no afectan a los demás.
+    """
+    settings = settings or {k: getattr(Config, k) for k in dir(Config) if k.isupper()}
+    reports = {}
+    for name, engine_settings in candidate_engines(settings, engines).items():
+        logger.info(f"⏱️ Midiendo {name}...")
+        try:
+            if isolate:
+                with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context("spawn")) as pool:
+                    reports[name] = pool.submit(benchmark_engine, engine_settings, frames_path,
+                                                width, limit).result()
+            else:
+                reports[name] = benchmark_engine(engine_settings, frames_path, width, limit)
+        except Exception as e:
+            logger.error(f"Error midiendo {name}: {e}")
+            reports[name] = {"error": str(e)}
+
+    measured = [n for n in reports if "detections" in reports[n]]
+    pairs = {f"{a} vs {b}": agreement(reports[a]["detections"], reports[b]["detections"])
+             for i, a in enumerate(measured) for b in measured[i + 1:]}
+    if not keep_detections:
+        for name in measured:
+            reports[name].pop("detections")
+
+    return {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "frames_path": os.path.abspath(frames_path),
+        "frame_width": width or None,
+        "host": {"platform": platform.platform(), "python": platform.python_version(),
+                 "cpu_count": os.cpu_count(), "opencv": cv2.__version__},
+        "engines": reports,
+        "agreement": pairs
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de detectores y motores de inferencia")
+    parser.add_argument("frames", help="Directorio de imágenes o archivo de video")
+    parser.add_argument("--engine", action="append", dest="engines",
+                        help="Motor a medir (deepface-opencv, onnx, modulo:Clase...); repetible. Por defecto, todos")
+    parser.add_argument("--width", type=int, default=Config.ANALYSIS_FRAME_WIDTH,
+                        help="Ancho al que se reducen los frames (0 = original)")
+    parser.add_argument("--limit", type=int, default=None, help="Máximo de frames")
+    parser.add_argument("--output", help="Archivo JSON de salida (por defecto, salida estándar)")
+    parser.add_argument("--in-process", action="store_true", help="No aislar cada motor en su propio proceso")
+    parser.add_argument("--detections", action="store_true", help="Incluir las caras detectadas por frame")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    report = run_benchmark(args.frames, engines=args.engines, width=args.width, limit=args.limit,
+                           isolate=not args.in_process, keep_detections=args.detections)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+        logger.info(f"📄 Resultados en {args.output}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,42 +1,307 @@
 import cv2
+import sys
 import time
 import threading
 import numpy as np
 import logging
+from .frame_buffer import FrameRing
+from .streaming import MjpegBroadcaster, placeholder_jpeg
+from .sources import open_replay_source
+from .telemetry import CaptureStats
+from .annotation import draw_overlays, ANNOTATION_MAX_AGE
+from .recorder import SessionRecorder
+from .engines import engine_status
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Estado de la cámara
-camera_state = {
-    "camera_object": None,
-    "current_frame": None,
-    "camera_index": -1,
-    "resolution": None,
-    "is_running": False,
-    "last_error": None,
-    "initialization_success": False
+# Ajustes de captura comunes a todas las cámaras (ver configure_capture)
+capture_settings = {
+    "analysis_width": 640,  # Ancho del frame para análisis (0 = resolución completa)
+    "preview_width": 0,     # Ancho del frame para streaming (0 = resolución completa)
+    "low_latency": False,   # grab() hasta el frame más nuevo y solo entonces retrieve()
+    "open_timeout": 10.0,   # Plazo máximo (s) para abrir una cámara en segundo plano
+    "open_retry_interval": 2.0  # Espera inicial (s) antes de reintentar una apertura fallida (se duplica hasta 30 s)
 }
 
-camera_lock = threading.Lock()
+# Variantes del stream: con overlays del análisis (cajas, emociones, contador) o limpia
+STREAM_VARIANTS = ("annotated", "clean")
 
-# Backends prioritarios para Windows
-_BACKENDS = [
-    cv2.CAP_MSMF,   # Windows Media Foundation (recomendado)
-    cv2.CAP_DSHOW,  # DirectShow (backup)
-    cv2.CAP_ANY     # Auto-detección como último recurso
-]
+def configure_capture(**settings):
+    """Actualiza capture_settings (debe llamarse desde Flask al iniciar)"""
+    for key, value in settings.items():
+        if key not in capture_settings:
+            raise KeyError(f"Ajuste de captura desconocido: {key}")
+        capture_settings[key] = value
+
+class CameraWorker:
+    """
+    Estado de captura de una cámara (un aula): estado, lock propio, buffer
+    circular de frames y un codificador MJPEG compartido por variante de stream.
+    """
+
+    def __init__(self, index, resolution=None, source=None):
+        self.index = index
+        self.state = {
+            "camera_object": None,
+            "camera_index": index,
+            "resolution": resolution,
+            "source": source,  # Fuente de reproducción (archivo, directorio, sintética)
+            "format": None,    # Backend, fourcc, resolución y FPS negociados
+            "frame_age_ms": {},         # Edad captura → consumidor (media móvil) por consumidor
+            "annotations": None,        # Último resultado del análisis a dibujar (ver publish_annotations)
+            "is_running": False,
+            "opening": False,  # Hay una apertura en segundo plano en curso
+            "openers": 0,      # Hilos de apertura vivos (incluye abandonados que aún no terminan)
+            "last_error": None,
+            "recording_error": None,  # Último error de escritura de la grabación (se soltó el grabador)
+            "initialization_success": False
+        }
+        self.lock = threading.Lock()
+        # Último frame capturado: buffer circular con slots reutilizables. Se lee
+        # sin el lock mediante ring.acquire() (vista de solo lectura, sin copia).
+        self.ring = FrameRing(slots=4)
+        # Versiones reducidas del mismo frame (mismo seq), generadas una sola vez
+        # en el hilo de captura: para análisis y para el stream
+        self.analysis_ring = FrameRing(slots=3)
+        self.preview_ring = FrameRing(slots=3)
+        # Buffer de salida de cada variante: solo lo usa su codificador
+        self.stream_scratch = {variant: {"buffer": None} for variant in STREAM_VARIANTS}
+        # Telemetría de captura: FPS real, lecturas fallidas/descartadas y latencia
+        self.stats = CaptureStats()
+        # Un único codificador JPEG por variante, compartido por todos sus clientes.
+        # Los overlays se dibujan una vez por frame en el de la variante "annotated"
+        self.broadcasters = {
+            variant: MjpegBroadcaster(lambda last_seq, v=variant: _render_stream_frame(self, last_seq, v),
+                                      fps=30, quality=85, name=f"MjpegEncoder-{index}-{variant}",
+                                      wait=lambda last_key, timeout: frame_level(self, "preview").wait(
+                                          last_key if isinstance(last_key, int) else 0, timeout))
+            for variant in STREAM_VARIANTS
+        }
+        # Grabación opcional de la sesión (SessionRecorder); la captura solo encola
+        self.recorder = None
+        # Despierta al hilo de captura cuando cambia la configuración o se detiene
+        self.wakeup = threading.Event()
+        self.thread = None
+
+# Workers de captura por índice de cámara
+camera_workers = {}
+camera_workers_lock = threading.Lock()
+
+def get_camera_worker(index, create=True):
+    """Devuelve el worker de la cámara index (lo crea sin iniciarlo si no existe)"""
+    with camera_workers_lock:
+        worker = camera_workers.get(index)
+        if worker is None and create:
+            worker = camera_workers[index] = CameraWorker(index)
+        return worker
+
+def list_camera_workers():
+    with camera_workers_lock:
+        return sorted(camera_workers.items())
+
+def register_camera_source(index, source):
+    """
+    Asocia una fuente de reproducción (ver sources.open_replay_source) al
+    índice de cámara index. Se usa igual que una cámara real: /video_feed/<index>,
+    análisis, etc. Conviene usar índices altos (p.ej. 100+) para no chocar con
+    dispositivos reales.
+    """
+    worker = get_camera_worker(index)
+    with worker.lock:
+        worker.state["source"] = source
+    worker.wakeup.set()
+    logger.info(f"🎞️ Cámara {index} asociada a la fuente {source}")
+    return worker
+
+def camera_sources():
+    """Índices de cámara con fuente de reproducción configurada"""
+    sources = {}
+    for idx, worker in list_camera_workers():
+        with worker.lock:
+            if worker.state["source"]:
+                sources[idx] = worker.state["source"]
+    return sources
+
+def frame_level(worker, level):
+    """
+    Buffer a usar para un nivel ("analysis" o "preview"): el reducido si la
+    captura lo está generando, o el de resolución completa si no.
+    """
+    ring = worker.analysis_ring if level == "analysis" else worker.preview_ring
+    return ring if ring.has_frame() else worker.ring
+
+def _publish_pyramid(worker, frame, seq, timestamp=None):
+    """
+    Genera los frames reducidos de análisis/preview del frame completo ya
+    publicado con seq (los consumidores esperan en el nivel que leen)
+    """
+    for ring, width in ((worker.analysis_ring, capture_settings["analysis_width"]),
+                        (worker.preview_ring, capture_settings["preview_width"])):
+        if width and frame.shape[1] > width:
+            ring.publish_resized(frame, width, timestamp=timestamp, seq=seq)
+        elif ring.has_frame():
+            ring.clear()
+
+def record_frame_age(worker, consumer, timestamp):
+    """
+    Registra cuánto tardó un frame desde su captura hasta llegar a un
+    consumidor ("analysis", "stream", ...). Devuelve la edad en ms.
+    """
+    age_ms = max(0.0, (time.time() - timestamp) * 1000.0)
+    with worker.lock:
+        ages = worker.state["frame_age_ms"]
+        prev = ages.get(consumer)
+        ages[consumer] = round(age_ms if prev is None else prev * 0.8 + age_ms * 0.2, 1)
+    return age_ms
+
+def _grab_latest(cap, max_drain=5, buffered_threshold=0.005):
+    """
+    Modo baja latencia: grab() sin decodificar hasta alcanzar el frame más
+    nuevo. Un grab() que vuelve al instante entregó un frame que ya estaba
+    encolado en el driver (viejo), así que se sigue; el que bloquea es el
+    frame en vivo. Devuelve (ok, frames_descartados, instante_de_captura).
+    """
+    grabbed, stamp = -1, None
+    while grabbed < max_drain:
+        start = time.perf_counter()
+        if not cap.grab():
+            break
+        stamp = time.time()
+        grabbed += 1
+        if time.perf_counter() - start > buffered_threshold:
+            break
+    return grabbed >= 0, max(grabbed, 0), stamp
+
+def publish_annotations(worker, seq, faces, frame_width):
+    """
+    Publica el último resultado del análisis para el stream anotado.
+    faces: [{"region": {x,y,w,h}, "emotion", "score", "gender"}] en
+    coordenadas de un frame de frame_width píxeles de ancho.
+    """
+    with worker.lock:
+        worker.state["annotations"] = {"seq": seq, "faces": list(faces), "frame_width": frame_width,
+                                       "updated_at": time.time()}
+
+def stream_broadcaster(worker, variant="annotated"):
+    """Codificador MJPEG de la variante pedida ("annotated" o "clean")"""
+    if variant not in worker.broadcasters:
+        raise ValueError(f"Variante de stream desconocida: {variant}")
+    return worker.broadcasters[variant]
+
+def _clear_frames(worker):
+    for ring in (worker.ring, worker.analysis_ring, worker.preview_ring):
+        ring.clear()
+
+def camera_room(index):
+    """Sala de Socket.IO de una cámara (los dashboards de esa aula)"""
+    return f"camera_{index}"
+
+def cameras_in_use():
+    """
+    Índices con un dispositivo abierto por su hilo de captura o que se está
+    abriendo en segundo plano (probarlo a la vez puede quitarle el dispositivo
+    a la apertura o hacerla fallar)
+    """
+    in_use = []
+    for idx, worker in list_camera_workers():
+        with worker.lock:
+            if worker.state["camera_object"] is not None or worker.state["opening"] or worker.state["openers"]:
+                in_use.append(idx)
+    return in_use
+
+def _platform_backends(platform=None):
+    """Backends prioritarios según el sistema operativo"""
+    platform = platform or sys.platform
+    if platform.startswith("win"):
+        return [
+            cv2.CAP_MSMF,   # Windows Media Foundation (recomendado)
+            cv2.CAP_DSHOW,  # DirectShow (backup)
+            cv2.CAP_ANY     # Auto-detección como último recurso
+        ]
+    if platform.startswith("linux"):
+        return [
+            cv2.CAP_V4L2,   # Video4Linux2 (permite negociar MJPG)
+            cv2.CAP_ANY
+        ]
+    if platform == "darwin":
+        return [cv2.CAP_AVFOUNDATION, cv2.CAP_ANY]
+    return [cv2.CAP_ANY]
+
+_BACKENDS = _platform_backends()
+
+# Formatos de píxel en orden de preferencia. MJPG llega comprimido desde la
+# cámara y permite 720p/1080p a 30 FPS en USB 2.0; YUYV sin comprimir no.
+_FOURCC_PREFERENCE = ("MJPG", "YUYV")
+
+# Formato negociado por (índice, backend, resolución) para no volver a probar al reabrir
+_format_cache = {}
 
 def _get_backend_name(backend):
     """Obtiene el nombre legible del backend"""
     backend_names = {
         cv2.CAP_MSMF: "MSMF",
         cv2.CAP_DSHOW: "DSHOW",
+        cv2.CAP_V4L2: "V4L2",
+        cv2.CAP_AVFOUNDATION: "AVFOUNDATION",
         cv2.CAP_ANY: "AUTO"
     }
     return backend_names.get(backend, f"UNKNOWN_{backend}")
 
+def _fourcc_to_str(value):
+    """Convierte el entero CAP_PROP_FOURCC a texto (p.ej. "MJPG")"""
+    value = int(value or 0)
+    if value <= 0:
+        return None
+    return "".join(chr((value >> (8 * i)) & 0xFF) for i in range(4)).strip("\x00 ") or None
+
+def _apply_format(cap, fourcc, width, height, fps):
+    """Aplica formato, resolución y FPS (en ese orden, como exige V4L2) y lee lo obtenido"""
+    if fourcc:
+        cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc))
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+    cap.set(cv2.CAP_PROP_FPS, fps)
+    return {
+        "fourcc": _fourcc_to_str(cap.get(cv2.CAP_PROP_FOURCC)),
+        "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        "fps": round(float(cap.get(cv2.CAP_PROP_FPS) or 0), 2)
+    }
+
+def _negotiate_format(cap, index, backend, width, height, fps=30):
+    """
+    Prueba los formatos de _FOURCC_PREFERENCE para la resolución pedida y se
+    queda con el primero que el driver acepta con la resolución y FPS
+    completos; si ninguno llega a los FPS pedidos, el de más FPS.
+    """
+    key = (index, backend, width, height)
+    cached = _format_cache.get(key)
+    if cached:
+        return _apply_format(cap, cached["fourcc"], width, height, fps)
+    
+    best = None
+    for fourcc in _FOURCC_PREFERENCE:
+        got = _apply_format(cap, fourcc, width, height, fps)
+        logger.info(f"  - Formato {fourcc} @ {width}x{height}: {got}")
+        if got["fourcc"] != fourcc or (got["width"], got["height"]) != (width, height):
+            continue
+        if got["fps"] >= fps:
+            best = got
+            break
+        if best is None or got["fps"] > best["fps"]:
+            best = got
+    
+    if best is None:
+        # El driver no reporta/acepta formatos: dejar el que elija
+        best = _apply_format(cap, None, width, height, fps)
+    elif best["fourcc"] != _fourcc_to_str(cap.get(cv2.CAP_PROP_FOURCC)):
+        best = _apply_format(cap, best["fourcc"], width, height, fps)
+    
+    _format_cache[key] = best
+    return best
+
 def _try_open_camera(index, backend, test_read=True):
     """
     Intenta abrir una cámara con un backend específico
@@ -82,15 +347,20 @@ def _try_open_camera(index, backend, test_read=True):
                 pass
         return None
 
-def detect_cameras(max_idx=10):
+def detect_cameras(max_idx=10, in_use=()):
     """
     Detecta cámaras disponibles de forma más robusta
     Devuelve lista de índices de cámaras funcionales
+    Los índices en in_use (abiertos por el hilo de captura) no se prueban.
     """
     logger.info(f"Detectando cámaras disponibles (máximo índice: {max_idx})")
     detected_cameras = []
     
     for i in range(max_idx):
+        if i in in_use:
+            detected_cameras.append(i)
+            continue
+        
         for backend in _BACKENDS:
             cap = _try_open_camera(i, backend, test_read=True)
             if cap:
@@ -123,45 +393,49 @@ def _parse_resolution(resolution_str):
     
     return 640, 480  # Fallback
 
-def _open_camera(index, resolution):
+def _open_camera(index, resolution, source=None):
     """
-    Abre una cámara con configuración específica
+    Abre una cámara (o una fuente de reproducción) con configuración específica.
+    No modifica el estado del worker: devuelve (cap, formato, error) y es el
+    hilo de captura quien decide cuándo hacer el cambio.
     """
     logger.info(f"Intentando abrir cámara índice {index} con resolución {resolution}")
     
-    # Limpiar error anterior
-    with camera_lock:
-        camera_state["last_error"] = None
-    
     width, height = _parse_resolution(resolution)
     logger.info(f"Resolución parseada: {width}x{height}")
     
+    # Fuente de reproducción en lugar de dispositivo
+    if source:
+        cap = open_replay_source(source, width, height)
+        if cap is None:
+            return None, None, f"No se pudo abrir la fuente {source}"
+        return cap, {"backend": "REPLAY", "fourcc": None,
+                     "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                     "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                     "fps": cap.fps}, None
+    
     # Intentar con cada backend
     for backend in _BACKENDS:
         cap = _try_open_camera(index, backend, test_read=False)
         if cap:
             try:
-                # Configurar resolución
-                cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
-                cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
-                cap.set(cv2.CAP_PROP_FPS, 30)
-                
-                # Verificar resolución actual
-                actual_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-                actual_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-                actual_fps = int(cap.get(cv2.CAP_PROP_FPS))
+                # Negociar formato de píxel, resolución y FPS
+                fmt = _negotiate_format(cap, index, backend, width, height, 30)
                 
                 logger.info(f"Configuración aplicada:")
-                logger.info(f"  - Resolución: {width}x{height} → {actual_width}x{actual_height}")
-                logger.info(f"  - FPS: 30 → {actual_fps}")
+                logger.info(f"  - Resolución: {width}x{height} → {fmt['width']}x{fmt['height']}")
+                logger.info(f"  - FPS: 30 → {fmt['fps']}")
+                logger.info(f"  - Formato: {fmt['fourcc']}")
                 
-                # Probar leer un frame
+                # En modo baja latencia pedir al driver la cola mínima (V4L2 lo respeta)
+                if capture_settings["low_latency"]:
+                    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+                
+                # Probar leer un frame: la cámara solo se usa si entrega un frame válido
                 ret, frame = cap.read()
                 if ret and frame is not None:
                     logger.info(f"✅ Cámara {index} configurada exitosamente")
-                    with camera_lock:
-                        camera_state["initialization_success"] = True
-                    return cap
+                    return cap, dict(fmt, backend=_get_backend_name(backend)), None
                 else:
                     logger.warning(f"Cámara {index} configurada pero no puede leer frames")
             
@@ -173,206 +447,448 @@ def _open_camera(index, resolution):
     # Si llegamos aquí, falló la apertura
     error_msg = f"No se pudo abrir cámara índice {index} con ningún backend"
     logger.error(error_msg)
-    with camera_lock:
-        camera_state["last_error"] = error_msg
-        camera_state["initialization_success"] = False
-    
-    return None
+    return None, None, error_msg
+
+class _CameraOpener:
+    """
+    Apertura de una cámara en segundo plano con plazo máximo.
+
+    cv2.VideoCapture no se puede cancelar: si se vence el plazo la apertura
+    se abandona y el dispositivo se libera apenas termine de abrirse. El hilo
+    de captura consulta poll() sin bloquear y sigue sirviendo la cámara
+    anterior mientras tanto.
+    """
+
+    def __init__(self, worker, resolution, timeout, exclusive=False):
+        self.resolution = resolution
+        self.exclusive = exclusive  # Se abrió tras cerrar la cámara anterior
+        self.timed_out = False      # Abandonada por plazo: el dispositivo puede seguir tomado
+        self.deadline = time.time() + timeout
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._result = (None, None, None)
+        self._abandoned = False
+        with worker.lock:
+            index, source = worker.state["camera_index"], worker.state["source"]
+            worker.state["openers"] += 1  # Antes de arrancar: el registro no debe probar el dispositivo
+        self._thread = threading.Thread(target=self._run, args=(worker, index, source),
+                                        daemon=True, name=f"CameraOpener-{index}")
+        self._thread.start()
+
+    def _run(self, worker, index, source):
+        try:
+            try:
+                result = _open_camera(index, self.resolution, source)
+            except Exception as e:
+                result = (None, None, f"Error abriendo cámara {index}: {e}")
+            with self._lock:
+                if self._abandoned:
+                    if result[0] is not None:
+                        result[0].release()
+                    return
+                self._result = result
+                self._done.set()
+        finally:
+            with worker.lock:
+                worker.state["openers"] -= 1
+        worker.wakeup.set()  # Avisar al hilo de captura
+
+    def poll(self):
+        """
+        (terminado, cap, formato, error) sin bloquear. Vencido el plazo se
+        abandona la apertura y se informa como error.
+        """
+        if self._done.is_set():
+            return (True,) + self._result
+        if time.time() >= self.deadline:
+            self.abandon()
+            if self._done.is_set():  # Terminó justo a tiempo
+                return (True,) + self._result
+            self.timed_out = True
+            return True, None, None, f"Tiempo de apertura agotado ({self.resolution})"
+        return False, None, None, None
+
+    def abandon(self):
+        with self._lock:
+            if self._done.is_set():
+                return
+            self._abandoned = True
+
+def _swap_camera(worker, cap, fmt):
+    """Reemplaza la cámara en uso por cap (ya validada) y libera la anterior"""
+    with worker.lock:
+        old = worker.state["camera_object"]
+        worker.state["camera_object"] = cap
+        worker.state["format"] = fmt
+        worker.state["initialization_success"] = True
+        worker.state["last_error"] = None
+    if old is not None and old is not cap:
+        old.release()
+    worker.stats.reset()
 
-def camera_thread_func():
+def _drop_failed_recorder(worker, recorder):
+    """Suelta un grabador que murió por un error de escritura (el dashboard inicia otro)"""
+    with worker.lock:
+        if worker.recorder is not recorder or recorder.last_error is None:
+            return  # Ya reemplazado, o detenido a propósito por stop_camera_recording
+        worker.recorder = None
+        worker.state["recording_error"] = recorder.last_error
+    logger.error(f"⏺️ Grabación de cámara {worker.index} detenida por error: {recorder.last_error}")
+
+def _release_camera(worker):
+    with worker.lock:
+        cap, worker.state["camera_object"] = worker.state["camera_object"], None
+    if cap is not None:
+        cap.release()
+
+def camera_thread_func(worker):
     """
-    Función principal del hilo de captura de cámara
+    Función principal del hilo de captura de una cámara
     """
-    logger.info("🎥 Iniciando hilo de captura de cámara")
+    logger.info(f"🎥 Iniciando hilo de captura de cámara {worker.index}")
     
     last_idx = -1
     last_res = ""
     consecutive_failures = 0
     max_consecutive_failures = 30  # ~1 segundo a 30fps
+    opener = None      # Apertura en segundo plano en curso (_CameraOpener)
+    retry_at = None    # Cuándo reintentar abrir si no hay cámara
+    retry_delay = capture_settings["open_retry_interval"]
     
     while True:
         try:
-            with camera_lock:
-                if not camera_state["is_running"]:
-                    logger.info("🛑 Deteniendo hilo de cámara")
-                    if camera_state["camera_object"]:
-                        camera_state["camera_object"].release()
-                        camera_state["camera_object"] = None
-                    break
-                
-                current_idx = camera_state["camera_index"]
-                current_res = camera_state["resolution"]
+            with worker.lock:
+                running = worker.state["is_running"]
+                current_idx = worker.state["camera_index"]
+                current_res = worker.state["resolution"]
+                has_camera = worker.state["camera_object"] is not None
+            
+            if not running:
+                logger.info("🛑 Deteniendo hilo de cámara")
+                if opener:
+                    opener.abandon()
+                _release_camera(worker)
+                with worker.lock:
+                    worker.state["opening"] = False
+                break
             
-            # Reabrir cámara si cambió la configuración
+            # Cambio de configuración: abrir la nueva en segundo plano. La cámara
+            # anterior sigue entregando frames hasta que la nueva entregue uno válido.
+            # El índice de un worker es fijo: otra cámara es otro worker (switch_camera_worker)
             if current_idx != last_idx or current_res != last_res:
                 logger.info(f"Cambio de configuración detectado: {current_idx}, {current_res}")
-                
-                # Cerrar cámara anterior
-                with camera_lock:
-                    if camera_state["camera_object"]:
-                        camera_state["camera_object"].release()
-                        camera_state["camera_object"] = None
-                
-                # Abrir nueva cámara
+                if opener:
+                    opener.abandon()
+                opener = None
                 if current_idx >= 0:
-                    new_camera = _open_camera(current_idx, current_res)
-                    with camera_lock:
-                        camera_state["camera_object"] = new_camera
-                
+                    opener = _CameraOpener(worker, current_res, capture_settings["open_timeout"],
+                                           exclusive=not has_camera)
                 last_idx = current_idx
                 last_res = current_res
                 consecutive_failures = 0
+                retry_at, retry_delay = None, capture_settings["open_retry_interval"]
+            elif opener is None and current_idx >= 0 and retry_at is not None and time.time() >= retry_at:
+                # Apertura fallida o vencida, o cámara cerrada por fallos: reintentar (en paralelo
+                # si la cámara anterior sigue entregando frames)
+                opener = _CameraOpener(worker, current_res, capture_settings["open_timeout"],
+                                       exclusive=not has_camera)
+            
+            if opener:
+                done, new_cap, fmt, error = opener.poll()
+                if done:
+                    opener_was_exclusive, timed_out, opener = opener.exclusive, opener.timed_out, None
+                    if new_cap is not None:
+                        logger.info(f"🔀 Cámara {worker.index} lista, cambiando al nuevo dispositivo")
+                        _swap_camera(worker, new_cap, fmt)
+                        retry_at, retry_delay = None, capture_settings["open_retry_interval"]
+                    elif not opener_was_exclusive and not timed_out:
+                        # El driver puede rechazar un segundo handle del mismo dispositivo:
+                        # cerrar el anterior y abrir de nuevo. No tras un plazo vencido: la
+                        # apertura abandonada puede seguir teniendo el dispositivo
+                        logger.warning(f"No se pudo abrir en paralelo ({error}); cerrando la cámara anterior")
+                        _release_camera(worker)
+                        _clear_frames(worker)
+                        opener = _CameraOpener(worker, current_res, capture_settings["open_timeout"],
+                                               exclusive=True)
+                    else:
+                        logger.error(error)
+                        with worker.lock:
+                            worker.state["last_error"] = error
+                            if not has_camera:
+                                worker.state["initialization_success"] = False
+                        retry_at = time.time() + retry_delay
+                        retry_delay = min(retry_delay * 2, 30.0)
+                with worker.lock:
+                    worker.state["opening"] = opener is not None
             
             # Capturar frame
-            with camera_lock:
-                cap = camera_state["camera_object"]
+            with worker.lock:
+                cap = worker.state["camera_object"]
             
             if cap and cap.isOpened():
                 try:
-                    ret, frame = cap.read()
+                    # Leer directamente sobre un slot libre del buffer circular
+                    slot_idx, slot = worker.ring.claim()
+                    read_start = time.perf_counter()
+                    stale = 0
+                    if capture_settings["low_latency"]:
+                        ret, stale, stamp = _grab_latest(cap)
+                        frame = None
+                        if ret:
+                            ret, frame = cap.retrieve(slot) if slot is not None else cap.retrieve()
+                    else:
+                        ret, frame = cap.read(slot) if slot is not None else cap.read()
+                        stamp = time.time()
+                    read_latency = time.perf_counter() - read_start
                     if ret and frame is not None:
-                        with camera_lock:
-                            camera_state["current_frame"] = frame.copy()
+                        worker.stats.record_frame(read_latency, dropped=slot_idx < 0, stale=stale)
+                        seq = worker.ring.commit(slot_idx, frame, timestamp=stamp)
+                        if slot_idx >= 0:  # Sin slot libre el frame se descarta: no hay niveles que publicar
+                            _publish_pyramid(worker, frame, seq, stamp)
+                        recorder = worker.recorder
+                        if recorder is not None:
+                            if recorder.running:
+                                recorder.submit(frame, stamp)  # Nunca bloquea: descarta si el disco no da abasto
+                            else:
+                                _drop_failed_recorder(worker, recorder)
                         consecutive_failures = 0
                     else:
+                        worker.stats.record_failure(read_latency)
                         consecutive_failures += 1
                         logger.warning(f"Fallo leyendo frame (fallos consecutivos: {consecutive_failures})")
                         
-                        with camera_lock:
-                            camera_state["current_frame"] = None
-                        
-                        # Si hay muchos fallos consecutivos, intentar reabrir
-                        if consecutive_failures >= max_consecutive_failures:
-                            logger.error("Demasiados fallos consecutivos, reabriendo cámara")
-                            cap.release()
-                            with camera_lock:
-                                camera_state["camera_object"] = None
-                            consecutive_failures = 0
+                        _clear_frames(worker)
+                        time.sleep(1/30.0)  # Espaciar reintentos (~1 segundo en total)
                 
                 except Exception as e:
                     logger.error(f"Error capturando frame: {e}")
+                    worker.stats.record_failure()
                     consecutive_failures += 1
-                    with camera_lock:
-                        camera_state["current_frame"] = None
+                    _clear_frames(worker)
+                    time.sleep(1/30.0)
+                
+                # Si hay muchos fallos consecutivos, cerrar y reabrir la cámara
+                if consecutive_failures >= max_consecutive_failures:
+                    logger.error("Demasiados fallos consecutivos, reabriendo cámara")
+                    _release_camera(worker)
+                    consecutive_failures = 0
+                    retry_at = time.time()
             else:
-                # No hay cámara o no está abierta
-                with camera_lock:
-                    camera_state["current_frame"] = None
+                # No hay cámara o no está abierta: esperar la apertura o un cambio de configuración
+                _clear_frames(worker)
+                worker.wakeup.wait(0.5)
+                worker.wakeup.clear()
         
         except Exception as e:
             logger.error(f"Error en hilo de cámara: {e}")
             time.sleep(0.1)  # Pausa en caso de error
             continue
         
-        # Frame rate control
-        time.sleep(1/30.0)  # ~30 FPS
+        # Sin pausa fija: cap.read() bloquea hasta que el driver (o la fuente
+        # de reproducción) entrega el siguiente frame
 
-def generate_frames():
+def _render_stream_frame(worker, last_seq, variant="annotated"):
     """
-    Generador de frames para el stream MJPEG
+    Prepara la imagen a codificar para el stream MJPEG compartido de una
+    variante. Devuelve (seq, imagen); imagen None si no hay frame nuevo desde
+    last_seq. En la variante "annotated" los overlays se dibujan aquí, una
+    sola vez por frame, a partir del último resultado del análisis.
+    Sin frame se devuelve el JPEG ya codificado del mensaje correspondiente
+    (clave = mensaje), que se publica una sola vez mientras no cambie.
     """
-    logger.info("🎬 Iniciando generador de frames MJPEG")
-    
-    frame_count = 0
-    
-    while True:
-        try:
-            with camera_lock:
-                if not camera_state["is_running"]:
-                    logger.info("🛑 Deteniendo generador de frames")
-                    break
-                
-                current_frame = camera_state["current_frame"]
-                last_error = camera_state["last_error"]
-            
-            frame_count += 1
-            
-            # Crear frame de salida
+    try:
+        with worker.lock:
+            last_error = worker.state["last_error"]
+            opening = worker.state["opening"]
+            annotations = worker.state["annotations"]
+        
+        scratch_state = worker.stream_scratch[variant]
+        
+        # Crear frame de salida
+        with frame_level(worker, "preview").acquire() as (seq, current_frame, captured_at):
             if current_frame is not None:
-                # Frame real de la cámara
-                output_frame = current_frame.copy()
-                
-                # Agregar información de debug (opcional)
-                cv2.putText(output_frame, f"Frame: {frame_count}", (10, 30), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-                
-            else:
-                # Frame negro con mensaje de error
-                output_frame = np.zeros((480, 640, 3), dtype=np.uint8)
-                
-                # Agregar mensaje de error
-                if last_error:
-                    lines = [
-                        "Error de camara:",
-                        last_error[:50],  # Truncar mensaje largo
-                        f"Frame: {frame_count}"
-                    ]
-                else:
-                    lines = [
-                        "Camara no configurada",
-                        "Configure la camara primero",
-                        f"Frame: {frame_count}"
-                    ]
-                
-                for i, line in enumerate(lines):
-                    y_pos = 150 + (i * 40)
-                    cv2.putText(output_frame, line, (50, y_pos), 
-                               cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
-            
-            # Codificar como JPEG
-            ret, buffer = cv2.imencode('.jpg', output_frame, 
-                                     [cv2.IMWRITE_JPEG_QUALITY, 85])
-            
-            if ret:
-                yield (b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
-                       + buffer.tobytes() + b'\r\n')
-            else:
-                logger.error("Error codificando frame como JPEG")
+                if seq == last_seq:
+                    return seq, None
+                record_frame_age(worker, "stream", captured_at)
+                # Frame real de la cámara (el slot es de solo lectura)
+                scratch = scratch_state["buffer"]
+                if scratch is None or scratch.shape != current_frame.shape:
+                    scratch = scratch_state["buffer"] = np.empty_like(current_frame)
+                np.copyto(scratch, current_frame)
         
-        except Exception as e:
-            logger.error(f"Error en generador de frames: {e}")
-            # Generar frame de error
-            error_frame = np.zeros((480, 640, 3), dtype=np.uint8)
-            cv2.putText(error_frame, f"Error: {str(e)[:30]}", (50, 240), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
-            
-            ret, buffer = cv2.imencode('.jpg', error_frame)
-            if ret:
-                yield (b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
-                       + buffer.tobytes() + b'\r\n')
+        if current_frame is not None:
+            if variant == "annotated":
+                # Resultados recientes del análisis (en resolución completa)
+                faces, scale = (), 1.0
+                if annotations and time.time() - annotations["updated_at"] <= ANNOTATION_MAX_AGE:
+                    faces = annotations["faces"]
+                    scale = scratch.shape[1] / annotations["frame_width"]
+                draw_overlays(scratch, seq, faces, scale)
+            return seq, scratch
         
-        time.sleep(0.033)  # ~30 FPS
+        # Sin frame: mensaje de error o de cámara no configurada
+        if opening:
+            lines = ("Abriendo camara...",)
+        elif last_error:
+            lines = ("Error de camara:", last_error[:50])  # Truncar mensaje largo
+        else:
+            lines = ("Camara no configurada", "Configure la camara primero")
+        key = ("placeholder",) + lines
+        return key, (None if last_seq == key else placeholder_jpeg(lines))
+    
+    except Exception as e:
+        logger.error(f"Error en generador de frames: {e}")
+        lines = (f"Error: {str(e)[:30]}",)
+        key = ("error",) + lines
+        return key, (None if last_seq == key else placeholder_jpeg(lines, color=(0, 0, 255)))
+
+def _stream_active(worker):
+    with worker.lock:
+        return worker.state["is_running"]
 
-def get_camera_info():
+def generate_frames(worker, variant="annotated"):
     """
-    Obtiene información del estado actual de la cámara
+    Generador de frames para el stream MJPEG (un cliente).
+    Solo reparte los bytes ya codificados por el codificador de la variante.
     """
-    with camera_lock:
+    broadcaster = stream_broadcaster(worker, variant)
+    logger.info(f"🎬 Iniciando generador de frames MJPEG (cámara {worker.index}, {variant})")
+    yield from broadcaster.frames(lambda: _stream_active(worker))
+    logger.info("🛑 Deteniendo generador de frames")
+
+# Distingue los ETag de snapshots entre reinicios del servidor (los seq vuelven a 1)
+_SNAPSHOT_EPOCH = format(int(time.time()), "x")
+
+def get_snapshot(worker, max_width=None, variant="annotated"):
+    """
+    Último frame codificado de una cámara como (etag, jpeg_bytes). Reutiliza
+    el JPEG del stream MJPEG; el ETag cambia solo cuando cambia la imagen.
+    """
+    seq, jpeg = stream_broadcaster(worker, variant).snapshot(max_width)
+    return f"{worker.index}-{variant}-{_SNAPSHOT_EPOCH}-{seq}-{max_width or 0}", jpeg
+
+def get_camera_info(worker):
+    """
+    Obtiene información del estado actual de una cámara
+    """
+    with worker.lock:
         return {
-            "is_running": camera_state["is_running"],
-            "camera_index": camera_state["camera_index"],
-            "resolution": camera_state["resolution"],
-            "has_camera_object": camera_state["camera_object"] is not None,
-            "has_current_frame": camera_state["current_frame"] is not None,
-            "last_error": camera_state["last_error"],
-            "initialization_success": camera_state["initialization_success"]
+            "is_running": worker.state["is_running"],
+            "camera_index": worker.state["camera_index"],
+            "resolution": worker.state["resolution"],
+            "source": worker.state["source"],
+            "format": worker.state["format"],
+            "low_latency": capture_settings["low_latency"],
+            "frame_age_ms": dict(worker.state["frame_age_ms"]),
+            "capture_stats": worker.stats.snapshot(),
+            "has_camera_object": worker.state["camera_object"] is not None,
+            "has_current_frame": worker.ring.has_frame(),
+            "frame_seq": worker.ring.seq,
+            "analysis_frame_scaled": worker.analysis_ring.has_frame(),
+            "preview_frame_scaled": worker.preview_ring.has_frame(),
+            "stream_clients": {variant: b.subscribers for variant, b in worker.broadcasters.items()},
+            "annotated_faces": len(worker.state["annotations"]["faces"]) if worker.state["annotations"] else 0,
+            "recording": worker.recorder.info() if worker.recorder is not None else None,
+            "recording_error": worker.state["recording_error"],
+            "models": engine_status(),
+            "thread_alive": worker.thread is not None and worker.thread.is_alive(),
+            "opening": worker.state["opening"],
+            "last_error": worker.state["last_error"],
+            "initialization_success": worker.state["initialization_success"]
         }
 
+def list_camera_info():
+    """Información de todas las cámaras con worker, por índice"""
+    return {idx: get_camera_info(w) for idx, w in list_camera_workers()}
+
+def start_camera_worker(index, resolution=None, source=None):
+    """
+    Inicia (o reconfigura) el worker de captura de una cámara y lo devuelve.
+    Cada cámara tiene su propio hilo, estado, lock y buffer de frames.
+    """
+    worker = register_camera_source(index, source) if source else get_camera_worker(index)
+    with worker.lock:
+        worker.state["is_running"] = True
+        if resolution:
+            worker.state["resolution"] = resolution
+        alive = worker.thread is not None and worker.thread.is_alive()
+    worker.wakeup.set()
+    
+    if not alive:
+        logger.info(f"🎥 Iniciando worker de captura para cámara {index}")
+        thread = threading.Thread(target=camera_thread_func, args=(worker,),
+                                  daemon=True, name=f"CameraThread-{index}")
+        with worker.lock:
+            worker.thread = thread
+        thread.start()
+    return worker
+
+def stop_camera_worker(index):
+    """Detiene el worker de una cámara (el hilo libera el dispositivo)"""
+    stop_camera_recording(index)
+    worker = get_camera_worker(index, create=False)
+    if worker:
+        with worker.lock:
+            worker.state["is_running"] = False
+        worker.wakeup.set()
+        logger.info(f"🛑 Worker de cámara {index} detenido")
+
+def start_camera_recording(index, session_id, out_dir, **options):
+    """
+    Empieza a grabar la cámara index en segmentos (ver SessionRecorder).
+    Si ya había una grabación en curso se cierra primero.
+    """
+    worker = get_camera_worker(index)
+    recorder = SessionRecorder(session_id, out_dir, camera=index, **options).start()
+    with worker.lock:
+        previous, worker.recorder = worker.recorder, recorder
+        worker.state["recording_error"] = None
+    if previous is not None:
+        previous.stop()
+    return recorder
+
+def stop_camera_recording(index):
+    """Detiene la grabación de la cámara index; devuelve su estado final o None"""
+    worker = get_camera_worker(index, create=False)
+    if worker is None:
+        return None
+    with worker.lock:
+        recorder, worker.recorder = worker.recorder, None
+    if recorder is None:
+        return None
+    recorder.stop()
+    return recorder.info()
+
+def configure_camera_worker(index, resolution):
+    """Cambia la resolución de una cámara; su hilo la reabre al despertar"""
+    worker = get_camera_worker(index)
+    with worker.lock:
+        worker.state["resolution"] = resolution
+    worker.wakeup.set()
+    return worker
+
+def switch_camera_worker(previous, index, resolution):
+    """
+    Cambia la cámara de un aula de previous a index. El worker anterior se
+    detiene: su hilo libera el dispositivo y su hilo de análisis termina
+    (deja de inferir y de escribir CSV para una cámara que nadie mira).
+    """
+    if previous is not None and previous != index:
+        stop_camera_worker(previous)
+    return configure_camera_worker(index, resolution)
+
 def start_camera_system():
     """
     Inicia el sistema de cámara (debe llamarse desde Flask)
     """
-    with camera_lock:
-        camera_state["is_running"] = True
-    
-    # El hilo se inicia desde core.py cuando se accede al dashboard
+    # Los hilos se inician por cámara desde core.py cuando se accede al dashboard
     logger.info("✅ Sistema de cámara habilitado")
 
 def stop_camera_system():
     """
-    Detiene el sistema de cámara
+    Detiene el sistema de cámara (todas las cámaras)
     """
-    with camera_lock:
-        camera_state["is_running"] = False
+    for idx, _ in list_camera_workers():
+        stop_camera_worker(idx)
     
-    logger.info("🛑 Sistema de cámara detenido")
\ No newline at end of file
+    logger.info("🛑 Sistema de cámara detenido")
@@ -0,0 +1,120 @@
+import glob
+import time
+import threading
+import logging
+
+from .camera import cameras_in_use, camera_sources, detect_cameras
+
+logger = logging.getLogger(__name__)
+
+# Caché de cámaras detectadas. Las rutas leen de aquí y nunca prueban
+# dispositivos en el hilo de la petición.
+registry_state = {
+    "cameras": [],
+    "updated_at": 0.0,
+    "probe_seconds": None,
+    "probing": False,
+    "devices": None,     # Firma de /dev/video* (Linux) para detectar hotplug
+    "ttl": 60,
+    "max_index": 10
+}
+
+registry_lock = threading.Lock()
+_refresh_event = threading.Event()
+_registry_thread = None
+
+
+def _device_signature():
+    """Lista de nodos de video del sistema (None si la plataforma no los expone)"""
+    nodes = glob.glob("/dev/video*")
+    return tuple(sorted(nodes)) if nodes else None
+
+
+def _probe():
+    with registry_lock:
+        if registry_state["probing"]:
+            return
+        registry_state["probing"] = True
+        max_index = registry_state["max_index"]
+
+    start = time.time()
+    try:
+        cameras = detect_cameras(max_idx=max_index, in_use=cameras_in_use())
+    except Exception as e:
+        logger.error(f"Error detectando cámaras en segundo plano: {e}")
+        cameras = None
+
+    with registry_lock:
+        registry_state["probing"] = False
+        if cameras is not None:
+            registry_state["cameras"] = cameras
+            registry_state["updated_at"] = time.time()
+            registry_state["probe_seconds"] = round(time.time() - start, 3)
+    logger.info(f"📷 Registro de cámaras actualizado: {cameras} ({time.time() - start:.2f}s)")
+
+
+def _registry_loop(poll_interval):
+    logger.info("📷 Iniciando registro de cámaras en segundo plano")
+    while True:
+        forced = _refresh_event.wait(timeout=poll_interval)
+        _refresh_event.clear()
+
+        devices = _device_signature()
+        with registry_lock:
+            hotplug = devices != registry_state["devices"]
+            registry_state["devices"] = devices
+            stale = time.time() - registry_state["updated_at"] > registry_state["ttl"]
+
+        if forced or hotplug or stale:
+            if hotplug and registry_state["updated_at"]:
+                logger.info(f"🔌 Cambio de dispositivos de video detectado: {devices}")
+            _probe()
+
+
+def start_camera_registry(ttl=60, max_index=10, poll_interval=2.0):
+    """
+    Inicia el hilo que mantiene la caché de cámaras (debe llamarse desde Flask).
+    Se vuelve a probar cuando expira el TTL, cuando cambian los nodos
+    /dev/video* (hotplug) o cuando se pide con refresh_cameras().
+    """
+    global _registry_thread
+    with registry_lock:
+        registry_state["ttl"] = ttl
+        registry_state["max_index"] = max_index
+        if _registry_thread is not None and _registry_thread.is_alive():
+            return
+        _registry_thread = threading.Thread(target=_registry_loop, args=(poll_interval,),
+                                            daemon=True, name="CameraRegistryThread")
+        _registry_thread.start()
+
+
+def refresh_cameras():
+    """Pide una nueva detección en segundo plano (no bloquea)"""
+    _refresh_event.set()
+
+
+def get_available_cameras():
+    """
+    Devuelve las cámaras de la caché al instante. Mientras no haya una primera
+    detección se devuelve el índice 0 (modo demo), como detect_cameras().
+    Incluye los índices asociados a fuentes de reproducción.
+    """
+    with registry_lock:
+        cameras = list(registry_state["cameras"])
+    # Cámaras abiertas por un worker y fuentes de reproducción configuradas
+    for idx in cameras_in_use() + list(camera_sources()):
+        if idx not in cameras:
+            cameras.append(idx)
+    return sorted(cameras) if cameras else [0]
+
+
+def get_registry_info():
+    with registry_lock:
+        updated_at = registry_state["updated_at"]
+        return {
+            "cameras": list(registry_state["cameras"]),
+            "age_seconds": round(time.time() - updated_at, 1) if updated_at else None,
+            "probe_seconds": registry_state["probe_seconds"],
+            "probing": registry_state["probing"],
+            "ttl": registry_state["ttl"]
+        }
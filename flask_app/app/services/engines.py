@@ -0,0 +1,468 @@
+import os
+import time
+import threading
+import logging
+import importlib
+import importlib.util
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Orden de salida de los modelos de DeepFace (y de sus exportaciones a ONNX)
+EMOTION_LABELS = ("angry", "disgust", "fear", "happy", "sad", "surprise", "neutral")
+GENDER_LABELS = ("Woman", "Man")
+
+
+def _percentages(probs, labels):
+    """Probabilidades (o logits) del modelo → {etiqueta: porcentaje} como DeepFace"""
+    probs = np.asarray(probs, dtype=np.float64).ravel()
+    if probs.min() < 0 or abs(probs.sum() - 1.0) > 1e-3:
+        probs = np.exp(probs - probs.max())  # Logits: aplicar softmax
+    probs = probs / probs.sum()
+    return {label: float(p * 100.0) for label, p in zip(labels, probs)}
+
+
+def face_result(face, emotion=None, gender=None):
+    """Resultado de una cara con el formato de DeepFace.analyze"""
+    result = {"region": dict(face["region"]), "face_confidence": float(face.get("confidence", 1.0))}
+    if "track_id" in face:
+        result["track_id"] = face["track_id"]
+    if emotion is not None:
+        result["emotion"] = emotion
+        result["dominant_emotion"] = max(emotion, key=emotion.get)
+    if gender is not None:
+        result["gender"] = gender
+        result["dominant_gender"] = max(gender, key=gender.get)
+    return result
+
+
+def crop_face(frame, region):
+    """Recorte de la cara (vista, sin copia) acotado a los bordes del frame"""
+    h, w = frame.shape[:2]
+    x, y = max(0, int(region["x"])), max(0, int(region["y"]))
+    x2, y2 = min(w, x + int(region["w"])), min(h, y + int(region["h"]))
+    return frame[y:y2, x:x2]
+
+
+class InferenceEngine:
+    """
+    Interfaz de los motores de inferencia del análisis de emociones.
+
+    detect(frame) -> [{"region": {x, y, w, h}, "confidence"}]
+    classify(frame, faces, actions) -> un resultado por cara (mismo orden)
+    analyze(frame, actions) -> detect + classify
+
+    Los resultados usan el formato de DeepFace.analyze (region,
+    face_confidence, emotion, dominant_emotion, gender, dominant_gender),
+    así el hilo de análisis no depende del motor. Los modelos se cargan en
+    load(), nunca al importar el módulo.
+    """
+
+    name = "base"
+    batched_classify = False  # classify_many junta las peticiones (un forward por modelo o en paralelo)
+
+    def __init__(self):
+        self.loaded = False
+
+    @property
+    def available(self):
+        return True
+
+    def load(self):
+        self.loaded = True
+
+    def detect(self, frame):
+        raise NotImplementedError
+
+    def classify(self, frame, faces, actions=("emotion", "gender")):
+        raise NotImplementedError
+
+    def classify_many(self, requests):
+        """
+        Clasifica varias peticiones [(frame, faces, actions)] de una vez (caras
+        de un frame o de varias cámaras). Devuelve una lista de resultados por
+        petición. Los motores que admiten lotes lo hacen en un forward por modelo.
+        """
+        return [self.classify(frame, faces, actions) for frame, faces, actions in requests]
+
+    def analyze(self, frame, actions=("emotion", "gender")):
+        faces = self.detect(frame)
+        if not faces:
+            return []
+        return self.classify(frame, faces, actions)
+
+    def warm_up(self, actions=("emotion", "gender")):
+        """Carga los modelos y ejecuta cada uno una vez (la primera inferencia es la lenta)"""
+        self.load()
+        frame = np.full((240, 320, 3), 128, dtype=np.uint8)
+        self.detect(frame)
+        self.classify(frame, [{"region": {"x": 80, "y": 40, "w": 160, "h": 160}, "confidence": 0.0}], actions)
+
+    def info(self):
+        return {"engine": self.name, "available": self.available, "loaded": self.loaded}
+
+
+class DeepFaceEngine(InferenceEngine):
+    """Motor por defecto: DeepFace (TensorFlow/Keras), importado recién en load()"""
+
+    name = "deepface"
+
+    def __init__(self, detector_backend="opencv"):
+        super().__init__()
+        self.detector_backend = detector_backend
+        self._deepface = None
+
+    @property
+    def available(self):
+        return importlib.util.find_spec("deepface") is not None
+
+    def load(self):
+        if self._deepface is None:
+            from deepface import DeepFace
+            self._deepface = DeepFace
+        self.loaded = True
+
+    def _df(self):
+        if self._deepface is None:
+            self.load()
+        return self._deepface
+
+    def detect(self, frame):
+        faces = self._df().extract_faces(img_path=frame, detector_backend=self.detector_backend,
+                                         enforce_detection=False)
+        return [{"region": {k: int(f["facial_area"][k]) for k in ("x", "y", "w", "h")},
+                 "confidence": float(f.get("confidence", 0))}
+                for f in faces if f.get("confidence", 0) > 0]
+
+    def classify(self, frame, faces, actions=("emotion", "gender")):
+        # DeepFace.analyze clasifica de a una cara: sin lotes (ver get_batcher)
+        results = []
+        for face in faces:
+            analysis = self._df().analyze(img_path=np.ascontiguousarray(crop_face(frame, face["region"])),
+                                          actions=list(actions), enforce_detection=False,
+                                          detector_backend="skip")[0]
+            results.append(face_result(face, analysis.get("emotion"), analysis.get("gender")))
+        return results
+
+    def analyze(self, frame, actions=("emotion", "gender")):
+        # Mismo llamado de siempre: DeepFace detecta y clasifica en una pasada
+        return self._df().analyze(img_path=frame, actions=list(actions), enforce_detection=False,
+                                  detector_backend=self.detector_backend)
+
+
+class OnnxEngine(InferenceEngine):
+    """
+    Motor ONNX Runtime (CPU) con modelos exportados.
+
+    emotion_model: modelo de emociones de DeepFace exportado a ONNX (entrada
+    48x48 en gris, salida en el orden de EMOTION_LABELS). gender_model:
+    modelo de género (entrada 224x224 BGR en [0, 1], salida Woman/Man).
+    Se exportan desde los pesos de DeepFace con tf2onnx, p.ej.
+    python -m tf2onnx.convert --keras emotion.h5 --output emotion.onnx
+    Detección: YuNet (cv2.FaceDetectorYN) si se indica detector_model, si no
+    el clasificador Haar de OpenCV (el mismo del backend "opencv" de DeepFace).
+    Las caras se clasifican en lotes de hasta batch_size recortes por modelo.
+    """
+
+    name = "onnx"
+    batched_classify = True
+
+    def __init__(self, emotion_model, gender_model=None, detector_model=None, threads=0,
+                 detector_threshold=0.7, batch_size=32):
+        super().__init__()
+        self.batch_size = max(1, batch_size)
+        self.emotion_model = emotion_model
+        self.gender_model = gender_model
+        self.detector_model = detector_model
+        self.threads = threads
+        self.detector_threshold = detector_threshold
+        self._sessions = {}
+        self._detector = None
+        self._detector_lock = threading.Lock()  # Los detectores de OpenCV no son reentrantes
+
+    @property
+    def available(self):
+        return (importlib.util.find_spec("onnxruntime") is not None
+                and bool(self.emotion_model) and os.path.exists(self.emotion_model))
+
+    def load(self):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        if self.threads:
+            options.intra_op_num_threads = self.threads
+        models = {"emotion": self.emotion_model, "gender": self.gender_model}
+        for action, path in models.items():
+            if path and action not in self._sessions:
+                self._sessions[action] = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+                logger.info(f"🧠 Modelo ONNX de {action} cargado: {path}")
+        if self._detector is None:
+            self._detector = self._create_detector()
+        self.loaded = True
+
+    def _create_detector(self):
+        if self.detector_model:
+            return cv2.FaceDetectorYN.create(self.detector_model, "", (320, 320), self.detector_threshold)
+        cascade = os.path.join(cv2.data.haarcascades, "haarcascade_frontalface_default.xml")
+        if not os.path.exists(cascade):
+            raise RuntimeError("No hay detector de caras: configure ONNX_DETECTOR_MODEL (YuNet)")
+        return cv2.CascadeClassifier(cascade)
+
+    def detect(self, frame):
+        if not self.loaded:
+            self.load()
+        with self._detector_lock:
+            if isinstance(self._detector, cv2.CascadeClassifier):
+                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                boxes = self._detector.detectMultiScale(gray, 1.1, 10)
+                return [{"region": {"x": int(x), "y": int(y), "w": int(w), "h": int(h)}, "confidence": 1.0}
+                        for (x, y, w, h) in boxes]
+            self._detector.setInputSize((frame.shape[1], frame.shape[0]))
+            _, boxes = self._detector.detect(frame)
+        return [{"region": {"x": int(b[0]), "y": int(b[1]), "w": int(b[2]), "h": int(b[3])},
+                 "confidence": float(b[-1])}
+                for b in (boxes if boxes is not None else [])]
+
+    # -----------------------------
+    # Preprocesamiento (igual que DeepFace sobre la cara recortada; no se alinea)
+    # -----------------------------
+    @staticmethod
+    def _face_input(crop, size=224):
+        # Redimensiona manteniendo proporción, rellena con negro y escala a [0, 1] (como DeepFace)
+        h, w = crop.shape[:2]
+        factor = size / max(h, w)
+        resized = cv2.resize(crop, (max(1, int(w * factor)), max(1, int(h * factor))))
+        canvas = np.zeros((size, size, 3), dtype=np.uint8)
+        top, left = (size - resized.shape[0]) // 2, (size - resized.shape[1]) // 2
+        canvas[top:top + resized.shape[0], left:left + resized.shape[1]] = resized
+        return canvas.astype(np.float32) / 255.0  # BGR, como lo recibe DeepFace
+
+    @classmethod
+    def _emotion_input(cls, crop):
+        # DeepFace pasa a gris la cara ya llevada a 224x224 y recién entonces la reduce a 48x48
+        gray = cv2.cvtColor(cls._face_input(crop), cv2.COLOR_BGR2GRAY)
+        return cv2.resize(gray, (48, 48))[:, :, None]
+
+    @classmethod
+    def _gender_input(cls, crop):
+        return cls._face_input(crop)
+
+    def _run(self, action, batch):
+        """Ejecuta el modelo sobre un lote NHWC (se transpone si el modelo es NCHW)"""
+        session = self._sessions[action]
+        model_input = session.get_inputs()[0]
+        shape = model_input.shape
+        if len(shape) == 4 and shape[1] in (1, 3) and shape[3] not in (1, 3):
+            batch = batch.transpose(0, 3, 1, 2)
+        return session.run(None, {model_input.name: np.ascontiguousarray(batch)})[0]
+
+    def _run_batched(self, action, inputs):
+        """Probabilidades por entrada, en lotes de batch_size (1 si el modelo fija el lote)"""
+        size = self.batch_size if self._sessions[action].get_inputs()[0].shape[0] != 1 else 1
+        outputs = []
+        for start in range(0, len(inputs), size):
+            outputs.extend(self._run(action, np.stack(inputs[start:start + size])))
+        return outputs
+
+    def classify(self, frame, faces, actions=("emotion", "gender")):
+        return self.classify_many([(frame, faces, actions)])[0]
+
+    def classify_many(self, requests):
+        if not self.loaded:
+            self.load()
+        crops = [(r, crop_face(frame, face["region"]), actions)
+                 for r, (frame, faces, actions) in enumerate(requests) for face in faces]
+        emotion_idx = [i for i, (_, _, actions) in enumerate(crops) if "emotion" in actions]
+        gender_idx = [i for i, (_, _, actions) in enumerate(crops)
+                      if "gender" in actions and "gender" in self._sessions]
+        emotions = dict(zip(emotion_idx, self._run_batched(
+            "emotion", [self._emotion_input(crops[i][1]) for i in emotion_idx]))) if emotion_idx else {}
+        genders = dict(zip(gender_idx, self._run_batched(
+            "gender", [self._gender_input(crops[i][1]) for i in gender_idx]))) if gender_idx else {}
+
+        results = [[] for _ in requests]
+        faces = [face for _, face_list, _ in requests for face in face_list]
+        for i, (r, _, _) in enumerate(crops):
+            emotion = _percentages(emotions[i], EMOTION_LABELS) if i in emotions else None
+            gender = _percentages(genders[i], GENDER_LABELS) if i in genders else None
+            results[r].append(face_result(faces[i], emotion, gender))
+        return results
+
+
+class ClassificationBatcher:
+    """
+    Junta las peticiones de clasificación de varios hilos de análisis (una
+    por cámara) en un solo classify_many. El primer hilo que llega espera
+    max_wait segundos a que lleguen otras cámaras, clasifica todo el lote y
+    entrega a cada hilo sus resultados. Con max_wait=0 solo se juntan las
+    peticiones que coinciden en el tiempo.
+    """
+
+    def __init__(self, engine, max_wait=0.0):
+        self.engine = engine
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._pending = []
+        self.batches = 0
+        self.requests = 0
+
+    def classify(self, frame, faces, actions=("emotion", "gender")):
+        return self.classify_many([(frame, faces, actions)])[0]
+
+    def classify_many(self, requests):
+        item = {"requests": requests, "done": threading.Event(), "results": None, "error": None}
+        with self._lock:
+            self._pending.append(item)
+            leader = len(self._pending) == 1
+        if leader:
+            time.sleep(self.max_wait)
+            with self._lock:
+                batch, self._pending = self._pending, []
+            self._run(batch)
+        item["done"].wait()
+        if item["error"] is not None:
+            raise item["error"]
+        return item["results"]
+
+    def _run(self, batch):
+        merged = [request for item in batch for request in item["requests"]]
+        try:
+            results = self.engine.classify_many(merged)
+        except Exception as e:
+            results = None
+            for item in batch:
+                item["error"] = e
+        self.batches += 1
+        self.requests += len(batch)
+        offset = 0
+        for item in batch:
+            if results is not None:
+                item["results"] = results[offset:offset + len(item["requests"])]
+            offset += len(item["requests"])
+            item["done"].set()
+
+
+# -----------------------------
+# Registro de motores
+# -----------------------------
+_engines = {}
+_batchers = {}
+_engines_lock = threading.Lock()
+
+# Precarga de modelos: el análisis no empieza hasta que el motor está listo
+engine_state = {
+    "status": "idle",      # idle | loading | ready | error | unavailable
+    "engine": None,
+    "started_at": None,
+    "time_to_ready_s": None,
+    "error": None,
+    "failed_at": None
+}
+engine_state_lock = threading.Lock()
+_warm_up_lock = threading.Lock()   # Una sola carga aunque la pidan varios hilos
+
+ENGINE_RETRY_INTERVAL = 30.0       # Tras un error de carga no reintentar antes de esto
+
+
+def create_engine(settings):
+    """
+    Crea el motor indicado por INFERENCE_ENGINE ("deepface", "onnx" o una
+    clase propia como "paquete.modulo:Clase", que recibe settings). Con
+    INFERENCE_WORKERS > 0 el motor corre en un pool de procesos.
+    """
+    name = settings.get("INFERENCE_ENGINE", "deepface")
+    if int(settings.get("INFERENCE_WORKERS", 0)) > 0:
+        from .inference_pool import PooledEngine
+        return PooledEngine(settings, processes=int(settings["INFERENCE_WORKERS"]),
+                            slot_bytes=int(float(settings.get("INFERENCE_SHM_SLOT_MB", 8)) * 1024 * 1024),
+                            start_timeout=float(settings.get("INFERENCE_START_TIMEOUT", 300)))
+    if name == "deepface":
+        return DeepFaceEngine(detector_backend=settings.get("DEEPFACE_DETECTOR", "opencv"))
+    if name == "onnx":
+        return OnnxEngine(settings.get("ONNX_EMOTION_MODEL"), settings.get("ONNX_GENDER_MODEL"),
+                          settings.get("ONNX_DETECTOR_MODEL"), int(settings.get("ONNX_THREADS", 0)),
+                          batch_size=int(settings.get("INFERENCE_BATCH_SIZE", 32)))
+    if ":" in name:
+        module_name, class_name = name.split(":", 1)
+        return getattr(importlib.import_module(module_name), class_name)(settings)
+    raise ValueError(f"Motor de inferencia desconocido: {name}")
+
+
+def get_engine(settings):
+    """Motor compartido por todos los hilos de análisis (uno por nombre)"""
+    name = settings.get("INFERENCE_ENGINE", "deepface")
+    with _engines_lock:
+        if name not in _engines:
+            _engines[name] = create_engine(settings)
+            logger.info(f"🧠 Motor de inferencia: {name}")
+        return _engines[name]
+
+
+def get_batcher(settings):
+    """
+    Agrupador de clasificación compartido entre cámaras (uno por motor). Solo
+    sirve si el motor clasifica en lotes (ONNX, pool de procesos): con DeepFace
+    cada cara es un forward aparte, juntar cámaras no ahorra nada y solo
+    agregaría espera, así que se devuelve el motor tal cual.
+    """
+    engine = get_engine(settings)
+    if not engine.batched_classify:
+        return engine
+    with _engines_lock:
+        if engine.name not in _batchers:
+            _batchers[engine.name] = ClassificationBatcher(
+                engine, max_wait=settings.get("INFERENCE_BATCH_WAIT_MS", 0) / 1000.0)
+        return _batchers[engine.name]
+
+
+def engine_status():
+    """Estado de la precarga de modelos (para /readyz y get_camera_info)"""
+    with engine_state_lock:
+        return dict(engine_state, ready=engine_state["status"] == "ready")
+
+
+def _set_engine_state(**kw):
+    with engine_state_lock:
+        engine_state.update(kw)
+
+
+def warm_up_engine(settings):
+    """
+    Carga y ejecuta una vez todos los modelos del motor configurado.
+    Devuelve True si el motor quedó listo. Si otro hilo ya está cargando,
+    espera a que termine en lugar de cargar dos veces.
+    """
+    engine = get_engine(settings)
+    with _warm_up_lock:
+        with engine_state_lock:
+            status, failed_at = engine_state["status"], engine_state["failed_at"]
+        if status == "ready":
+            return True
+        if status == "error" and time.time() - failed_at < ENGINE_RETRY_INTERVAL:
+            return False
+        if not engine.available:
+            _set_engine_state(status="unavailable", engine=engine.name)
+            return False
+
+        started = time.time()
+        _set_engine_state(status="loading", engine=engine.name, started_at=started, error=None)
+        logger.info(f"⏳ Cargando modelos del motor {engine.name}...")
+        try:
+            engine.warm_up()
+        except Exception as e:
+            _set_engine_state(status="error", error=str(e), failed_at=time.time())
+            logger.error(f"Error cargando los modelos del motor {engine.name}: {e}")
+            return False
+        elapsed = round(time.time() - started, 2)
+        _set_engine_state(status="ready", time_to_ready_s=elapsed)
+        logger.info(f"✅ Motor {engine.name} listo en {elapsed} s")
+        return True
+
+
+def preload_engine(settings, background=True):
+    """Precarga al iniciar la aplicación, en un hilo propio o bloqueando el arranque"""
+    if not background:
+        return warm_up_engine(settings)
+    threading.Thread(target=warm_up_engine, args=(settings,), daemon=True, name="ModelWarmUp").start()
+    return None
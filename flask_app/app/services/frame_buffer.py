@@ -0,0 +1,146 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+
+
+class FrameRing:
+    """
+    Buffer circular de frames preasignados con número de secuencia.
+
+    El hilo de captura escribe directamente sobre un slot libre (cap.read(slot))
+    y lo publica con commit(), que despierta a quienes esperan en wait(). Los
+    consumidores toman una vista de solo lectura del último slot con acquire();
+    mientras la vista está tomada el slot queda "fijado" y el escritor no lo
+    reutiliza, así que no hace falta copiar el frame ni mantener el lock de la
+    cámara durante el procesamiento.
+    """
+
+    def __init__(self, slots=4):
+        if slots < 2:
+            raise ValueError("FrameRing necesita al menos 2 slots")
+        self._cond = threading.Condition()
+        self._buffers = [None] * slots
+        self._seqs = [0] * slots
+        self._stamps = [0.0] * slots
+        self._pins = [0] * slots
+        self._latest = -1
+        self._seq = 0
+
+    # -----------------------------
+    # Escritor (hilo de captura)
+    # -----------------------------
+    def claim(self):
+        """
+        Reserva el siguiente slot libre para escritura.
+        Devuelve (idx, buffer); buffer es None si el slot aún no fue asignado.
+        """
+        with self._cond:
+            n = len(self._buffers)
+            start = (self._latest + 1) % n
+            for off in range(n):
+                idx = (start + off) % n
+                if idx != self._latest and self._pins[idx] == 0:
+                    return idx, self._buffers[idx]
+        # Todos los slots fijados por consumidores lentos
+        return -1, None
+
+    def commit(self, idx, frame, timestamp=None, seq=None):
+        """
+        Publica el frame escrito en el slot idx como el más reciente.
+        Si OpenCV reasignó el buffer (cambio de resolución) se adopta el nuevo.
+        Con idx < 0 (sin slot libre) el frame se descarta. seq permite numerar
+        igual que otro buffer (p.ej. versiones reducidas del mismo frame).
+        """
+        with self._cond:
+            if idx < 0:
+                return self._seq
+            self._seq = self._seq + 1 if seq is None else seq
+            self._buffers[idx] = frame
+            self._seqs[idx] = self._seq
+            self._stamps[idx] = time.time() if timestamp is None else timestamp
+            self._latest = idx
+            self._cond.notify_all()
+            return self._seq
+
+    def publish(self, frame, timestamp=None, seq=None):
+        """Copia un frame externo en el siguiente slot libre y lo publica"""
+        idx, buf = self.claim()
+        if idx >= 0:
+            if buf is None or buf.shape != frame.shape or buf.dtype != frame.dtype:
+                buf = np.empty_like(frame)
+            np.copyto(buf, frame)
+            frame = buf
+        return self.commit(idx, frame, timestamp, seq)
+
+    def publish_resized(self, frame, width, timestamp=None, seq=None):
+        """
+        Publica una versión reducida a width píxeles de ancho (misma proporción),
+        redimensionando directamente sobre un slot libre.
+        """
+        h, w = frame.shape[:2]
+        size = (width, max(1, round(h * width / w)))
+        idx, buf = self.claim()
+        if idx < 0:
+            return self.seq
+        if buf is None or buf.shape[:2] != (size[1], size[0]) or buf.dtype != frame.dtype:
+            buf = None
+        small = cv2.resize(frame, size, dst=buf, interpolation=cv2.INTER_AREA)
+        return self.commit(idx, small, timestamp, seq)
+
+    def clear(self):
+        """Marca que no hay frame disponible (los buffers se conservan)"""
+        with self._cond:
+            self._latest = -1
+
+    # -----------------------------
+    # Consumidores
+    # -----------------------------
+    @contextmanager
+    def acquire(self, after_seq=0):
+        """
+        Entrega (seq, vista_solo_lectura, timestamp) del último frame.
+        Si no hay frame, o no hay uno más nuevo que after_seq, entrega
+        (seq_actual, None, 0.0).
+        """
+        with self._cond:
+            idx = self._latest
+            if idx < 0 or self._seqs[idx] <= after_seq:
+                seq = self._seqs[idx] if idx >= 0 else self._seq
+                idx = -1
+            else:
+                self._pins[idx] += 1
+                seq = self._seqs[idx]
+                stamp = self._stamps[idx]
+                view = self._buffers[idx].view()
+        if idx < 0:
+            yield seq, None, 0.0
+            return
+        view.flags.writeable = False
+        try:
+            yield seq, view, stamp
+        finally:
+            with self._cond:
+                self._pins[idx] -= 1
+
+    def wait(self, after_seq=0, timeout=None):
+        """
+        Bloquea hasta que se publique un frame con seq > after_seq (o hasta
+        timeout). Devuelve el seq del frame disponible, o 0 si no hay frame.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._latest >= 0 and self._seqs[self._latest] > after_seq,
+                                timeout)
+            return self._seqs[self._latest] if self._latest >= 0 else 0
+
+    @property
+    def seq(self):
+        """Número de secuencia del último frame publicado"""
+        with self._cond:
+            return self._seq
+
+    def has_frame(self):
+        with self._cond:
+            return self._latest >= 0
@@ -0,0 +1,125 @@
+import time
+import threading
+import logging
+from functools import partial
+
+from ..extensions import socketio
+from .camera import get_camera_worker, stream_broadcaster
+
+logger = logging.getLogger(__name__)
+
+# Clientes Socket.IO que reciben los frames por el mismo canal de emotion_update
+# en lugar de abrir /video_feed. Cada cliente tiene como máximo un frame en
+# vuelo: el siguiente se envía solo cuando confirma (ack) el anterior, así un
+# cliente lento se salta frames en vez de acumular cola.
+push_state = {
+    "clients": {},   # sid -> estado de entrega
+    "threads": {}    # (cámara, variante) -> True mientras su hilo de envío está activo
+}
+push_lock = threading.Lock()
+
+ACK_TIMEOUT = 2.0    # Sin ack en este tiempo se asume perdido y se reintenta
+
+
+def _client_state(camera, max_fps, variant="annotated"):
+    return {
+        "camera": camera,
+        "variant": variant,
+        "interval": 1.0 / max_fps if max_fps > 0 else 0.0,
+        "in_flight": None,   # (seq, enviado_en) del frame sin confirmar
+        "last_sent": 0.0,
+        "rtt_ms": None,
+        "sent": 0,
+        "skipped": 0
+    }
+
+
+def _camera_clients(camera, variant=None):
+    return [sid for sid, c in push_state["clients"].items()
+            if c["camera"] == camera and (variant is None or c["variant"] == variant)]
+
+
+def _on_ack(sid, seq, *args):
+    with push_lock:
+        client = push_state["clients"].get(sid)
+        if not client or not client["in_flight"] or client["in_flight"][0] != seq:
+            return
+        rtt_ms = (time.time() - client["in_flight"][1]) * 1000.0
+        client["rtt_ms"] = round(rtt_ms if client["rtt_ms"] is None else client["rtt_ms"] * 0.8 + rtt_ms * 0.2, 1)
+        client["in_flight"] = None
+
+
+def _ready_clients(camera, seq, now, variant="annotated"):
+    """Clientes que pueden recibir el frame seq ahora (y marca el envío)"""
+    ready = []
+    with push_lock:
+        for sid in _camera_clients(camera, variant):
+            client = push_state["clients"][sid]
+            waiting_ack = client["in_flight"] and now - client["in_flight"][1] < ACK_TIMEOUT
+            if waiting_ack or now - client["last_sent"] < client["interval"]:
+                client["skipped"] += 1
+                continue
+            client["in_flight"] = (seq, now)
+            client["last_sent"] = now
+            client["sent"] += 1
+            ready.append(sid)
+    return ready
+
+
+def _push_loop(camera, variant):
+    """Hilo por cámara y variante: reparte el JPEG ya codificado a los clientes suscritos"""
+    worker = get_camera_worker(camera, create=False)  # subscribe_frames ya comprobó que existe
+    logger.info(f"📡 Iniciando envío de frames por Socket.IO (cámara {camera}, {variant})")
+
+    def active():
+        with push_lock:
+            return bool(_camera_clients(camera, variant))
+
+    try:
+        for seq, jpeg in stream_broadcaster(worker, variant).jpegs(active):
+            for sid in _ready_clients(camera, seq, time.time(), variant):
+                # Servidor python-socketio directo: el wrapper de Flask-SocketIO
+                # descarta el ack cuando se emite desde una tarea en segundo plano
+                socketio.server.emit("video_frame", {"camera": camera, "seq": seq, "frame": jpeg},
+                                     to=sid, namespace="/", callback=partial(_on_ack, sid, seq))
+    except Exception as e:
+        logger.error(f"Error enviando frames por Socket.IO (cámara {camera}): {e}")
+    finally:
+        with push_lock:
+            push_state["threads"].pop((camera, variant), None)
+            restart = bool(_camera_clients(camera, variant))
+        if restart:
+            _ensure_pusher(camera, variant)
+    logger.info(f"🛑 Envío de frames por Socket.IO detenido (cámara {camera}, {variant})")
+
+
+def _ensure_pusher(camera, variant):
+    with push_lock:
+        if push_state["threads"].get((camera, variant)):
+            return
+        push_state["threads"][(camera, variant)] = True  # Lo libera _push_loop al terminar
+    socketio.start_background_task(_push_loop, camera, variant)
+
+
+def subscribe_frames(sid, camera, max_fps=15, variant="annotated"):
+    """Empieza a enviar frames de la cámara al cliente sid (reemplaza suscripción previa)"""
+    worker = get_camera_worker(camera, create=False)
+    if worker is None:
+        raise KeyError(f"Cámara {camera} no configurada")
+    stream_broadcaster(worker, variant)  # Valida la variante
+    with push_lock:
+        push_state["clients"][sid] = _client_state(camera, max_fps, variant)
+    _ensure_pusher(camera, variant)
+
+
+def unsubscribe_frames(sid):
+    with push_lock:
+        return push_state["clients"].pop(sid, None) is not None
+
+
+def get_push_info(camera=None):
+    """Estado de entrega por cliente (frames enviados, saltados, RTT del ack)"""
+    with push_lock:
+        return {sid: {k: c[k] for k in ("camera", "variant", "sent", "skipped", "rtt_ms")}
+                for sid, c in push_state["clients"].items()
+                if camera is None or c["camera"] == camera}
@@ -0,0 +1,328 @@
+import os
+import time
+import queue
+import atexit
+import itertools
+import threading
+import logging
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .engines import InferenceEngine, create_engine
+
+logger = logging.getLogger(__name__)
+
+
+def _worker_main(settings, slot_names, requests, results):
+    """Proceso de inferencia: carga su propio motor y atiende peticiones sobre los slots compartidos"""
+    # Los slots los crea y libera el proceso web (comparte con él el resource tracker)
+    slots = [shared_memory.SharedMemory(name=name) for name in slot_names]
+
+    started = time.time()
+    try:
+        engine = create_engine(settings)
+        engine.warm_up()
+    except Exception as e:
+        results.put(("error", os.getpid(), None, str(e)))
+        return
+    results.put(("ready", os.getpid(), round(time.time() - started, 2), None))
+
+    while True:
+        message = requests.get()
+        if message is None:
+            break
+        job_id, op, slot, shape, dtype, faces, actions = message
+        results.put(("taken", os.getpid(), job_id, None))  # Para liberar el slot si este proceso muere
+        frame = np.ndarray(shape, dtype=np.dtype(dtype), buffer=slots[slot].buf)
+        try:
+            if op == "detect":
+                output = engine.detect(frame)
+            elif op == "classify":
+                output = engine.classify(frame, faces, actions)
+            else:
+                output = engine.analyze(frame, actions)
+            results.put((job_id, os.getpid(), output, None))
+        except Exception as e:
+            results.put((job_id, os.getpid(), None, str(e)))
+        del frame  # Libera la vista antes de cerrar el slot
+    for slot in slots:
+        slot.close()
+
+
+class InferencePool:
+    """
+    Pool de procesos de inferencia con entrega de frames por memoria compartida.
+
+    El proceso web copia cada frame en un slot de memoria compartida libre y
+    envía por la cola solo el índice del slot, la forma y las caras; el
+    proceso de inferencia lee el frame directamente del slot (sin pickle del
+    array) y devuelve los resultados, que son dicts pequeños. Hay dos slots
+    por proceso, así que como mucho 2*processes frames están en vuelo y
+    submit() espera un slot libre si el pool va atrasado. Un slot vuelve a
+    estar libre solo cuando el proceso responde o muere (o cuando una
+    petición vencida no la tomó ningún proceso), nunca antes.
+    """
+
+    def __init__(self, settings, processes=2, slot_bytes=8 * 1024 * 1024, timeout=30.0,
+                 start_timeout=300.0):
+        # Solo la configuración del motor viaja a los procesos (sin INFERENCE_WORKERS: no anidar pools)
+        self.settings = {k: v for k, v in settings.items() if k.startswith(("INFERENCE_", "ONNX_", "DEEPFACE_"))}
+        self.settings["INFERENCE_WORKERS"] = 0
+        self.processes = max(1, processes)
+        self.slot_bytes = slot_bytes
+        self.timeout = timeout
+        self.start_timeout = start_timeout  # Cargar TensorFlow/DeepFace en frío puede tardar minutos
+        self._ctx = mp.get_context("spawn")  # Sin fork: el proceso web tiene hilos y locks tomados
+        self._slots = []
+        self._free = queue.Queue()
+        self._pending = {}
+        self._expired = {}   # job_id -> (slot, vencida_en) de peticiones que un proceso aún puede estar leyendo
+        self._owners = {}    # job_id -> pid del proceso que la tomó
+        self._pending_lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._procs = []
+        self._requests = None
+        self._results = None
+        self._collector = None
+        self._running = False
+        self.ready_times = {}
+
+    # -----------------------------
+    # Ciclo de vida
+    # -----------------------------
+    def start(self):
+        if self._running:
+            return self
+        if mp.parent_process() is not None:
+            raise RuntimeError("El pool de inferencia no puede iniciarse desde un proceso hijo")
+        self._slots = [shared_memory.SharedMemory(create=True, size=self.slot_bytes)
+                       for _ in range(self.processes * 2)]
+        # Estado nuevo en cada arranque (un reintento tras un fallo no debe duplicar slots)
+        self._free = queue.Queue()
+        for i in range(len(self._slots)):
+            self._free.put(i)
+        self.ready_times = {}
+        self._expired, self._owners = {}, {}
+        self._requests = self._ctx.Queue()
+        self._results = self._ctx.Queue()
+        names = [slot.name for slot in self._slots]
+        self._procs = [self._ctx.Process(target=_worker_main, name=f"Inference-{i}", daemon=True,
+                                         args=(self.settings, names, self._requests, self._results))
+                       for i in range(self.processes)]
+        for proc in self._procs:
+            proc.start()
+        self._running = True
+        atexit.register(self.close)
+
+        # Esperar a que todos los procesos carguen sus modelos (falla apenas uno muere)
+        deadline = time.time() + self.start_timeout
+        while len(self.ready_times) < self.processes:
+            try:
+                kind, pid, elapsed, error = self._results.get(timeout=0.5)
+            except queue.Empty:
+                dead = [p for p in self._procs if not p.is_alive()]
+                if dead:
+                    self.close()
+                    raise RuntimeError(f"Proceso de inferencia {dead[0].pid} terminó al iniciar "
+                                       f"(código {dead[0].exitcode})")
+                if time.time() > deadline:
+                    self.close()
+                    raise RuntimeError(f"Tiempo agotado ({self.start_timeout} s) esperando los procesos de inferencia")
+                continue
+            if kind == "error":
+                self.close()
+                raise RuntimeError(f"Proceso de inferencia {pid}: {error}")
+            self.ready_times[pid] = elapsed
+        self._collector = threading.Thread(target=self._collect, daemon=True, name="InferenceResults")
+        self._collector.start()
+        logger.info(f"🧠 Pool de inferencia listo: {self.processes} procesos "
+                    f"({len(self._slots)} slots de {self.slot_bytes // (1024 * 1024)} MB)")
+        return self
+
+    def close(self):
+        if not self._running:
+            return
+        self._running = False
+        for _ in self._procs:
+            self._requests.put(None)
+        for proc in self._procs:
+            proc.join(timeout=5)
+            if proc.is_alive():
+                proc.terminate()
+        for slot in self._slots:
+            slot.close()
+            slot.unlink()
+        self._slots = []
+        with self._pending_lock:
+            for job in self._pending.values():
+                job["error"] = "Pool de inferencia cerrado"
+                job["done"].set()
+            self._pending.clear()
+            self._expired.clear()
+            self._owners.clear()
+        logger.info("🛑 Pool de inferencia detenido")
+
+    def _collect(self):
+        """Hilo del proceso web: entrega cada resultado a quien lo espera"""
+        next_check = time.time() + 1.0
+        while self._running:
+            try:
+                message = self._results.get(timeout=1.0)
+            except queue.Empty:
+                message = None
+            except (EOFError, OSError):
+                break
+            # Revisar procesos caídos cada segundo, aunque la cola de resultados nunca esté vacía
+            if time.time() >= next_check:
+                self._check_workers()
+                next_check = time.time() + 1.0
+            if message is None:
+                continue
+            job_id, pid, output, error = message
+            if job_id == "taken":
+                with self._pending_lock:
+                    self._owners[output] = pid
+                continue
+            if job_id in ("ready", "error"):  # Proceso reiniciado por _check_workers
+                if job_id == "ready":
+                    self.ready_times[pid] = output
+                else:
+                    logger.error(f"Proceso de inferencia {pid} no pudo cargar el motor: {error}")
+                continue
+            self._finish(job_id, output, error)
+
+    def _finish(self, job_id, output=None, error=None):
+        """Libera el slot de la petición y entrega el resultado (si alguien aún lo espera)"""
+        with self._pending_lock:
+            self._owners.pop(job_id, None)
+            job = self._pending.pop(job_id, None)
+            slot = job["slot"] if job is not None else self._expired.pop(job_id, (None, None))[0]
+        if slot is not None:
+            # El slot se libera aquí (no en wait) para que classify_many pueda tener
+            # más peticiones en vuelo que slots sin bloquearse
+            self._free.put(slot)
+        if job is not None:
+            job["output"], job["error"] = output, error
+            job["done"].set()
+
+    def _check_workers(self):
+        """Reemplaza procesos caídos (sus peticiones en curso vencen por timeout)"""
+        for i, proc in enumerate(self._procs):
+            if self._running and not proc.is_alive():
+                logger.error(f"Proceso de inferencia {proc.pid} terminó (código {proc.exitcode}), reiniciando")
+                with self._pending_lock:
+                    orphaned = [job_id for job_id, pid in self._owners.items() if pid == proc.pid]
+                for job_id in orphaned:
+                    self._finish(job_id, error=f"Proceso de inferencia {proc.pid} terminó")
+                names = [slot.name for slot in self._slots]
+                self._procs[i] = self._ctx.Process(target=_worker_main, name=proc.name, daemon=True,
+                                                   args=(self.settings, names, self._requests, self._results))
+                self._procs[i].start()
+        self._reclaim_expired()
+
+    def _reclaim_expired(self):
+        """
+        Libera los slots de peticiones vencidas que ya nadie va a responder: las
+        tomó un proceso que murió, o ningún proceso las tomó en otro timeout
+        (p.ej. el proceso murió entre sacarla de la cola y avisar). Si esta
+        última llega a procesarse igual, su respuesta se descarta y no vuelve
+        a liberar el slot.
+        """
+        now = time.time()
+        alive = {p.pid for p in self._procs if p.is_alive()}
+        with self._pending_lock:
+            lost = [job_id for job_id, (_, expired_at) in self._expired.items()
+                    if (self._owners[job_id] not in alive if job_id in self._owners
+                        else now - expired_at > self.timeout)]
+        for job_id in lost:
+            self._finish(job_id)
+
+    # -----------------------------
+    # Peticiones
+    # -----------------------------
+    def submit(self, op, frame, faces=None, actions=None):
+        """Envía el frame a un proceso libre; devuelve un job para wait()"""
+        if not self._running:
+            raise RuntimeError("Pool de inferencia detenido")
+        if frame.nbytes > self.slot_bytes:
+            raise ValueError(f"Frame de {frame.nbytes} bytes excede el slot de {self.slot_bytes}")
+        slot = self._free.get(timeout=self.timeout)
+        view = np.ndarray(frame.shape, dtype=frame.dtype, buffer=self._slots[slot].buf)
+        view[...] = frame
+        del view
+        job = {"id": next(self._ids), "slot": slot, "done": threading.Event(), "output": None, "error": None}
+        with self._pending_lock:
+            self._pending[job["id"]] = job
+        self._requests.put((job["id"], op, slot, frame.shape, frame.dtype.str,
+                            faces, tuple(actions) if actions else None))
+        return job
+
+    def wait(self, job):
+        if not job["done"].wait(self.timeout):
+            with self._pending_lock:
+                expired = self._pending.pop(job["id"], None) is not None
+                if expired:
+                    # El proceso puede seguir leyendo el slot: se libera cuando responda o muera
+                    self._expired[job["id"]] = (job["slot"], time.time())
+            if expired:
+                self._reclaim_expired()  # Si el proceso que la tomó ya murió, el slot vuelve ahora
+                raise TimeoutError(f"Inferencia sin respuesta en {self.timeout} s")
+            job["done"].wait()
+        if job["error"] is not None:
+            raise RuntimeError(job["error"])
+        return job["output"]
+
+    def run(self, op, frame, faces=None, actions=None):
+        return self.wait(self.submit(op, frame, faces, actions))
+
+    def info(self):
+        return {
+            "processes": self.processes,
+            "alive": sum(1 for p in self._procs if p.is_alive()),
+            "free_slots": self._free.qsize(),
+            "in_flight": len(self._pending),
+            "expired_slots": len(self._expired),
+            "time_to_ready_s": dict(self.ready_times)
+        }
+
+
+class PooledEngine(InferenceEngine):
+    """Motor que delega detect/classify/analyze en un InferencePool (misma interfaz)"""
+
+    batched_classify = True  # classify_many reparte las peticiones entre los procesos
+
+    def __init__(self, settings, processes=2, slot_bytes=8 * 1024 * 1024, start_timeout=300.0):
+        super().__init__()
+        self.pool = InferencePool(settings, processes, slot_bytes, start_timeout=start_timeout)
+        self._inner = create_engine(self.pool.settings)  # Solo para saber si está disponible
+        self.name = f"{self._inner.name}-pool"
+
+    @property
+    def available(self):
+        return self._inner.available
+
+    def load(self):
+        self.pool.start()
+        self.loaded = True
+
+    def warm_up(self, actions=("emotion", "gender")):
+        self.load()  # Cada proceso carga y ejercita sus modelos antes de reportarse listo
+
+    def detect(self, frame):
+        return self.pool.run("detect", frame)
+
+    def classify(self, frame, faces, actions=("emotion", "gender")):
+        return self.pool.run("classify", frame, faces, actions)
+
+    def classify_many(self, requests):
+        # Cada petición (una por cámara) va a un proceso distinto y corren en paralelo
+        jobs = [self.pool.submit("classify", frame, faces, actions) for frame, faces, actions in requests]
+        return [self.pool.wait(job) for job in jobs]
+
+    def analyze(self, frame, actions=("emotion", "gender")):
+        return self.pool.run("analyze", frame, actions=actions)
+
+    def info(self):
+        return dict(super().info(), pool=self.pool.info())
@@ -0,0 +1,54 @@
+import cv2
+import time
+
+
+class SceneChangeGate:
+    """
+    Detector barato de cambios de escena para evitar inferencias innecesarias.
+
+    Compara una versión reducida en escala de grises del frame con la del
+    último frame analizado. Si la diferencia media (niveles de gris, 0-255)
+    queda bajo threshold, la escena se considera igual y se puede reutilizar
+    el último resultado. Cada max_skip segundos se fuerza un análisis para no
+    quedar pegado ante cambios muy lentos. threshold <= 0 desactiva el filtro.
+    """
+
+    def __init__(self, threshold=4.0, size=(64, 48), max_skip=5.0):
+        self.threshold = threshold
+        self.size = size
+        self.max_skip = max_skip
+        self._reference = None
+        self._reference_time = 0.0
+        self.last_diff = None
+        self.analyzed = 0
+        self.skipped = 0
+
+    def _signature(self, frame):
+        small = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+
+    def should_analyze(self, frame, now=None):
+        """True si el frame difiere lo suficiente del último analizado"""
+        if self.threshold <= 0:
+            self.analyzed += 1
+            return True
+
+        now = time.time() if now is None else now
+        signature = self._signature(frame)
+        if self._reference is None or now - self._reference_time >= self.max_skip:
+            self.last_diff = None
+            changed = True
+        else:
+            self.last_diff = float(cv2.absdiff(signature, self._reference).mean())
+            changed = self.last_diff >= self.threshold
+
+        if changed:
+            self._reference = signature
+            self._reference_time = now
+            self.analyzed += 1
+        else:
+            self.skipped += 1
+        return changed
+
+    def reset(self):
+        self._reference = None
@@ -0,0 +1,225 @@
+import os
+import re
+import cv2
+import json
+import time
+import queue
+import threading
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "index.json"
+_SESSION_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+def valid_session_id(session_id):
+    """Los ids de sesión se usan como nombre de carpeta: solo [A-Za-z0-9_-]"""
+    return bool(session_id and _SESSION_ID_RE.match(session_id))
+
+
+def new_session_id(camera):
+    return f"{datetime.now().strftime('%Y%m%d-%H%M%S')}_cam{camera}"
+
+
+class SessionRecorder:
+    """
+    Grabador de una sesión de clase en segmentos de video.
+
+    La captura entrega frames con submit(), que nunca bloquea: si la cola
+    está llena (disco lento) el frame se descarta y se cuenta. Un hilo propio
+    escribe los frames en archivos de segment_seconds segundos dentro de
+    out_dir/<session_id>/ y mantiene index.json con la lista de segmentos
+    (archivo, inicio, fin, frames) para encontrarlos y reproducirlos luego.
+    """
+
+    def __init__(self, session_id, out_dir, fps=15, segment_seconds=300, queue_size=64,
+                 fourcc="MJPG", camera=None):
+        if not valid_session_id(session_id):
+            raise ValueError(f"Id de sesión inválido: {session_id!r}")
+        self.session_id = session_id
+        self.camera = camera
+        self.fps = fps
+        self.segment_seconds = segment_seconds
+        self.fourcc = fourcc
+        self.session_dir = os.path.join(out_dir, session_id)
+        self.ext = ".avi" if fourcc.upper() in ("MJPG", "XVID", "DIVX") else ".mp4"
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._interval = 1.0 / fps if fps > 0 else 0.0
+        self._next_due = None
+        self._thread = None
+        self._running = False
+        self._lock = threading.Lock()
+
+        self.accepted = 0
+        self.dropped = 0     # Cola llena: el disco no da abasto
+        self.written = 0
+        self.segments = []
+        self.started_at = None
+        self.last_error = None
+
+    # -----------------------------
+    # Productor (hilo de captura)
+    # -----------------------------
+    def submit(self, frame, timestamp=None):
+        """Encola una copia del frame sin bloquear. Devuelve False si se descartó."""
+        if not self._running:
+            return False
+        timestamp = time.time() if timestamp is None else timestamp
+        # Se graba a self.fps, no a los FPS de captura (tolerancia de 1/4 de intervalo
+        # para no perder frames por el jitter de la cámara)
+        if self._next_due is not None and timestamp < self._next_due - self._interval / 4:
+            return False
+        if self._queue.full():
+            self.dropped += 1
+            return False
+        try:
+            self._queue.put_nowait((frame.copy(), timestamp))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        if self._next_due is None or timestamp - self._next_due > self._interval:
+            self._next_due = timestamp  # Primer frame o hueco grande: reiniciar calendario
+        self._next_due += self._interval
+        self.accepted += 1
+        return True
+
+    # -----------------------------
+    # Escritor (hilo propio)
+    # -----------------------------
+    def start(self):
+        os.makedirs(self.session_dir, exist_ok=True)
+        self.started_at = time.time()
+        self._running = True
+        self._write_manifest()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name=f"Recorder-{self.session_id}")
+        self._thread.start()
+        logger.info(f"⏺️ Grabación iniciada: sesión {self.session_id} en {self.session_dir}")
+        return self
+
+    def stop(self, timeout=10.0):
+        """Deja de aceptar frames, escribe los pendientes y cierra el segmento"""
+        self._running = False
+        if self._thread is not None and self._thread.is_alive():
+            try:
+                self._queue.put(None, timeout=timeout)
+            except queue.Full:
+                logger.error(f"Grabador de {self.session_id} no responde, se abandona la cola")
+            self._thread.join(timeout)
+        logger.info(f"⏹️ Grabación detenida: sesión {self.session_id} "
+                    f"({self.written} frames, {self.dropped} descartados)")
+
+    def _open_segment(self, frame, timestamp):
+        name = f"{self.session_id}_{len(self.segments):04d}{self.ext}"
+        path = os.path.join(self.session_dir, name)
+        h, w = frame.shape[:2]
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*self.fourcc), self.fps or 15, (w, h))
+        if not writer.isOpened():
+            raise RuntimeError(f"No se pudo abrir {path} con fourcc {self.fourcc}")
+        segment = {"file": name, "start": timestamp, "end": timestamp, "frames": 0,
+                   "width": w, "height": h}
+        with self._lock:
+            self.segments.append(segment)
+        self._write_manifest()
+        return writer, segment
+
+    def _close_segment(self, writer, segment):
+        writer.release()
+        self._write_manifest()
+        logger.info(f"💾 Segmento cerrado: {segment['file']} ({segment['frames']} frames)")
+
+    def _run(self):
+        writer, segment = None, None
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                frame, timestamp = item
+                rollover = segment is not None and (
+                    timestamp - segment["start"] >= self.segment_seconds
+                    or (frame.shape[1], frame.shape[0]) != (segment["width"], segment["height"]))
+                if rollover:
+                    self._close_segment(writer, segment)
+                    writer, segment = None, None
+                if writer is None:
+                    writer, segment = self._open_segment(frame, timestamp)
+                writer.write(frame)
+                with self._lock:
+                    segment["frames"] += 1
+                    segment["end"] = timestamp
+                self.written += 1
+        except Exception as e:
+            self.last_error = str(e)
+            self._running = False
+            logger.error(f"Error grabando sesión {self.session_id}: {e}")
+        finally:
+            if writer is not None:
+                self._close_segment(writer, segment)
+            self._write_manifest()
+
+    def _write_manifest(self):
+        manifest = dict(self.info(), segments=self.list_segments())
+        tmp = os.path.join(self.session_dir, MANIFEST_NAME + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, os.path.join(self.session_dir, MANIFEST_NAME))
+
+    # -----------------------------
+    # Estado
+    # -----------------------------
+    def list_segments(self):
+        with self._lock:
+            return [dict(s) for s in self.segments]
+
+    @property
+    def running(self):
+        return self._running
+
+    def info(self):
+        return {
+            "session_id": self.session_id,
+            "camera": self.camera,
+            "recording": self._running,
+            "fps": self.fps,
+            "segment_seconds": self.segment_seconds,
+            "started_at": self.started_at,
+            "accepted": self.accepted,
+            "dropped": self.dropped,
+            "written": self.written,
+            "queued": self._queue.qsize(),
+            "segment_count": len(self.segments),
+            "last_error": self.last_error
+        }
+
+
+# -----------------------------
+# Grabaciones en disco
+# -----------------------------
+def load_manifest(out_dir, session_id):
+    """index.json de una sesión, o None si no existe"""
+    if not valid_session_id(session_id):
+        return None
+    path = os.path.join(out_dir, session_id, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def list_recorded_sessions(out_dir):
+    """Resumen de las sesiones grabadas (más recientes primero)"""
+    if not os.path.isdir(out_dir):
+        return []
+    sessions = []
+    for session_id in os.listdir(out_dir):
+        manifest = load_manifest(out_dir, session_id)
+        if manifest:
+            segments = manifest.pop("segments", [])
+            manifest["segment_count"] = len(segments)
+            manifest["duration_seconds"] = round(sum(s["end"] - s["start"] for s in segments), 1)
+            sessions.append(manifest)
+    return sorted(sessions, key=lambda m: m.get("started_at") or 0, reverse=True)
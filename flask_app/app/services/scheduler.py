@@ -0,0 +1,63 @@
+import time
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+class AnalysisScheduler:
+    """
+    Ritmo adaptativo del análisis según la latencia medida de la inferencia.
+
+    Lleva un promedio móvil exponencial de lo que tarda cada inferencia y
+    fija el intervalo entre ticks para que la inferencia ocupe a lo sumo
+    target_load del tiempo del hilo: un equipo lento analiza menos veces por
+    segundo en vez de acumular atraso, uno rápido analiza más. Si la CPU del
+    equipo supera cpu_ceiling el intervalo se alarga (hasta el doble) para
+    dejar aire a la captura y al streaming. El resultado siempre queda entre
+    min_interval y max_interval.
+    """
+
+    def __init__(self, min_interval=0.1, max_interval=2.0, target_load=0.5, cpu_ceiling=85.0,
+                 alpha=0.2, initial_interval=0.5, cpu_percent=None):
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.target_load = target_load
+        self.cpu_ceiling = cpu_ceiling
+        self.alpha = alpha
+        self.interval = min(self.max_interval, max(self.min_interval, initial_interval))
+        self.latency = None
+        self.cpu = None
+        self._cpu_percent = cpu_percent or (
+            (lambda: psutil.cpu_percent(interval=None)) if psutil is not None else None)
+        self._cpu_sampled_at = None
+
+    def _sample_cpu(self, now):
+        # Como mucho una muestra por segundo (cpu_percent mide desde la llamada anterior)
+        if self._cpu_percent is not None and (self._cpu_sampled_at is None or now - self._cpu_sampled_at >= 1.0):
+            self.cpu = self._cpu_percent()
+            self._cpu_sampled_at = now
+        return self.cpu
+
+    def record(self, latency, now=None):
+        """Registra la duración (s) de una inferencia y recalcula el intervalo"""
+        now = time.time() if now is None else now
+        self.latency = latency if self.latency is None else self.latency * (1 - self.alpha) + latency * self.alpha
+        interval = self.latency / self.target_load
+        cpu = self._sample_cpu(now)
+        if cpu is not None and cpu > self.cpu_ceiling:
+            interval *= 1 + (cpu - self.cpu_ceiling) / max(100.0 - self.cpu_ceiling, 1.0)
+        self.interval = min(self.max_interval, max(self.min_interval, interval))
+        return self.interval
+
+    @property
+    def rate(self):
+        return 1.0 / self.interval
+
+    def info(self):
+        return {
+            "analysis_rate": round(self.rate, 2),
+            "inference_ms": round(self.latency * 1000.0, 1) if self.latency is not None else None,
+            "cpu_percent": self.cpu
+        }
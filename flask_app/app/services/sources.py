@@ -0,0 +1,238 @@
+import os
+import cv2
+import time
+import logging
+import numpy as np
+from urllib.parse import parse_qs
+
+logger = logging.getLogger(__name__)
+
+_IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+class _ReplaySource:
+    """
+    Fuente de captura que reemplaza a cv2.VideoCapture (misma interfaz:
+    isOpened, read, grab, retrieve, get, set, release) para poder ejecutar
+    el pipeline captura → análisis → emisión sin cámara.
+
+    read() respeta los FPS configurados (fps=0: tan rápido como sea posible)
+    y bloquea hasta el siguiente frame, igual que una cámara real.
+    """
+
+    def __init__(self, fps=30, loop=True):
+        self.fps = float(fps or 0)
+        self.loop = loop
+        self._interval = 1.0 / self.fps if self.fps > 0 else 0.0
+        self._next_due = None
+        self._opened = True
+        self.frames_served = 0
+
+    def _pace(self):
+        if not self._interval:
+            return
+        now = time.monotonic()
+        if self._next_due is None or now - self._next_due > 1.0:
+            self._next_due = now  # Primer frame o retraso grande: reiniciar reloj
+        elif self._next_due > now:
+            time.sleep(self._next_due - now)
+        self._next_due += self._interval
+
+    def _next_frame(self, image):
+        raise NotImplementedError
+
+    def isOpened(self):
+        return self._opened
+
+    def read(self, image=None):
+        if not self._opened:
+            return False, None
+        self._pace()
+        frame = self._next_frame(image)
+        if frame is None:
+            return False, None
+        self.frames_served += 1
+        return True, frame
+
+    def grab(self):
+        if not self._opened:
+            return False
+        self._pace()
+        self._grabbed = True
+        return True
+
+    def retrieve(self, image=None):
+        if not self._opened or not getattr(self, "_grabbed", False):
+            return False, None
+        self._grabbed = False
+        frame = self._next_frame(image)
+        if frame is None:
+            return False, None
+        self.frames_served += 1
+        return True, frame
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return self.width
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return self.height
+        return 0.0
+
+    def set(self, prop, value):
+        return False  # La resolución la define la grabación
+
+    def release(self):
+        self._opened = False
+
+
+def _into(image, frame):
+    """Copia frame sobre el buffer entregado por el llamador si es compatible"""
+    if image is not None and image.shape == frame.shape and image.dtype == frame.dtype:
+        np.copyto(image, frame)
+        return image
+    return frame
+
+
+class VideoFileSource(_ReplaySource):
+    """Reproduce un archivo de video grabado (vuelve al inicio al terminar)"""
+
+    def __init__(self, path, fps=None, loop=True):
+        self._cap = cv2.VideoCapture(path)
+        native_fps = self._cap.get(cv2.CAP_PROP_FPS) or 30
+        super().__init__(native_fps if fps is None else fps, loop)
+        self._opened = self._cap.isOpened()
+        self.width = self._cap.get(cv2.CAP_PROP_FRAME_WIDTH)
+        self.height = self._cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
+
+    def _next_frame(self, image):
+        ret, frame = self._cap.read(image) if image is not None else self._cap.read()
+        if not ret and self.loop:
+            self._cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self._cap.read(image) if image is not None else self._cap.read()
+        return frame if ret else None
+
+    def grab(self):
+        if not self._opened:
+            return False
+        self._pace()
+        ok = self._cap.grab()
+        if not ok and self.loop:
+            self._cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok = self._cap.grab()
+        return ok
+
+    def retrieve(self, image=None):
+        ret, frame = self._cap.retrieve(image) if image is not None else self._cap.retrieve()
+        if ret:
+            self.frames_served += 1
+        return ret, frame if ret else None
+
+    def release(self):
+        super().release()
+        self._cap.release()
+
+
+class ImageDirSource(_ReplaySource):
+    """Reproduce las imágenes de un directorio en orden alfabético"""
+
+    def __init__(self, path, fps=30, loop=True):
+        super().__init__(fps, loop)
+        self._files = sorted(os.path.join(path, f) for f in os.listdir(path)
+                             if f.lower().endswith(_IMAGE_EXTENSIONS))
+        self._pos = 0
+        self._opened = bool(self._files)
+        first = cv2.imread(self._files[0]) if self._files else None
+        self.height, self.width = first.shape[:2] if first is not None else (0, 0)
+
+    def _next_frame(self, image):
+        if self._pos >= len(self._files):
+            if not self.loop:
+                return None
+            self._pos = 0
+        frame = cv2.imread(self._files[self._pos])
+        self._pos += 1
+        return _into(image, frame) if frame is not None else None
+
+
+class SyntheticSource(_ReplaySource):
+    """Genera frames sintéticos (fondo fijo + figuras en movimiento)"""
+
+    def __init__(self, width=640, height=480, fps=30, faces=3):
+        super().__init__(fps, loop=True)
+        self.width, self.height = width, height
+        self._faces = faces
+        gradient = np.linspace(40, 200, width, dtype=np.uint8)
+        self._background = np.dstack([np.tile(gradient, (height, 1))] * 3)
+
+    def _next_frame(self, image):
+        frame = _into(image, self._background)
+        if frame is self._background:
+            frame = self._background.copy()
+        n = self.frames_served
+        for i in range(self._faces):
+            cx = int((self.width / (self._faces + 1)) * (i + 1) + 20 * np.sin((n + 10 * i) / 15.0))
+            cy = int(self.height / 2 + 10 * np.cos((n + 7 * i) / 20.0))
+            cv2.ellipse(frame, (cx, cy), (40, 52), 0, 0, 360, (170, 190, 225), -1)
+        cv2.putText(frame, f"Sintetico {n}", (10, self.height - 15),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 1)
+        return frame
+
+
+def parse_source_spec(spec):
+    """
+    Interpreta una fuente tipo "file:/ruta.mp4?fps=15", "dir:/frames?fps=0&loop=0"
+    o "synthetic:?fps=30&faces=5". Devuelve (tipo, ruta, parámetros).
+    """
+    kind, _, rest = spec.partition(":")
+    path, _, query = rest.partition("?")
+    params = {k: v[-1] for k, v in parse_qs(query).items()}
+    return kind.strip().lower(), path.strip(), params
+
+
+def parse_camera_sources(value):
+    """
+    Interpreta CAMERA_SOURCES: "100=file:/clase.mp4?fps=15;101=synthetic:"
+    Devuelve {índice: fuente}.
+    """
+    sources = {}
+    for item in (value or "").split(";"):
+        if "=" not in item:
+            continue
+        idx, spec = item.split("=", 1)
+        try:
+            sources[int(idx)] = spec.strip()
+        except ValueError:
+            logger.error(f"Índice de fuente inválido en CAMERA_SOURCES: {idx}")
+    return sources
+
+
+def open_replay_source(spec, width=640, height=480):
+    """Abre una fuente de reproducción; devuelve None si no es válida"""
+    try:
+        kind, path, params = parse_source_spec(spec)
+        fps = float(params["fps"]) if "fps" in params else None
+        loop = params.get("loop", "1") not in ("0", "false", "no")
+
+        if kind == "file":
+            source = VideoFileSource(path, fps=fps, loop=loop)
+        elif kind == "dir":
+            source = ImageDirSource(path, fps=30 if fps is None else fps, loop=loop)
+        elif kind == "synthetic":
+            source = SyntheticSource(width, height, fps=30 if fps is None else fps,
+                                     faces=int(params.get("faces", 3)))
+        else:
+            logger.error(f"Tipo de fuente desconocido: {kind}")
+            return None
+
+        if not source.isOpened():
+            logger.error(f"No se pudo abrir la fuente {spec}")
+            source.release()
+            return None
+        logger.info(f"✅ Fuente de reproducción abierta: {spec} ({source.fps or 'máx'} FPS)")
+        return source
+
+    except Exception as e:
+        logger.error(f"Error abriendo fuente {spec}: {e}")
+        return None
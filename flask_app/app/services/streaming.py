@@ -0,0 +1,231 @@
+import cv2
+import time
+import threading
+import logging
+import numpy as np
+from collections import OrderedDict
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+MJPEG_BOUNDARY = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
+
+
+def mjpeg_chunk(jpeg_bytes):
+    """Arma una parte del stream multipart/x-mixed-replace"""
+    return MJPEG_BOUNDARY + jpeg_bytes + b'\r\n'
+
+
+@lru_cache(maxsize=32)
+def placeholder_jpeg(lines, color=(255, 255, 255), size=(640, 480)):
+    """
+    JPEG de un frame negro con mensaje (sin cámara, error, etc.). Se genera
+    una sola vez por mensaje: lines debe ser una tupla para poder cachearlo.
+    """
+    image = np.zeros((size[1], size[0], 3), dtype=np.uint8)
+    for i, line in enumerate(lines):
+        cv2.putText(image, line, (50, 150 + i * 40),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
+    ret, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 85])
+    return buffer.tobytes() if ret else b''
+
+
+class MjpegBroadcaster:
+    """
+    Etapa única de codificación MJPEG.
+
+    Un solo hilo codificador llama a render(last_key) -> (key, imagen),
+    codifica la imagen a JPEG una vez y entrega los mismos bytes a todos los
+    clientes suscritos. Si render devuelve imagen None no hay nada nuevo que
+    codificar; si es bytes es un JPEG ya codificado (p.ej. placeholder_jpeg)
+    que se publica tal cual y deja al hilo en modo reposo (idle_interval)
+    hasta que aparezca un frame real; a los clientes se les reenvía ese mismo
+    chunk cada idle_interval, sin volver a codificarlo. Con wait(last_key, timeout) el hilo
+    duerme hasta que haya un frame nuevo en lugar de despertar a intervalo fijo,
+    sin codificar más de fps frames por segundo. Los clientes lentos no
+    acumulan cola: siempre reciben el último frame codificado. El hilo se
+    detiene solo cuando no quedan suscriptores.
+
+    snapshot() reutiliza el mismo JPEG para quien solo necesita una imagen
+    fija (codifica bajo demanda si no hay stream activo) y guarda unas pocas
+    versiones reducidas por ancho máximo.
+    """
+
+    SNAPSHOT_CACHE_SIZE = 4
+
+    def __init__(self, render, fps=30, quality=85, idle_timeout=5.0, name="MjpegEncoder", wait=None,
+                 idle_interval=1.0):
+        self._render = render
+        self._wait = wait
+        self._interval = 1.0 / fps
+        self._idle_interval = idle_interval
+        self._params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+        self._idle_timeout = idle_timeout
+        self._name = name
+
+        self._cond = threading.Condition()
+        self._render_lock = threading.Lock()  # render() no es reentrante (buffer propio)
+        self._thread = None
+        self._subscribers = 0
+        self._seq = 0
+        self._jpeg = None
+        self._chunk = None
+        self._key = None
+        self._static = False          # El último frame publicado es un placeholder
+        self._scaled = OrderedDict()  # ancho -> (seq, jpeg)
+
+    # -----------------------------
+    # Hilo codificador
+    # -----------------------------
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, daemon=True, name=self._name)
+            self._thread.start()
+
+    def _run(self):
+        logger.info("🎞️ Iniciando codificador MJPEG compartido")
+        last_key = None
+        idle_since = None
+        last_encode = 0.0
+
+        while True:
+            with self._cond:
+                if self._subscribers == 0:
+                    idle_since = idle_since or time.time()
+                    if time.time() - idle_since > self._idle_timeout:
+                        self._thread = None
+                        logger.info("🛑 Codificador MJPEG sin clientes, deteniendo")
+                        return
+                else:
+                    idle_since = None
+
+            # Como mucho fps codificaciones por segundo aunque la captura entregue más
+            pause = last_encode + self._interval - time.time()
+            if pause > 0:
+                time.sleep(pause)
+            last_encode = time.time()
+            try:
+                last_key = self._encode_latest()
+            except Exception as e:
+                logger.error(f"Error en codificador MJPEG: {e}")
+
+            # Mostrando un placeholder: revisar a baja frecuencia (wait despierta
+            # antes si llega un frame real)
+            interval = self._idle_interval if self._static else self._interval
+            if self._wait:
+                self._wait(last_key, interval)
+            else:
+                time.sleep(interval)
+
+    def _encode_latest(self):
+        """
+        Renderiza y codifica si hay algo más nuevo que lo último publicado.
+        Lo usan el hilo y snapshot(); cada frame se codifica una sola vez.
+        Devuelve la clave vigente.
+        """
+        with self._render_lock:
+            key, image = self._render(self._key)
+            if image is None:
+                return self._key
+            if isinstance(image, bytes):
+                self._static = True
+                self._publish(image, key)
+                return key
+            ret, buffer = cv2.imencode('.jpg', image, self._params)
+            if not ret:
+                logger.error("Error codificando frame como JPEG")
+                return self._key
+            self._static = False
+            self._publish(buffer.tobytes(), key)
+            return key
+
+    def _publish(self, jpeg_bytes, key=None):
+        with self._cond:
+            self._seq += 1
+            self._jpeg = jpeg_bytes
+            self._chunk = mjpeg_chunk(jpeg_bytes)
+            self._key = key
+            self._cond.notify_all()
+
+    # -----------------------------
+    # Clientes
+    # -----------------------------
+    def latest(self):
+        """Devuelve (seq, jpeg_bytes) del último frame codificado"""
+        with self._cond:
+            return self._seq, self._jpeg
+
+    def snapshot(self, max_width=None):
+        """
+        Devuelve (seq, jpeg_bytes) del frame más reciente. Si el hilo
+        codificador ya lo codificó se reutiliza tal cual; si no (sin clientes
+        de stream) se codifica una vez aquí. Con max_width se entrega una
+        versión reducida, guardada en caché mientras el frame no cambie.
+        """
+        self._encode_latest()
+        seq, jpeg = self.latest()
+        if jpeg is None or not max_width:
+            return seq, jpeg
+
+        with self._cond:
+            cached = self._scaled.get(max_width)
+            if cached and cached[0] == seq:
+                self._scaled.move_to_end(max_width)
+                return cached
+        image = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+        h, w = image.shape[:2]
+        if w <= max_width:
+            return seq, jpeg
+        small = cv2.resize(image, (max_width, max(1, round(h * max_width / w))),
+                           interpolation=cv2.INTER_AREA)
+        ret, buffer = cv2.imencode('.jpg', small, self._params)
+        if not ret:
+            return seq, jpeg
+        with self._cond:
+            self._scaled[max_width] = (seq, buffer.tobytes())
+            self._scaled.move_to_end(max_width)
+            while len(self._scaled) > self.SNAPSHOT_CACHE_SIZE:
+                self._scaled.popitem(last=False)
+            return self._scaled[max_width]
+
+    @property
+    def subscribers(self):
+        with self._cond:
+            return self._subscribers
+
+    def _follow(self, is_active):
+        """
+        Entrega (seq, jpeg, chunk) de cada frame nuevo mientras is_active().
+        Mientras se muestra un placeholder se reenvía el mismo chunk cada
+        idle_interval: el cliente sigue recibiendo datos (y los navegadores
+        que pintan un frame MJPEG recién al llegar el siguiente lo muestran).
+        """
+        with self._cond:
+            self._subscribers += 1
+            self._ensure_thread()
+        try:
+            last_seq = 0
+            while is_active():
+                with self._cond:
+                    timeout = self._idle_interval if self._static else 1.0
+                    fresh = self._cond.wait_for(lambda: self._seq != last_seq, timeout=timeout)
+                    if not fresh and not (self._static and self._chunk is not None):
+                        continue
+                    last_seq, jpeg, chunk = self._seq, self._jpeg, self._chunk
+                yield last_seq, jpeg, chunk
+        finally:
+            with self._cond:
+                self._subscribers -= 1
+
+    def frames(self, is_active=lambda: True):
+        """
+        Generador MJPEG para un cliente HTTP. Entrega cada frame codificado
+        (sin copiar ni re-codificar) mientras is_active() sea verdadero.
+        """
+        for _, _, chunk in self._follow(is_active):
+            yield chunk
+
+    def jpegs(self, is_active=lambda: True):
+        """Como frames(), pero entrega (seq, jpeg_bytes) sin el encabezado multipart"""
+        for seq, jpeg, _ in self._follow(is_active):
+            yield seq, jpeg
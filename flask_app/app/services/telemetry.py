@@ -0,0 +1,97 @@
+import time
+import threading
+from collections import deque
+
+# Límites superiores (ms) de los buckets del histograma de latencia de lectura
+READ_LATENCY_BUCKETS_MS = (5, 10, 20, 33, 50, 100, 250, 500, 1000)
+
+
+class CaptureStats:
+    """
+    Telemetría de salud de la captura de una cámara.
+
+    El hilo de captura registra cada lectura (latencia de cap.read() o de
+    grab()+retrieve(), éxito o fallo, frames descartados) y la API obtiene un
+    snapshot() con FPS real, contadores e histograma de latencia. Permite
+    distinguir si un dashboard lento se debe a la cámara (FPS bajo, lecturas
+    lentas o fallidas), a la CPU (frames descartados) o a la red (todo sano).
+    """
+
+    def __init__(self, fps_window=2.0):
+        self.fps_window = fps_window
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = time.time()
+            self.frames = 0
+            self.failed_reads = 0
+            self.consecutive_failures = 0
+            self.dropped_frames = 0   # Leídos pero sin slot libre en el buffer (consumidores lentos)
+            self.stale_frames = 0     # Descartados por estar encolados en el driver (baja latencia)
+            self.last_frame_at = None
+            self._stamps = deque(maxlen=512)
+            self._latency_max_ms = 0.0
+            self._latency_sum_ms = 0.0
+            self._histogram = [0] * (len(READ_LATENCY_BUCKETS_MS) + 1)
+
+    def _record_latency(self, latency_ms):
+        bucket = len(READ_LATENCY_BUCKETS_MS)
+        for i, limit in enumerate(READ_LATENCY_BUCKETS_MS):
+            if latency_ms <= limit:
+                bucket = i
+                break
+        self._histogram[bucket] += 1
+        self._latency_sum_ms += latency_ms
+        self._latency_max_ms = max(self._latency_max_ms, latency_ms)
+
+    def record_frame(self, latency, dropped=False, stale=0, now=None):
+        """Lectura exitosa; latency en segundos"""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._record_latency(latency * 1000.0)
+            self.frames += 1
+            self.consecutive_failures = 0
+            self.dropped_frames += int(dropped)
+            self.stale_frames += stale
+            self.last_frame_at = now
+            self._stamps.append(now)
+
+    def record_failure(self, latency=0.0):
+        """Lectura fallida (ret False, frame vacío o excepción)"""
+        with self._lock:
+            self._record_latency(latency * 1000.0)
+            self.failed_reads += 1
+            self.consecutive_failures += 1
+
+    def fps(self, now=None):
+        """FPS reales en la ventana reciente (0 si no llegan frames)"""
+        now = time.time() if now is None else now
+        with self._lock:
+            recent = [t for t in self._stamps if now - t <= self.fps_window]
+        if len(recent) < 2:
+            return 0.0
+        return (len(recent) - 1) / max(recent[-1] - recent[0], 1e-6)
+
+    def snapshot(self, now=None):
+        now = time.time() if now is None else now
+        fps = self.fps(now)
+        with self._lock:
+            reads = self.frames + self.failed_reads
+            labels = [f"<={limit}ms" for limit in READ_LATENCY_BUCKETS_MS] + [f">{READ_LATENCY_BUCKETS_MS[-1]}ms"]
+            return {
+                "fps": round(fps, 1),
+                "frames": self.frames,
+                "failed_reads": self.failed_reads,
+                "consecutive_failures": self.consecutive_failures,
+                "dropped_frames": self.dropped_frames,
+                "stale_frames": self.stale_frames,
+                "last_frame_age_s": round(now - self.last_frame_at, 2) if self.last_frame_at else None,
+                "read_latency_ms": {
+                    "mean": round(self._latency_sum_ms / reads, 2) if reads else None,
+                    "max": round(self._latency_max_ms, 2),
+                    "histogram": dict(zip(labels, self._histogram))
+                },
+                "uptime_s": round(now - self.started_at, 1)
+            }
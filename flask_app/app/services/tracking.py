@@ -0,0 +1,184 @@
+import itertools
+
+import cv2
+import numpy as np
+
+
+def iou(a, b):
+    """Intersección sobre unión de dos cajas {x, y, w, h}"""
+    ix = max(0, min(a["x"] + a["w"], b["x"] + b["w"]) - max(a["x"], b["x"]))
+    iy = max(0, min(a["y"] + a["h"], b["y"] + b["h"]) - max(a["y"], b["y"]))
+    inter = ix * iy
+    union = a["w"] * a["h"] + b["w"] * b["h"] - inter
+    return inter / union if union > 0 else 0.0
+
+
+class FaceTracker:
+    """
+    Seguimiento de caras entre ejecuciones del detector (detectar una vez,
+    seguir muchas).
+
+    El detector corre cada detect_every llamadas a update(), cuando no hay
+    caras o cuando alguna se pierde. Entre detecciones cada caja se desplaza
+    con flujo óptico (Lucas-Kanade) sobre puntos de su interior. Las
+    detecciones se asocian a las caras existentes por IoU, de modo que cada
+    estudiante conserva su track_id. Una cara que el detector no encuentra
+    se conserva (oculta) durante max_missed detecciones por si reaparece.
+    """
+
+    def __init__(self, detect_every=5, iou_threshold=0.3, max_missed=1, min_points=4):
+        self.detect_every = max(1, detect_every)
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.min_points = min_points
+        self.tracks = []   # {"track_id", "region", "confidence", "missed"}
+        self._ids = itertools.count(1)
+        self._prev_gray = None
+        self._countdown = 0
+        self.detections = 0
+        self.tracked_ticks = 0
+
+    def update(self, frame, detect):
+        """Caras visibles en frame: [{"region", "confidence", "track_id"}]"""
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        visible = [t for t in self.tracks if t["missed"] == 0]
+        can_track = (self._countdown > 0 and visible and self._prev_gray is not None
+                     and self._prev_gray.shape == gray.shape)
+        if can_track and self._propagate(self._prev_gray, gray, visible):
+            self._countdown -= 1
+            self.tracked_ticks += 1
+        else:
+            self._associate(detect(frame))
+            self._countdown = self.detect_every - 1
+            self.detections += 1
+        self._prev_gray = gray
+        return [{"region": dict(t["region"]), "confidence": t["confidence"], "track_id": t["track_id"]}
+                for t in self.tracks if t["missed"] == 0]
+
+    def reset(self):
+        self.tracks = []
+        self._prev_gray = None
+        self._countdown = 0
+
+    def _propagate(self, prev, gray, tracks):
+        """Mueve las cajas con la mediana del flujo óptico. False si alguna se pierde."""
+        h, w = gray.shape
+        moved = []
+        for track in tracks:
+            r = track["region"]
+            x, y = max(0, r["x"]), max(0, r["y"])
+            roi = prev[y:min(h, r["y"] + r["h"]), x:min(w, r["x"] + r["w"])]
+            if roi.size == 0:
+                return False
+            points = cv2.goodFeaturesToTrack(roi, maxCorners=30, qualityLevel=0.01, minDistance=3)
+            if points is None or len(points) < self.min_points:
+                return False
+            points = (points + np.array([x, y], dtype=np.float32)).astype(np.float32)
+            new_points, status, _ = cv2.calcOpticalFlowPyrLK(prev, gray, points, None,
+                                                             winSize=(15, 15), maxLevel=2)
+            ok = status.ravel() == 1
+            if ok.sum() < self.min_points:
+                return False
+            dx, dy = np.median((new_points - points)[ok].reshape(-1, 2), axis=0)
+            nx, ny = int(round(r["x"] + dx)), int(round(r["y"] + dy))
+            # Más de la mitad de la cara fuera del frame: se considera perdida
+            visible_w = min(w, nx + r["w"]) - max(0, nx)
+            visible_h = min(h, ny + r["h"]) - max(0, ny)
+            if visible_w < r["w"] / 2 or visible_h < r["h"] / 2:
+                return False
+            moved.append((track, dict(r, x=nx, y=ny)))
+        for track, region in moved:
+            track["region"] = region
+        return True
+
+    def _associate(self, detections):
+        """Asigna detecciones a tracks por IoU (greedy); las sobrantes crean tracks nuevos"""
+        pairs = sorted(((iou(t["region"], d["region"]), ti, di)
+                        for ti, t in enumerate(self.tracks) for di, d in enumerate(detections)),
+                       reverse=True)
+        matched_tracks, matched_dets = set(), set()
+        for score, ti, di in pairs:
+            if score < self.iou_threshold:
+                break
+            if ti in matched_tracks or di in matched_dets:
+                continue
+            matched_tracks.add(ti)
+            matched_dets.add(di)
+            self.tracks[ti].update(region=dict(detections[di]["region"]),
+                                   confidence=detections[di].get("confidence", 1.0), missed=0)
+
+        kept = []
+        for ti, track in enumerate(self.tracks):
+            if ti not in matched_tracks:
+                track["missed"] += 1
+            if track["missed"] <= self.max_missed:
+                kept.append(track)
+        for di, det in enumerate(detections):
+            if di not in matched_dets:
+                kept.append({"track_id": next(self._ids), "region": dict(det["region"]),
+                             "confidence": det.get("confidence", 1.0), "missed": 0})
+        self.tracks = kept
+
+    def info(self):
+        return {
+            "tracks": sum(1 for t in self.tracks if t["missed"] == 0),
+            "detections": self.detections,
+            "tracked_ticks": self.tracked_ticks
+        }
+
+
+class TrackAttributeCache:
+    """
+    Atributos que no cambian durante la clase (género) guardados por track_id.
+
+    La emoción se clasifica en cada tick; el género solo la primera vez que
+    aparece una cara, cada refresh_seconds o mientras su confianza sea menor
+    que min_confidence. El resto de los ticks se copia el último valor, lo que
+    ahorra un forward del modelo de género por cara.
+    """
+
+    def __init__(self, refresh_seconds=60.0, min_confidence=80.0, attributes=("gender",)):
+        self.refresh_seconds = refresh_seconds
+        self.min_confidence = min_confidence
+        self.attributes = attributes
+        self._cache = {}   # track_id -> {"seen": ts, atributo: {"value", "dominant", "at"}}
+        self.inferred = 0
+        self.reused = 0
+
+    def _stale(self, entry, attribute, now):
+        cached = entry.get(attribute)
+        return (cached is None or now - cached["at"] >= self.refresh_seconds
+                or cached["value"].get(cached["dominant"], 0.0) < self.min_confidence)
+
+    def classify(self, classifier, frame, faces, now, actions=("emotion", "gender")):
+        """Clasifica las caras pidiendo solo los atributos vencidos y completa el resto desde la caché"""
+        fast = tuple(a for a in actions if a not in self.attributes)
+        groups = {}
+        for face in faces:
+            entry = self._cache.setdefault(face.get("track_id"), {})
+            entry["seen"] = now
+            stale = tuple(a for a in actions if a in self.attributes and self._stale(entry, a, now))
+            groups.setdefault(fast + stale, []).append(face)
+
+        requests = [(frame, group, group_actions) for group_actions, group in groups.items()]
+        results = []
+        for (_, group, group_actions), group_results in zip(requests, classifier.classify_many(requests)):
+            for face, result in zip(group, group_results):
+                entry = self._cache[face.get("track_id")]
+                for attribute in (a for a in actions if a in self.attributes):
+                    if attribute in group_actions and attribute in result:
+                        entry[attribute] = {"value": result[attribute], "at": now,
+                                            "dominant": result[f"dominant_{attribute}"]}
+                        self.inferred += 1
+                    elif entry.get(attribute):
+                        result[attribute] = entry[attribute]["value"]
+                        result[f"dominant_{attribute}"] = entry[attribute]["dominant"]
+                        self.reused += 1
+                results.append(result)
+        self._prune(now)
+        return results
+
+    def _prune(self, now):
+        # Tracks que no se ven hace rato ya no vuelven (el tracker les da otro id)
+        for track_id in [t for t, e in self._cache.items() if now - e["seen"] > max(self.refresh_seconds, 10.0)]:
+            del self._cache[track_id]
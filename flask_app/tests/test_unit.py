@@ -33,6 +33,100 @@ try:
 except ImportError:
     LIVIANO_AVAILABLE = False
 
+try:
+    from app.services.frame_buffer import FrameRing
+    FRAME_RING_AVAILABLE = True
+except ImportError:
+    FRAME_RING_AVAILABLE = False
+
+try:
+    from app.services.streaming import MjpegBroadcaster, placeholder_jpeg
+    STREAMING_AVAILABLE = True
+except ImportError:
+    STREAMING_AVAILABLE = False
+
+try:
+    from app.services import camera as camera_service
+    from app.services import camera_registry
+    CAMERA_SERVICE_AVAILABLE = True
+except ImportError:
+    CAMERA_SERVICE_AVAILABLE = False
+
+try:
+    from app.services.sources import open_replay_source, parse_camera_sources
+    SOURCES_AVAILABLE = True
+except ImportError:
+    SOURCES_AVAILABLE = False
+
+try:
+    from app.services.motion import SceneChangeGate
+    MOTION_AVAILABLE = True
+except ImportError:
+    MOTION_AVAILABLE = False
+
+try:
+    from app.services.telemetry import CaptureStats
+    TELEMETRY_AVAILABLE = True
+except ImportError:
+    TELEMETRY_AVAILABLE = False
+
+try:
+    from app.services import frame_push
+    FRAME_PUSH_AVAILABLE = True
+except ImportError:
+    FRAME_PUSH_AVAILABLE = False
+
+try:
+    from app.services.annotation import annotation_faces, draw_overlays, EMOTION_COLORS
+    ANNOTATION_AVAILABLE = True
+except ImportError:
+    ANNOTATION_AVAILABLE = False
+
+try:
+    from app.services.recorder import SessionRecorder, load_manifest, list_recorded_sessions
+    RECORDER_AVAILABLE = True
+except ImportError:
+    RECORDER_AVAILABLE = False
+
+try:
+    from app.services import engines as engines_service
+    from app.services.engines import OnnxEngine, create_engine, EMOTION_LABELS
+    import onnx
+    import onnxruntime
+    ONNX_ENGINE_AVAILABLE = True
+except ImportError:
+    ONNX_ENGINE_AVAILABLE = False
+
+try:
+    from app.services.tracking import FaceTracker, TrackAttributeCache, iou
+    TRACKING_AVAILABLE = True
+except ImportError:
+    TRACKING_AVAILABLE = False
+
+try:
+    from app.services.inference_pool import PooledEngine
+    INFERENCE_POOL_AVAILABLE = True
+except ImportError:
+    INFERENCE_POOL_AVAILABLE = False
+
+try:
+    from app.services.scheduler import AnalysisScheduler
+    SCHEDULER_AVAILABLE = True
+except ImportError:
+    SCHEDULER_AVAILABLE = False
+
+try:
+    from app.services import analysis as analysis_service
+    ANALYSIS_AVAILABLE = True
+except ImportError:
+    ANALYSIS_AVAILABLE = False
+
+try:
+    from app.services import benchmark
+    BENCHMARK_AVAILABLE = True
+except ImportError:
+    BENCHMARK_AVAILABLE = False
+
 class TestUtilityFunctions(unittest.TestCase):
     """Tests para funciones utilitarias"""
     
@@ -290,6 +384,1141 @@ class TestPerformance(unittest.TestCase):
         # Debería completarse en menos de 0.5 segundos
         self.assertLess(execution_time, 0.5)
 
+class TestFrameRing(unittest.TestCase):
+    """Tests para el buffer circular de frames de la cámara"""
+    
+    @unittest.skipUnless(FRAME_RING_AVAILABLE, "app.services.frame_buffer no disponible")
+    def test_acquire_returns_latest_read_only_view(self):
+        """Test: El consumidor recibe el último frame sin copia y de solo lectura"""
+        ring = FrameRing(slots=3)
+        frame = np.full((4, 4, 3), 7, dtype=np.uint8)
+        idx, buf = ring.claim()
+        self.assertIsNone(buf)
+        seq = ring.commit(idx, frame)
+        
+        with ring.acquire() as (got_seq, view, _):
+            self.assertEqual(got_seq, seq)
+            self.assertTrue(np.shares_memory(view, frame))
+            self.assertFalse(view.flags.writeable)
+        
+        # Sin frame nuevo después de seq
+        with ring.acquire(after_seq=seq) as (_, view, _):
+            self.assertIsNone(view)
+    
+    @unittest.skipUnless(FRAME_RING_AVAILABLE, "app.services.frame_buffer no disponible")
+    def test_pinned_slot_is_not_reused(self):
+        """Test: Un slot tomado por un consumidor no se sobrescribe"""
+        ring = FrameRing(slots=2)
+        ring.publish(np.zeros((2, 2, 3), dtype=np.uint8))
+        with ring.acquire() as (_, view, _):
+            for value in range(1, 5):
+                ring.publish(np.full((2, 2, 3), value, dtype=np.uint8))
+            self.assertEqual(int(view.max()), 0)
+        with ring.acquire() as (_, view, _):
+            self.assertIsNotNone(view)
+    
+    @unittest.skipUnless(FRAME_RING_AVAILABLE, "app.services.frame_buffer no disponible")
+    def test_clear_hides_frame(self):
+        """Test: clear() deja el buffer sin frame disponible"""
+        ring = FrameRing()
+        ring.publish(np.zeros((2, 2, 3), dtype=np.uint8))
+        self.assertTrue(ring.has_frame())
+        ring.clear()
+        self.assertFalse(ring.has_frame())
+        with ring.acquire() as (_, view, _):
+            self.assertIsNone(view)
+
+    @unittest.skipUnless(FRAME_RING_AVAILABLE, "app.services.frame_buffer no disponible")
+    def test_wait_wakes_on_commit(self):
+        """Test: wait() despierta cuando se publica un frame nuevo"""
+        import threading
+        ring = FrameRing()
+        self.assertEqual(ring.wait(0, timeout=0.01), 0)
+        
+        timer = threading.Timer(0.05, ring.publish, args=(np.zeros((2, 2, 3), dtype=np.uint8),))
+        timer.start()
+        self.assertEqual(ring.wait(0, timeout=5), 1)
+        timer.join()
+
+class TestMjpegBroadcaster(unittest.TestCase):
+    """Tests para el codificador MJPEG compartido"""
+    
+    @unittest.skipUnless(STREAMING_AVAILABLE, "app.services.streaming no disponible")
+    def test_same_bytes_for_all_clients(self):
+        """Test: Cada frame se codifica una sola vez para N clientes"""
+        calls = []
+        
+        def render(last_key):
+            calls.append(last_key)
+            if last_key == 1:
+                return 1, None
+            return 1, np.zeros((48, 64, 3), dtype=np.uint8)
+        
+        broadcaster = MjpegBroadcaster(render, fps=100, idle_timeout=0.1)
+        clients = [broadcaster.frames() for _ in range(3)]
+        chunks = [next(c) for c in clients]
+        
+        self.assertTrue(all(c is chunks[0] for c in chunks))
+        self.assertTrue(chunks[0].startswith(b'--frame'))
+        self.assertEqual(broadcaster.latest()[0], 1)
+        self.assertEqual(calls.count(None), 1)
+        for c in clients:
+            c.close()
+        self.assertEqual(broadcaster.subscribers, 0)
+    
+    @unittest.skipUnless(STREAMING_AVAILABLE, "app.services.streaming no disponible")
+    def test_encode_rate_capped_at_fps(self):
+        """Test: Aunque wait() entregue frames sin pausa, no se codifican más de fps por segundo"""
+        import time, itertools
+        keys = itertools.count(1)
+        broadcaster = MjpegBroadcaster(lambda last_key: (next(keys), np.zeros((8, 8, 3), dtype=np.uint8)),
+                                       fps=10, idle_timeout=0.1, wait=lambda last_key, timeout: None)
+        frames = broadcaster.frames()
+        next(frames)
+        start_seq = broadcaster.latest()[0]
+        time.sleep(0.5)
+        self.assertLessEqual(broadcaster.latest()[0] - start_seq, 6)
+        frames.close()
+    
+    @unittest.skipUnless(STREAMING_AVAILABLE, "app.services.streaming no disponible")
+    def test_snapshot_encodes_once_and_caches_scaled(self):
+        """Test: Snapshot sin stream codifica una vez por frame y guarda la versión reducida"""
+        frame = {"key": 1}
+        encoded = []
+        
+        def render(last_key):
+            if last_key == frame["key"]:
+                return last_key, None
+            encoded.append(frame["key"])
+            return frame["key"], np.full((120, 160, 3), 80, dtype=np.uint8)
+        
+        broadcaster = MjpegBroadcaster(render)
+        seq, jpeg = broadcaster.snapshot()
+        self.assertTrue(jpeg.startswith(b'\xff\xd8'))
+        self.assertEqual(broadcaster.snapshot(), (seq, jpeg))
+        
+        small = broadcaster.snapshot(max_width=40)
+        self.assertIs(broadcaster.snapshot(max_width=40)[1], small[1])
+        self.assertEqual(small[0], seq)
+        self.assertEqual(encoded, [1])
+        
+        frame["key"] = 2
+        self.assertEqual(broadcaster.snapshot(max_width=40)[0], seq + 1)
+    
+    @unittest.skipUnless(STREAMING_AVAILABLE and CAMERA_SERVICE_AVAILABLE, "app.services no disponible")
+    def test_placeholder_published_once_and_idle(self):
+        """Test: Sin cámara el placeholder se publica una vez y se reenvía a ~1 fps; un frame real lo reemplaza al instante"""
+        import time
+        worker = camera_service.CameraWorker(196)
+        broadcaster = camera_service.stream_broadcaster(worker, "clean")
+        frames = broadcaster.jpegs()
+        seq, jpeg = next(frames)
+        self.assertIs(jpeg, placeholder_jpeg(("Camara no configurada", "Configure la camara primero")))
+        
+        # En reposo se reenvía el mismo placeholder (sin publicarlo ni codificarlo de nuevo)
+        start = time.time()
+        self.assertEqual(next(frames), (seq, jpeg))
+        self.assertGreater(time.time() - start, 0.5)
+        self.assertEqual(broadcaster.latest()[0], seq)
+        
+        start = time.time()
+        worker.ring.publish(np.zeros((48, 64, 3), dtype=np.uint8))
+        self.assertEqual(next(frames)[0], seq + 1)
+        self.assertLess(time.time() - start, 0.5)  # No espera el intervalo de reposo
+        frames.close()
+
+class TestCameraRegistry(unittest.TestCase):
+    """Tests para la caché de detección de cámaras"""
+    
+    @unittest.skipUnless(CAMERA_SERVICE_AVAILABLE, "app.services.camera no disponible")
+    @patch('cv2.VideoCapture')
+    def test_detect_cameras_skips_in_use(self, mock_video_capture):
+        """Test: No se reabre la cámara que usa el hilo de captura"""
+        mock_cap = MagicMock()
+        mock_cap.isOpened.return_value = False
+        mock_video_capture.return_value = mock_cap
+        
+        cameras = camera_service.detect_cameras(max_idx=3, in_use=[1])
+        
+        self.assertIn(1, cameras)
+        opened = [c.args[0] for c in mock_video_capture.call_args_list]
+        self.assertNotIn(1, opened)
+    
+    @unittest.skipUnless(CAMERA_SERVICE_AVAILABLE, "app.services.camera no disponible")
+    def test_available_cameras_served_from_cache(self):
+        """Test: Las rutas leen la caché sin probar dispositivos"""
+        with patch.object(camera_registry, 'detect_cameras') as mock_detect:
+            with camera_registry.registry_lock:
+                previous = camera_registry.registry_state["cameras"]
+                camera_registry.registry_state["cameras"] = [2, 0]
+            try:
+                self.assertEqual(camera_registry.get_available_cameras(), [0, 2])
+            finally:
+                with camera_registry.registry_lock:
+                    camera_registry.registry_state["cameras"] = previous
+            mock_detect.assert_not_called()
+
+class TestFormatNegotiation(unittest.TestCase):
+    """Tests para la negociación de formato de píxel (V4L2)"""
+    
+    @unittest.skipUnless(CAMERA_SERVICE_AVAILABLE, "app.services.camera no disponible")
+    def test_falls_back_to_yuyv_when_mjpg_rejected(self):
+        """Test: Si el driver no acepta MJPG se usa YUYV"""
+        import cv2
+        props = {}
+        yuyv = cv2.VideoWriter_fourcc(*'YUYV')
+        
+        def fake_set(prop, value):
+            if prop == cv2.CAP_PROP_FOURCC and value != yuyv:
+                return False
+            props[prop] = value
+            return True
+        
+        cap = MagicMock()
+        cap.set.side_effect = fake_set
+        cap.get.side_effect = lambda prop: props.get(prop, 0)
+        
+        fmt = camera_service._negotiate_format(cap, 91, cv2.CAP_V4L2, 1280, 720, 30)
+        self.assertEqual(fmt, {"fourcc": "YUYV", "width": 1280, "height": 720, "fps": 30.0})
+    
+    @unittest.skipUnless(CAMERA_SERVICE_AVAILABLE, "app.services.camera no disponible")
+    def test_linux_prefers_v4l2(self):
+        """Test: En Linux el primer backend es V4L2"""
+        import cv2
+        self.assertEqual(camera_service._platform_backends("linux")[0], cv2.CAP_V4L2)
+        self.assertEqual(camera_service._platform_backends("win32")[0], cv2.CAP_MSMF)
+
+class TestReplaySources(unittest.TestCase):
+    """Tests para las fuentes de captura sin cámara"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+    
+    @unittest.skipUnless(SOURCES_AVAILABLE, "app.services.sources no disponible")
+    def test_parse_camera_sources(self):
+        """Test: Formato de CAMERA_SOURCES"""
+        sources = parse_camera_sources("100=file:/x.mp4?fps=15; 101=synthetic:;bad")
+        self.assertEqual(sources, {100: "file:/x.mp4?fps=15", 101: "synthetic:"})
+    
+    @unittest.skipUnless(SOURCES_AVAILABLE, "app.services.sources no disponible")
+    def test_image_dir_source_loops(self):
+        """Test: El directorio de imágenes se reproduce en orden y en bucle"""
+        import cv2
+        for i in range(2):
+            cv2.imwrite(os.path.join(self.temp_dir, f"{i}.png"), np.full((8, 8, 3), i * 100, dtype=np.uint8))
+        
+        source = open_replay_source(f"dir:{self.temp_dir}?fps=0")
+        values = [int(source.read()[1][0, 0, 0]) for _ in range(3)]
+        self.assertEqual(values, [0, 100, 0])
+        
+        source = open_replay_source(f"dir:{self.temp_dir}?fps=0&loop=0")
+        self.assertEqual([source.read()[0] for _ in range(3)], [True, True, False])
+    
+    @unittest.skipUnless(SOURCES_AVAILABLE and CAMERA_SERVICE_AVAILABLE, "app.services no disponible")
+    def test_synthetic_source_feeds_capture_thread(self):
+        """Test: Una fuente sintética alimenta el hilo de captura como una cámara"""
+        import time
+        worker = camera_service.start_camera_worker(190, "320x240", source="synthetic:?fps=0")
+        try:
+            deadline = time.time() + 5
+            while worker.ring.seq < 5 and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertGreaterEqual(worker.ring.seq, 5)
+            with worker.ring.acquire() as (_, frame, _ts):
+                self.assertEqual(frame.shape, (240, 320, 3))
+        finally:
+            camera_service.stop_camera_worker(190)
+
+    @unittest.skipUnless(SOURCES_AVAILABLE and CAMERA_SERVICE_AVAILABLE, "app.services no disponible")
+    def test_capture_publishes_analysis_frame(self):
+        """Test: La captura genera el frame reducido de análisis con el mismo seq"""
+        import time
+        worker = camera_service.start_camera_worker(191, "1280x720", source="synthetic:?fps=0")
+        try:
+            deadline = time.time() + 5
+            while worker.ring.seq < 3 and time.time() < deadline:
+                time.sleep(0.01)
+            ring = camera_service.frame_level(worker, "analysis")
+            self.assertIs(ring, worker.analysis_ring)
+            with ring.acquire() as (seq, small, _):
+                self.assertEqual(small.shape, (360, 640, 3))
+                self.assertGreater(seq, 0)
+        finally:
+            camera_service.stop_camera_worker(191)
+            worker.thread.join(timeout=5)
+        # El nivel reducido lleva el seq que asignó el commit del frame completo
+        self.assertEqual(worker.analysis_ring.seq, worker.ring.seq)
+
+class TestLowLatencyCapture(unittest.TestCase):
+    """Tests para el modo de captura de baja latencia (grab/retrieve)"""
+    
+    @unittest.skipUnless(CAMERA_SERVICE_AVAILABLE, "app.services.camera no disponible")
+    def test_grab_latest_drains_buffered_frames(self):
+        """Test: Los grab() instantáneos (frames encolados) se descartan hasta el frame en vivo"""
+        import time
+        queued = [True, True, True]
+        
+        def fake_grab():
+            if queued:
+                queued.pop()
+            else:
+                time.sleep(0.02)  # Cola vacía: el driver bloquea hasta el siguiente frame
+            return True
+        
+        cap = MagicMock()
+        cap.grab.side_effect = fake_grab
+        ok, dropped, stamp = camera_service._grab_latest(cap)
+        self.assertTrue(ok)
+        self.assertEqual(dropped, 3)
+        self.assertEqual(cap.grab.call_count, 4)
+        self.assertAlmostEqual(stamp, time.time(), delta=0.5)
+    
+    @unittest.skipUnless(CAMERA_SERVICE_AVAILABLE, "app.services.camera no disponible")
+    def test_grab_failure(self):
+        """Test: Sin frame disponible se informa el fallo"""
+        cap = MagicMock()
+        cap.grab.return_value = False
+        self.assertEqual(camera_service._grab_latest(cap), (False, 0, None))
+    
+    @unittest.skipUnless(SOURCES_AVAILABLE and CAMERA_SERVICE_AVAILABLE, "app.services no disponible")
+    def test_low_latency_worker_reports_frame_age(self):
+        """Test: En modo baja latencia la captura funciona y se mide la edad del frame"""
+        import time
+        camera_service.configure_capture(low_latency=True)
+        worker = camera_service.start_camera_worker(192, "320x240", source="synthetic:?fps=0")
+        try:
+            deadline = time.time() + 5
+            while worker.ring.seq < 3 and time.time() < deadline:
+                time.sleep(0.01)
+            with worker.ring.acquire() as (_, frame, captured_at):
+                self.assertEqual(frame.shape, (240, 320, 3))
+                age = camera_service.record_frame_age(worker, "test", captured_at)
+            self.assertGreaterEqual(age, 0.0)
+            info = camera_service.get_camera_info(worker)
+            self.assertTrue(info["low_latency"])
+            self.assertGreater(info["capture_stats"]["frames"], 0)
+            self.assertIn("test", info["frame_age_ms"])
+        finally:
+            camera_service.stop_camera_worker(192)
+            camera_service.configure_capture(low_latency=False)
+
+class TestSceneChangeGate(unittest.TestCase):
+    """Tests para el filtro de cambios de escena previo a la inferencia"""
+    
+    @unittest.skipUnless(MOTION_AVAILABLE, "app.services.motion no disponible")
+    def test_static_scene_is_skipped(self):
+        """Test: Escena estática se omite y un cambio fuerte se analiza"""
+        gate = SceneChangeGate(threshold=4.0, max_skip=60)
+        frame = np.full((480, 640, 3), 100, dtype=np.uint8)
+        
+        self.assertTrue(gate.should_analyze(frame, now=0))
+        self.assertFalse(gate.should_analyze(frame + 1, now=1))
+        self.assertTrue(gate.should_analyze(frame + 50, now=2))
+        self.assertEqual((gate.analyzed, gate.skipped), (2, 1))
+    
+    @unittest.skipUnless(MOTION_AVAILABLE, "app.services.motion no disponible")
+    def test_max_skip_forces_analysis(self):
+        """Test: Tras max_skip segundos se fuerza un análisis"""
+        gate = SceneChangeGate(threshold=4.0, max_skip=5)
+        frame = np.zeros((48, 64, 3), dtype=np.uint8)
+        gate.should_analyze(frame, now=0)
+        self.assertFalse(gate.should_analyze(frame, now=4))
+        self.assertTrue(gate.should_analyze(frame, now=5))
+
+class TestCaptureStats(unittest.TestCase):
+    """Tests para la telemetría de salud de la captura"""
+    
+    @unittest.skipUnless(TELEMETRY_AVAILABLE, "app.services.telemetry no disponible")
+    def test_counters_and_histogram(self):
+        """Test: Lecturas exitosas, fallidas y descartadas con su latencia"""
+        stats = CaptureStats()
+        stats.record_frame(0.004, now=100.0)
+        stats.record_frame(0.030, dropped=True, stale=2, now=100.1)
+        stats.record_failure(2.0)
+        
+        snap = stats.snapshot(now=100.1)
+        self.assertEqual((snap["frames"], snap["failed_reads"]), (2, 1))
+        self.assertEqual((snap["dropped_frames"], snap["stale_frames"]), (1, 2))
+        self.assertEqual(snap["consecutive_failures"], 1)
+        histogram = snap["read_latency_ms"]["histogram"]
+        self.assertEqual((histogram["<=5ms"], histogram["<=33ms"], histogram[">1000ms"]), (1, 1, 1))
+        self.assertEqual(snap["read_latency_ms"]["max"], 2000.0)
+    
+    @unittest.skipUnless(TELEMETRY_AVAILABLE, "app.services.telemetry no disponible")
+    def test_fps_window(self):
+        """Test: FPS real sobre la ventana reciente; 0 si dejan de llegar frames"""
+        stats = CaptureStats(fps_window=2.0)
+        for i in range(31):
+            stats.record_frame(0.01, now=10.0 + i / 30.0)
+        self.assertAlmostEqual(stats.fps(now=11.0), 30.0, places=1)
+        self.assertEqual(stats.fps(now=20.0), 0.0)
+
+class TestSocketFramePush(unittest.TestCase):
+    """Tests para el envío de frames por Socket.IO limitado por acks"""
+    
+    @unittest.skipUnless(FRAME_PUSH_AVAILABLE, "app.services.frame_push no disponible")
+    def test_one_frame_in_flight_until_ack(self):
+        """Test: Un cliente sin ack se salta frames; con ack vuelve a recibir"""
+        frame_push.push_state["clients"]["sid-a"] = frame_push._client_state(193, max_fps=0)
+        try:
+            self.assertEqual(frame_push._ready_clients(193, 1, now=10.0), ["sid-a"])
+            self.assertEqual(frame_push._ready_clients(193, 2, now=10.1), [])
+            
+            frame_push._on_ack("sid-a", 1)
+            self.assertEqual(frame_push._ready_clients(193, 3, now=10.2), ["sid-a"])
+            # Ack perdido: pasado ACK_TIMEOUT se vuelve a enviar
+            self.assertEqual(frame_push._ready_clients(193, 4, now=10.2 + frame_push.ACK_TIMEOUT), ["sid-a"])
+            
+            info = frame_push.get_push_info(193)["sid-a"]
+            self.assertEqual((info["sent"], info["skipped"]), (3, 1))
+            self.assertIsNotNone(info["rtt_ms"])
+        finally:
+            frame_push.unsubscribe_frames("sid-a")
+    
+    @unittest.skipUnless(FRAME_PUSH_AVAILABLE, "app.services.frame_push no disponible")
+    def test_max_fps_limit(self):
+        """Test: Se respeta el máximo de FPS por cliente aunque confirme al instante"""
+        frame_push.push_state["clients"]["sid-b"] = frame_push._client_state(194, max_fps=10)
+        try:
+            self.assertEqual(frame_push._ready_clients(194, 1, now=20.0), ["sid-b"])
+            frame_push._on_ack("sid-b", 1)
+            self.assertEqual(frame_push._ready_clients(194, 2, now=20.05), [])
+            self.assertEqual(frame_push._ready_clients(194, 3, now=20.1), ["sid-b"])
+        finally:
+            frame_push.unsubscribe_frames("sid-b")
+
+    @unittest.skipUnless(FRAME_PUSH_AVAILABLE, "app.services.frame_push no disponible")
+    def test_unknown_camera_not_created(self):
+        """Test: Suscribirse a una cámara no configurada falla sin crear su worker"""
+        from app.services.camera import get_camera_worker
+        with self.assertRaises(KeyError):
+            frame_push.subscribe_frames("sid-c", 195)
+        self.assertIsNone(get_camera_worker(195, create=False))
+        self.assertFalse(frame_push.unsubscribe_frames("sid-c"))
+
+class TestAnnotationStage(unittest.TestCase):
+    """Tests para la etapa compartida de overlays del stream"""
+    
+    @unittest.skipUnless(ANNOTATION_AVAILABLE, "app.services.annotation no disponible")
+    def test_annotation_faces_from_results(self):
+        """Test: Resultados de DeepFace se convierten a cajas con emoción en español"""
+        results = [
+            {"region": {"x": 10, "y": 20, "w": 30, "h": 40}, "dominant_emotion": "happy",
+             "emotion": {"happy": 91.5}, "dominant_gender": "Woman"},
+            {"region": {"x": 0, "y": 0, "w": 0, "h": 0}, "dominant_emotion": "sad"}
+        ]
+        faces = annotation_faces(results, {"happy": "feliz", "sad": "triste"})
+        self.assertEqual(faces, [{"region": {"x": 10, "y": 20, "w": 30, "h": 40},
+                                  "emotion": "feliz", "score": 91.5, "gender": "Woman"}])
+    
+    @unittest.skipUnless(ANNOTATION_AVAILABLE, "app.services.annotation no disponible")
+    def test_draw_overlays_scales_boxes(self):
+        """Test: Las cajas en resolución completa se escalan al frame de salida"""
+        image = np.zeros((120, 160, 3), dtype=np.uint8)
+        face = {"region": {"x": 100, "y": 100, "w": 100, "h": 100}, "emotion": "feliz", "score": 80.0}
+        draw_overlays(image, 7, [face], scale=0.5)
+        self.assertEqual(tuple(image[100, 75]), EMOTION_COLORS["feliz"])   # Borde inferior escalado
+        self.assertEqual(tuple(image[80, 80]), (0, 0, 0))                  # Interior sin pintar
+    
+    @unittest.skipUnless(ANNOTATION_AVAILABLE and CAMERA_SERVICE_AVAILABLE, "app.services no disponible")
+    def test_annotated_and_clean_variants(self):
+        """Test: Solo la variante anotada lleva overlays; la limpia es el frame tal cual"""
+        worker = camera_service.CameraWorker(195)
+        frame = np.full((240, 320, 3), 60, dtype=np.uint8)
+        worker.ring.publish(frame)
+        camera_service.publish_annotations(
+            worker, 1, [{"region": {"x": 40, "y": 40, "w": 80, "h": 80}, "emotion": "triste", "score": 75.0}], 320)
+        
+        _, clean = camera_service._render_stream_frame(worker, None, "clean")
+        np.testing.assert_array_equal(clean, frame)
+        _, annotated = camera_service._render_stream_frame(worker, None, "annotated")
+        self.assertEqual(tuple(annotated[120, 80]), EMOTION_COLORS["triste"])
+        with self.assertRaises(ValueError):
+            camera_service.stream_broadcaster(worker, "raw")
+
+class TestSessionRecorder(unittest.TestCase):
+    """Tests para la grabación segmentada de sesiones"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+    
+    @unittest.skipUnless(RECORDER_AVAILABLE, "app.services.recorder no disponible")
+    def test_segments_indexed_by_session(self):
+        """Test: Los frames se escriben en segmentos por tiempo y quedan en index.json"""
+        import cv2
+        recorder = SessionRecorder("clase_test", self.temp_dir, fps=10, segment_seconds=1, queue_size=100).start()
+        frame = np.full((48, 64, 3), 120, dtype=np.uint8)
+        accepted = [recorder.submit(frame, 100.0 + i * 0.1) for i in range(25)]
+        self.assertTrue(all(accepted))
+        self.assertFalse(recorder.submit(frame, 102.45))  # Más rápido que los FPS de grabación
+        recorder.stop()
+        
+        manifest = load_manifest(self.temp_dir, "clase_test")
+        self.assertFalse(manifest["recording"])
+        self.assertEqual([s["frames"] for s in manifest["segments"]], [10, 10, 5])
+        cap = cv2.VideoCapture(os.path.join(self.temp_dir, "clase_test", manifest["segments"][0]["file"]))
+        self.assertEqual(int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), 10)
+        cap.release()
+        self.assertEqual([m["session_id"] for m in list_recorded_sessions(self.temp_dir)], ["clase_test"])
+    
+    @unittest.skipUnless(RECORDER_AVAILABLE, "app.services.recorder no disponible")
+    def test_full_queue_drops_without_blocking(self):
+        """Test: Con la cola llena (disco lento) submit descarta en lugar de bloquear"""
+        recorder = SessionRecorder("lenta", self.temp_dir, fps=0, queue_size=2)
+        recorder._running = True  # Sin hilo escritor: nada vacía la cola
+        frame = np.zeros((8, 8, 3), dtype=np.uint8)
+        results = [recorder.submit(frame) for _ in range(5)]
+        self.assertEqual(results, [True, True, False, False, False])
+        self.assertEqual(recorder.dropped, 3)
+    
+    @unittest.skipUnless(RECORDER_AVAILABLE and SOURCES_AVAILABLE and CAMERA_SERVICE_AVAILABLE,
+                         "app.services no disponible")
+    def test_failed_recorder_detached_with_error(self):
+        """Test: Un grabador que muere por error de escritura se suelta y el error queda en get_camera_info"""
+        import time
+        worker = camera_service.start_camera_worker(202, "320x240", source="synthetic:?fps=60")
+        try:
+            failing = MagicMock()
+            failing.return_value.isOpened.return_value = False
+            with patch("app.services.recorder.cv2.VideoWriter", failing):
+                camera_service.start_camera_recording(202, "falla", self.temp_dir)
+                deadline = time.time() + 5
+                while worker.recorder is not None and time.time() < deadline:
+                    time.sleep(0.01)
+            info = camera_service.get_camera_info(worker)
+            self.assertIsNone(info["recording"])
+            self.assertIn("No se pudo abrir", info["recording_error"])
+            
+            camera_service.start_camera_recording(202, "nueva", self.temp_dir)
+            self.assertIsNone(camera_service.get_camera_info(worker)["recording_error"])
+        finally:
+            camera_service.stop_camera_worker(202)
+    
+    @unittest.skipUnless(RECORDER_AVAILABLE, "app.services.recorder no disponible")
+    def test_rejects_unsafe_session_id(self):
+        """Test: El id de sesión no puede salir de la carpeta de grabaciones"""
+        with self.assertRaises(ValueError):
+            SessionRecorder("../fuera", self.temp_dir)
+        self.assertIsNone(load_manifest(self.temp_dir, "../fuera"))
+
+class TestCameraSwitching(unittest.TestCase):
+    """Tests para la apertura en segundo plano y el cambio sin cortes de cámara"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+    
+    def _wait(self, condition, timeout=5.0):
+        import time
+        deadline = time.time() + timeout
+        while not condition() and time.time() < deadline:
+            time.sleep(0.005)
+        return condition()
+    
+    @unittest.skipUnless(SOURCES_AVAILABLE and CAMERA_SERVICE_AVAILABLE, "app.services no disponible")
+    def test_reconfigure_keeps_serving_until_swap(self):
+        """Test: Al cambiar de resolución no hay frames vacíos hasta que la nueva cámara está lista"""
+        worker = camera_service.start_camera_worker(197, "320x240", source="synthetic:?fps=60")
+        try:
+            self.assertTrue(self._wait(lambda: worker.ring.seq >= 3))
+            camera_service.configure_camera_worker(197, "640x480")
+            
+            gaps = 0
+            def swapped():
+                nonlocal gaps
+                gaps += not worker.ring.has_frame()
+                with worker.ring.acquire() as (_, frame, _ts):
+                    return frame is not None and frame.shape == (480, 640, 3)
+            self.assertTrue(self._wait(swapped))
+            self.assertEqual(gaps, 0)
+            self.assertEqual(camera_service.get_camera_info(worker)["format"]["width"], 640)
+        finally:
+            camera_service.stop_camera_worker(197)
+    
+    @unittest.skipUnless(SOURCES_AVAILABLE and CAMERA_SERVICE_AVAILABLE, "app.services no disponible")
+    def test_reopens_after_consecutive_failures(self):
+        """Test: Tras muchos fallos de lectura la cámara se cierra y se vuelve a abrir"""
+        import cv2
+        for i in range(3):
+            cv2.imwrite(os.path.join(self.temp_dir, f"{i}.png"), np.full((24, 32, 3), i * 50, dtype=np.uint8))
+        # Sin bucle: tras 3 frames las lecturas fallan hasta que se reabre la fuente
+        worker = camera_service.start_camera_worker(198, "32x24", source=f"dir:{self.temp_dir}?fps=0&loop=0")
+        try:
+            self.assertTrue(self._wait(lambda: worker.ring.seq >= 6, timeout=8))
+        finally:
+            camera_service.stop_camera_worker(198)
+    
+    @unittest.skipUnless(CAMERA_SERVICE_AVAILABLE, "app.services.camera no disponible")
+    def test_open_deadline_abandons_and_releases(self):
+        """Test: Una apertura que excede el plazo se abandona y el dispositivo se libera al terminar"""
+        import time
+        cap = MagicMock()
+        def slow_open(index, resolution, source=None):
+            time.sleep(0.3)
+            return cap, {"backend": "TEST"}, None
+        
+        worker = camera_service.get_camera_worker(199)
+        with patch.object(camera_service, "_open_camera", slow_open):
+            opener = camera_service._CameraOpener(worker, "640x480", timeout=0.05)
+            self.assertEqual(opener.poll()[0], False)
+            self.assertIn(199, camera_service.cameras_in_use())  # El registro no la prueba mientras abre
+            time.sleep(0.1)
+            done, new_cap, _, error = opener.poll()
+            # Abandonada pero aún abriendo: sigue ocupada hasta que se libere
+            self.assertIn(199, camera_service.cameras_in_use())
+        self.assertTrue(done)
+        self.assertIsNone(new_cap)
+        self.assertIn("Tiempo de apertura agotado", error)
+        self.assertTrue(self._wait(lambda: cap.release.called, timeout=2))
+        self.assertTrue(self._wait(lambda: 199 not in camera_service.cameras_in_use(), timeout=2))
+    
+    @unittest.skipUnless(SOURCES_AVAILABLE and CAMERA_SERVICE_AVAILABLE, "app.services no disponible")
+    def test_open_timeout_keeps_current_camera(self):
+        """Test: Un cambio cuya apertura vence el plazo no cierra la cámara en uso ni reabre en exclusivo"""
+        import time
+        real_open, attempts = camera_service._open_camera, []
+        def open_camera(index, resolution, source=None):
+            if resolution == "640x480":
+                attempts.append(resolution)
+                time.sleep(0.5)
+            return real_open(index, resolution, source)
+        
+        with patch.object(camera_service, "_open_camera", open_camera), \
+             patch.dict(camera_service.capture_settings, {"open_timeout": 0.1, "open_retry_interval": 30.0}):
+            worker = camera_service.start_camera_worker(200, "320x240", source="synthetic:?fps=60")
+            try:
+                self.assertTrue(self._wait(lambda: worker.ring.seq >= 3))
+                camera_service.configure_camera_worker(200, "640x480")
+                self.assertTrue(self._wait(lambda: "Tiempo de apertura agotado" in (worker.state["last_error"] or "")))
+                seq = worker.ring.seq
+                self.assertTrue(self._wait(lambda: worker.ring.seq > seq + 3))
+                self.assertIsNotNone(worker.state["camera_object"])
+                self.assertEqual(attempts, ["640x480"])
+            finally:
+                camera_service.stop_camera_worker(200)
+    
+    @unittest.skipUnless(SOURCES_AVAILABLE and CAMERA_SERVICE_AVAILABLE, "app.services no disponible")
+    def test_switching_camera_stops_previous_worker(self):
+        """Test: Al cambiar el aula de la cámara 190 a la 191 el worker anterior se detiene"""
+        worker = camera_service.start_camera_worker(190, "320x240", source="synthetic:?fps=60")
+        try:
+            self.assertTrue(self._wait(lambda: worker.ring.seq >= 3))
+            camera_service.switch_camera_worker(190, 191, "320x240")
+            self.assertFalse(worker.state["is_running"])
+            self.assertTrue(self._wait(lambda: not worker.thread.is_alive()))
+            self.assertIsNone(worker.state["camera_object"])
+        finally:
+            camera_service.stop_camera_worker(190)
+
+class TestInferenceEngines(unittest.TestCase):
+    """Tests para los motores de inferencia intercambiables"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+    
+    def _save_model(self, name, nodes, inputs, outputs, initializers):
+        from onnx import helper
+        graph = helper.make_graph(nodes, name, inputs, outputs, initializers)
+        model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)], ir_version=8)
+        path = os.path.join(self.temp_dir, f"{name}.onnx")
+        onnx.save(model, path)
+        return path
+    
+    def _models(self):
+        """Modelos mínimos: emociones NHWC que entrega logits, género NCHW con softmax"""
+        from onnx import helper, numpy_helper, TensorProto
+        weights = np.zeros((48 * 48, 7), dtype=np.float32)
+        weights[:, EMOTION_LABELS.index("happy")] = 10.0 / (48 * 48)  # Logit ∝ brillo medio
+        emotion = self._save_model("emotion", [
+            helper.make_node("Reshape", ["input", "shape"], ["flat"]),
+            helper.make_node("MatMul", ["flat", "w"], ["logits"])
+        ], [helper.make_tensor_value_info("input", TensorProto.FLOAT, ["N", 48, 48, 1])],
+           [helper.make_tensor_value_info("logits", TensorProto.FLOAT, ["N", 7])],
+           [numpy_helper.from_array(np.array([-1, 48 * 48], dtype=np.int64), "shape"),
+            numpy_helper.from_array(weights, "w")])
+        # Woman ∝ rojo medio, Man ∝ azul medio (entrada BGR, como DeepFace)
+        channel = np.array([[0, 4], [0, 0], [4, 0]], dtype=np.float32)
+        gender = self._save_model("gender", [
+            helper.make_node("GlobalAveragePool", ["input"], ["pooled"]),
+            helper.make_node("Flatten", ["pooled"], ["flat"]),
+            helper.make_node("MatMul", ["flat", "w"], ["logits"]),
+            helper.make_node("Softmax", ["logits"], ["probs"], axis=1)
+        ], [helper.make_tensor_value_info("input", TensorProto.FLOAT, ["N", 3, 224, 224])],
+           [helper.make_tensor_value_info("probs", TensorProto.FLOAT, ["N", 2])],
+           [numpy_helper.from_array(channel, "w")])
+        return emotion, gender
+    
+    @unittest.skipUnless(ONNX_ENGINE_AVAILABLE, "onnxruntime/onnx no disponibles")
+    def test_onnx_results_use_deepface_format(self):
+        """Test: El motor ONNX entrega porcentajes y dominantes con el formato de DeepFace"""
+        emotion_model, gender_model = self._models()
+        engine = OnnxEngine(emotion_model, gender_model)
+        engine._detector = object()  # Sin detector: las caras se entregan a classify
+        engine.load()
+        frame = np.zeros((100, 200, 3), dtype=np.uint8)
+        frame[10:60, 20:70] = (255, 255, 255)
+        frame[10:60, 120:170] = (255, 0, 0)  # Azul en BGR
+        faces = [{"region": {"x": 20, "y": 10, "w": 50, "h": 50}, "confidence": 0.9},
+                 {"region": {"x": 120, "y": 10, "w": 50, "h": 50}, "confidence": 0.8}]
+        
+        results = engine.classify(frame, faces)
+        self.assertEqual([r["region"] for r in results], [f["region"] for f in faces])
+        self.assertEqual(results[0]["dominant_emotion"], "happy")
+        self.assertAlmostEqual(sum(results[0]["emotion"].values()), 100.0, places=3)
+        self.assertEqual(results[1]["dominant_gender"], "Man")
+        self.assertAlmostEqual(sum(results[1]["gender"].values()), 100.0, places=3)
+        self.assertEqual(results[1]["face_confidence"], 0.8)
+        
+        engine.detect = lambda image: []
+        self.assertEqual(engine.analyze(frame), [])
+    
+    @unittest.skipUnless(ONNX_ENGINE_AVAILABLE, "onnxruntime/onnx no disponibles")
+    def test_preprocessing_matches_deepface(self):
+        """Test: Las entradas de emoción y género se preparan como en DeepFace (cara no cuadrada)"""
+        import cv2
+        crop = np.random.default_rng(3).integers(0, 255, (90, 60, 3), dtype=np.uint8)
+        # Pasos de DeepFace: extract_faces (proporción, relleno centrado, [0, 1]) y gris a 48x48
+        factor = min(224 / crop.shape[0], 224 / crop.shape[1])
+        face = cv2.resize(crop, (int(crop.shape[1] * factor), int(crop.shape[0] * factor)))
+        d0, d1 = 224 - face.shape[0], 224 - face.shape[1]
+        face = np.pad(face, ((d0 // 2, d0 - d0 // 2), (d1 // 2, d1 - d1 // 2), (0, 0)), "constant")
+        face = face.astype(np.float32) / 255
+        expected_emotion = cv2.resize(cv2.cvtColor(face, cv2.COLOR_BGR2GRAY), (48, 48))
+        
+        np.testing.assert_allclose(OnnxEngine._gender_input(crop), face, atol=1e-6)
+        np.testing.assert_allclose(OnnxEngine._emotion_input(crop)[:, :, 0], expected_emotion, atol=1e-6)
+    
+    @unittest.skipUnless(ONNX_ENGINE_AVAILABLE, "onnxruntime/onnx no disponibles")
+    def test_engine_selection(self):
+        """Test: INFERENCE_ENGINE elige el motor y un modelo inexistente lo deja no disponible"""
+        engine = create_engine({"INFERENCE_ENGINE": "onnx", "ONNX_EMOTION_MODEL": "/no/existe.onnx"})
+        self.assertEqual(engine.name, "onnx")
+        self.assertFalse(engine.available)
+        self.assertEqual(create_engine({}).name, "deepface")
+        with self.assertRaises(ValueError):
+            create_engine({"INFERENCE_ENGINE": "tflite"})
+    
+    @unittest.skipUnless(ONNX_ENGINE_AVAILABLE, "onnxruntime/onnx no disponibles")
+    def test_batched_matches_per_face(self):
+        """Test: Clasificar en lotes da los mismos resultados que cara por cara"""
+        emotion_model, gender_model = self._models()
+        rng = np.random.default_rng(3)
+        frame = rng.integers(0, 255, (120, 400, 3), dtype=np.uint8)
+        faces = [{"region": {"x": 12 * i, "y": i % 5 * 10, "w": 30 + i, "h": 40}} for i in range(25)]
+        results = {}
+        for batch_size in (1, 8):
+            engine = OnnxEngine(emotion_model, gender_model, batch_size=batch_size)
+            engine._detector = object()
+            results[batch_size] = engine.classify_many([(frame, faces[:10], ("emotion",)),
+                                                        (frame, faces[10:], ("emotion", "gender"))])
+        self.assertEqual([len(r) for r in results[8]], [10, 15])
+        self.assertNotIn("gender", results[8][0][0])
+        for per_face, batched in zip(sum(results[1], []), sum(results[8], [])):
+            self.assertEqual(per_face.keys(), batched.keys())
+            for key in ("emotion", "gender"):
+                for label, value in per_face.get(key, {}).items():
+                    self.assertEqual(value, batched[key][label])
+            self.assertEqual(per_face.get("dominant_emotion"), batched.get("dominant_emotion"))
+    
+    @unittest.skipUnless(ONNX_ENGINE_AVAILABLE, "app.services.engines no disponible")
+    def test_batcher_merges_cameras(self):
+        """Test: Las peticiones simultáneas de varias cámaras se clasifican en un solo lote"""
+        import threading
+        class CountingEngine(engines_service.InferenceEngine):
+            def __init__(self):
+                super().__init__()
+                self.calls = []
+            def classify(self, frame, faces, actions=("emotion", "gender")):
+                return [{"camera": frame, "face": face} for face in faces]
+            def classify_many(self, requests):
+                self.calls.append(len(requests))
+                return super().classify_many(requests)
+        engine = CountingEngine()
+        batcher = engines_service.ClassificationBatcher(engine, max_wait=0.2)
+        out = {}
+        threads = [threading.Thread(target=lambda c=c: out.__setitem__(c, batcher.classify(c, [c, c])))
+                   for c in range(3)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        self.assertEqual(engine.calls, [3])
+        self.assertEqual(out[2], [{"camera": 2, "face": 2}, {"camera": 2, "face": 2}])
+    
+    @unittest.skipUnless(ONNX_ENGINE_AVAILABLE, "app.services.engines no disponible")
+    def test_batcher_only_for_batching_engines(self):
+        """Test: Con DeepFace (una cara por forward) no se crea agrupador; con ONNX sí"""
+        deepface = engines_service.get_batcher({"INFERENCE_ENGINE": "deepface"})
+        self.assertIsInstance(deepface, engines_service.DeepFaceEngine)
+        onnx_batcher = engines_service.get_batcher({"INFERENCE_ENGINE": "onnx"})
+        self.assertIsInstance(onnx_batcher, engines_service.ClassificationBatcher)
+    
+    @unittest.skipUnless(ONNX_ENGINE_AVAILABLE, "app.services.engines no disponible")
+    def test_warm_up_once_and_reports_readiness(self):
+        """Test: La precarga ejercita los modelos una sola vez y reporta el estado"""
+        import threading
+        class SlowEngine(engines_service.InferenceEngine):
+            name = "prueba"
+            calls = 0
+            fail = True
+            def warm_up(self, actions=("emotion", "gender")):
+                SlowEngine.calls += 1
+                if SlowEngine.fail:
+                    raise RuntimeError("modelo corrupto")
+        settings = {"INFERENCE_ENGINE": "prueba"}
+        saved_state = dict(engines_service.engine_state)
+        engines_service._engines["prueba"] = SlowEngine()
+        try:
+            self.assertFalse(engines_service.warm_up_engine(settings))
+            self.assertFalse(engines_service.warm_up_engine(settings))  # Sin reintento inmediato
+            status = engines_service.engine_status()
+            self.assertEqual((status["status"], status["error"], SlowEngine.calls), ("error", "modelo corrupto", 1))
+            
+            SlowEngine.fail = False
+            engines_service.engine_state["failed_at"] -= engines_service.ENGINE_RETRY_INTERVAL
+            threads = [threading.Thread(target=engines_service.warm_up_engine, args=(settings,)) for _ in range(4)]
+            for t in threads: t.start()
+            for t in threads: t.join()
+            status = engines_service.engine_status()
+            self.assertTrue(status["ready"])
+            self.assertIsNotNone(status["time_to_ready_s"])
+            self.assertEqual(SlowEngine.calls, 2)
+        finally:
+            engines_service._engines.pop("prueba", None)
+            engines_service.engine_state.update(saved_state)
+
+class TestFaceTracking(unittest.TestCase):
+    """Tests para el seguimiento de caras entre ejecuciones del detector"""
+    
+    def _frame(self, x, y=40):
+        """Frame con un parche texturado (la "cara") en (x, y)"""
+        rng = np.random.default_rng(7)
+        frame = np.full((160, 240, 3), 90, dtype=np.uint8)
+        frame[y:y + 40, x:x + 40] = rng.integers(0, 255, (40, 40, 1), dtype=np.uint8)
+        return frame
+    
+    @unittest.skipUnless(ANALYSIS_AVAILABLE and TRACKING_AVAILABLE, "app.services.analysis no disponible")
+    def test_tracking_default_depends_on_engine(self):
+        """Test: Sin configurar, DeepFace detecta en cada tick (caras alineadas) y ONNX sigue las caras"""
+        deepface, onnx_engine, pooled = MagicMock(), MagicMock(), MagicMock()
+        deepface.name, onnx_engine.name, pooled.name = "deepface", "onnx", "deepface-pool"
+        self.assertEqual(analysis_service._detect_every({}, deepface), 0)
+        self.assertEqual(analysis_service._detect_every({}, pooled), 0)
+        self.assertEqual(analysis_service._detect_every({"FACE_TRACK_DETECT_EVERY": None}, onnx_engine), 5)
+        self.assertEqual(analysis_service._detect_every({"FACE_TRACK_DETECT_EVERY": 3}, deepface), 3)
+    
+    @unittest.skipUnless(TRACKING_AVAILABLE, "app.services.tracking no disponible")
+    def test_detects_every_n_and_follows_motion(self):
+        """Test: El detector corre cada N ticks y entre medio la caja sigue a la cara"""
+        calls = []
+        def detect(frame):
+            calls.append(1)
+            return [{"region": {"x": x, "y": 40, "w": 40, "h": 40}, "confidence": 0.9}]
+        tracker = FaceTracker(detect_every=3)
+        ids, xs = set(), []
+        for i in range(6):
+            x = 20 + 3 * i
+            faces = tracker.update(self._frame(x), detect)
+            ids.update(f["track_id"] for f in faces)
+            xs.append(faces[0]["region"]["x"])
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(ids, {1})
+        for i, x in enumerate(xs):
+            self.assertLessEqual(abs(x - (20 + 3 * i)), 1)
+    
+    @unittest.skipUnless(TRACKING_AVAILABLE, "app.services.tracking no disponible")
+    def test_association_and_lost_tracks(self):
+        """Test: Detecciones se asocian por IoU y una cara perdida fuerza al detector"""
+        box = {"x": 20, "y": 40, "w": 40, "h": 40}
+        self.assertEqual(iou(box, box), 1.0)
+        self.assertEqual(iou(box, dict(box, x=100)), 0.0)
+        
+        detections = [[{"region": box}], [{"region": dict(box, x=22)}, {"region": dict(box, x=150)}], []]
+        calls = []
+        def detect(frame):
+            calls.append(1)
+            return detections[min(len(calls) - 1, len(detections) - 1)]
+        tracker = FaceTracker(detect_every=10, max_missed=1)
+        flat = np.full((160, 240, 3), 90, dtype=np.uint8)  # Sin textura: el flujo óptico no sigue nada
+        self.assertEqual([f["track_id"] for f in tracker.update(flat, detect)], [1])
+        self.assertEqual([f["track_id"] for f in tracker.update(flat, detect)], [1, 2])
+        self.assertEqual(tracker.update(flat, detect), [])
+        self.assertEqual(len(tracker.tracks), 2)  # Ocultas hasta superar max_missed
+        tracker.update(flat, detect)
+        self.assertEqual(tracker.tracks, [])
+        self.assertEqual(len(calls), 4)
+
+    @unittest.skipUnless(TRACKING_AVAILABLE, "app.services.tracking no disponible")
+    def test_gender_cached_per_track(self):
+        """Test: El género se infiere una vez por cara y se reinfiere si vence o es dudoso"""
+        requested = []
+        class Classifier:
+            def classify_many(self, requests):
+                out = []
+                for frame, faces, actions in requests:
+                    requested.extend((f["track_id"], actions) for f in faces)
+                    results = []
+                    for f in faces:
+                        result = {"emotion": {"happy": 90.0}, "dominant_emotion": "happy"}
+                        if "gender" in actions:
+                            woman = 55.0 if f["track_id"] == 2 else 95.0  # La cara 2 es dudosa
+                            result.update(gender={"Woman": woman, "Man": 100 - woman}, dominant_gender="Woman")
+                        results.append(result)
+                    out.append(results)
+                return out
+        cache = TrackAttributeCache(refresh_seconds=60, min_confidence=80)
+        faces = [{"track_id": 1, "region": {}}, {"track_id": 2, "region": {}}]
+        for now in (0, 1, 2, 61):
+            results = cache.classify(Classifier(), None, faces, now)
+            self.assertEqual([r["dominant_gender"] for r in results], ["Woman", "Woman"])
+        gender_ticks = [(t, a) for t, a in requested if "gender" in a]
+        self.assertEqual([t for t, _ in gender_ticks].count(1), 2)  # Al aparecer y al vencer
+        self.assertEqual([t for t, _ in gender_ticks].count(2), 4)  # Confianza baja: cada tick
+        self.assertEqual(len(requested), 8)  # La emoción se clasifica siempre
+
+class TestInferencePool(unittest.TestCase):
+    """Tests para los procesos de inferencia con frames en memoria compartida"""
+    
+    ENGINE_SOURCE = '''
+import os
+import time
+from app.services.engines import InferenceEngine, face_result
+
+class BrightnessEngine(InferenceEngine):
+    name = "brillo"
+    def __init__(self, settings):
+        super().__init__()
+    def detect(self, frame):
+        return [{"region": {"x": 0, "y": 0, "w": frame.shape[1], "h": frame.shape[0]}, "confidence": 1.0}]
+    def classify(self, frame, faces, actions=("emotion", "gender")):
+        return [dict(face_result(face, {"happy": float(frame.mean()), "sad": 0.0}), pid=os.getpid())
+                for face in faces]
+
+class SlowEngine(BrightnessEngine):
+    def detect(self, frame):
+        time.sleep(0.6)
+        return super().detect(frame)
+
+class CrashEngine(BrightnessEngine):
+    def warm_up(self, actions=("emotion", "gender")):
+        os._exit(3)
+
+class DieEngine(BrightnessEngine):
+    def detect(self, frame):
+        if frame.shape[0] == 8:  # El calentamiento usa otro tamaño
+            os._exit(4)
+        return super().detect(frame)
+'''
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        with open(os.path.join(self.temp_dir, "motor_prueba.py"), "w") as f:
+            f.write(self.ENGINE_SOURCE)
+        sys.path.insert(0, self.temp_dir)
+    
+    def tearDown(self):
+        import shutil
+        sys.path.remove(self.temp_dir)
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+    
+    @unittest.skipUnless(INFERENCE_POOL_AVAILABLE, "app.services.inference_pool no disponible")
+    def test_results_from_worker_processes(self):
+        """Test: Los frames llegan a otros procesos por memoria compartida y vuelven los resultados"""
+        engine = PooledEngine({"INFERENCE_ENGINE": "motor_prueba:BrightnessEngine", "SECRET_KEY": "x"},
+                              processes=2, slot_bytes=64 * 64 * 3)
+        self.assertNotIn("SECRET_KEY", engine.pool.settings)
+        engine.warm_up()
+        try:
+            frames = [np.full((64, 64, 3), v, dtype=np.uint8) for v in (10, 20, 30, 40, 50)]
+            faces = engine.detect(frames[0])
+            self.assertEqual(faces[0]["region"]["w"], 64)
+            # Más peticiones que slots: no se bloquea y cada resultado corresponde a su frame
+            results = engine.classify_many([(f, faces, ("emotion",)) for f in frames])
+            self.assertEqual([r[0]["emotion"]["happy"] for r in results], [10.0, 20.0, 30.0, 40.0, 50.0])
+            self.assertNotIn(os.getpid(), {r[0]["pid"] for r in results})
+            self.assertEqual(engine.analyze(frames[1])[0]["dominant_emotion"], "happy")
+            with self.assertRaises(ValueError):
+                engine.detect(np.zeros((128, 128, 3), dtype=np.uint8))
+            self.assertEqual(engine.pool.info()["free_slots"], 4)
+        finally:
+            engine.pool.close()
+    
+    @unittest.skipUnless(INFERENCE_POOL_AVAILABLE, "app.services.inference_pool no disponible")
+    def test_startup_failure_and_retry(self):
+        """Test: Un proceso que muere al iniciar falla rápido y el reintento no duplica slots"""
+        import time
+        engine = PooledEngine({"INFERENCE_ENGINE": "motor_prueba:CrashEngine"}, processes=2,
+                              slot_bytes=1024, start_timeout=60)
+        started = time.time()
+        with self.assertRaises(RuntimeError):
+            engine.warm_up()
+        self.assertLess(time.time() - started, 20)
+        
+        engine.pool.settings["INFERENCE_ENGINE"] = "motor_prueba:BrightnessEngine"
+        engine.warm_up()
+        try:
+            free = [engine.pool._free.get_nowait() for _ in range(engine.pool._free.qsize())]
+            self.assertEqual(sorted(free), [0, 1, 2, 3])
+            self.assertEqual(len(engine.pool.ready_times), 2)
+        finally:
+            engine.pool.close()
+    
+    @unittest.skipUnless(INFERENCE_POOL_AVAILABLE, "app.services.inference_pool no disponible")
+    def test_timed_out_slot_held_until_answer(self):
+        """Test: El slot de una petición vencida no se reutiliza mientras el proceso la procesa"""
+        import time
+        engine = PooledEngine({"INFERENCE_ENGINE": "motor_prueba:SlowEngine"}, processes=1, slot_bytes=1024)
+        engine.warm_up()
+        try:
+            engine.pool.timeout = 0.2
+            with self.assertRaises(TimeoutError):
+                engine.detect(np.zeros((8, 8, 3), dtype=np.uint8))
+            self.assertEqual(engine.pool.info()["free_slots"], 1)
+            self.assertEqual(engine.pool.info()["expired_slots"], 1)
+            deadline = time.time() + 5
+            while engine.pool.info()["free_slots"] < 2 and time.time() < deadline:
+                time.sleep(0.05)
+            self.assertEqual(engine.pool.info()["free_slots"], 2)
+            self.assertEqual(engine.pool.info()["expired_slots"], 0)
+        finally:
+            engine.pool.close()
+
+    @unittest.skipUnless(INFERENCE_POOL_AVAILABLE, "app.services.inference_pool no disponible")
+    def test_expired_slots_reclaimed_when_unanswerable(self):
+        """Test: Vencida la petición de un proceso muerto, o que nadie tomó, su slot vuelve a estar libre"""
+        import time
+        engine = PooledEngine({"INFERENCE_ENGINE": "motor_prueba:DieEngine"}, processes=1, slot_bytes=1024)
+        engine.warm_up()
+        try:
+            engine.pool.timeout = 0.5
+            with self.assertRaises((TimeoutError, RuntimeError)):
+                engine.detect(np.zeros((8, 8, 3), dtype=np.uint8))
+            deadline = time.time() + 5
+            while engine.pool.info()["free_slots"] < 2 and time.time() < deadline:
+                time.sleep(0.05)
+            self.assertEqual(engine.pool.info()["free_slots"], 2)
+            
+            # Petición vencida que ningún proceso tomó: se libera pasado otro timeout
+            slot = engine.pool._free.get_nowait()
+            engine.pool._expired[-1] = (slot, time.time() - 1.0)
+            engine.pool._reclaim_expired()
+            self.assertEqual(engine.pool.info()["free_slots"], 2)
+            self.assertEqual(engine.pool.info()["expired_slots"], 0)
+        finally:
+            engine.pool.close()
+
+class TestAnalysisScheduler(unittest.TestCase):
+    """Tests para el ritmo adaptativo del análisis"""
+    
+    @unittest.skipUnless(ANALYSIS_AVAILABLE, "app.services.analysis no disponible")
+    def test_zero_rate_means_no_limit(self):
+        """Test: ANALYSIS_MIN_RATE = 0 (sin piso) no divide por cero"""
+        self.assertEqual(analysis_service._rate_interval(2.0), 0.5)
+        self.assertEqual(analysis_service._rate_interval(0), 1000.0)
+        self.assertEqual(analysis_service._rate_interval(-1), 1000.0)
+    
+    @unittest.skipUnless(SCHEDULER_AVAILABLE, "app.services.scheduler no disponible")
+    def test_interval_follows_latency_within_bounds(self):
+        """Test: Un equipo lento analiza menos seguido y uno rápido más, sin salir de los límites"""
+        cpu = [20.0]
+        scheduler = AnalysisScheduler(min_interval=0.1, max_interval=2.0, target_load=0.5,
+                                      alpha=1.0, cpu_percent=lambda: cpu[0])
+        self.assertAlmostEqual(scheduler.record(0.2, now=0), 0.4)
+        self.assertEqual(scheduler.record(0.8, now=1), 1.6)
+        self.assertEqual(scheduler.record(3.0, now=2), 2.0)      # Tope: max_interval
+        self.assertEqual(scheduler.record(0.01, now=3), 0.1)     # Piso: min_interval
+        self.assertEqual(scheduler.info()["analysis_rate"], 10.0)
+    
+    @unittest.skipUnless(SCHEDULER_AVAILABLE, "app.services.scheduler no disponible")
+    def test_backs_off_when_cpu_saturated(self):
+        """Test: Con la CPU sobre el umbral el intervalo se alarga y la EWMA suaviza la latencia"""
+        cpu = [95.0]
+        scheduler = AnalysisScheduler(min_interval=0.1, max_interval=5.0, target_load=0.5,
+                                      cpu_ceiling=80.0, alpha=0.5, cpu_percent=lambda: cpu[0])
+        self.assertAlmostEqual(scheduler.record(0.2, now=0), 0.4 * 1.75)
+        cpu[0] = 10.0
+        self.assertAlmostEqual(scheduler.record(0.4, now=0.5), 0.6 * 1.75)  # CPU aún sin re-muestrear
+        self.assertAlmostEqual(scheduler.record(0.4, now=2), 0.7)
+        self.assertAlmostEqual(scheduler.info()["inference_ms"], 350.0)
+
+class TestEngineBenchmark(unittest.TestCase):
+    """Tests para el benchmark de motores sobre frames grabados"""
+    
+    ENGINE_SOURCE = '''
+from app.services.engines import InferenceEngine, face_result
+
+class Fija(InferenceEngine):
+    """Siempre la misma cara, feliz"""
+    name = "fija"
+    def __init__(self, settings):
+        super().__init__()
+        self.shift = 0
+    def detect(self, frame):
+        return [{"region": {"x": 10 + self.shift, "y": 10, "w": 40, "h": 40}, "confidence": 1.0}]
+    def classify(self, frame, faces, actions=("emotion", "gender")):
+        return [face_result(f, {"happy": 90.0, "sad": 10.0}, {"Woman": 70.0, "Man": 30.0}) for f in faces]
+
+class Corrida(Fija):
+    """La misma cara algo desplazada y triste"""
+    name = "corrida"
+    def __init__(self, settings):
+        super().__init__(settings)
+        self.shift = 4
+    def classify(self, frame, faces, actions=("emotion", "gender")):
+        return [face_result(f, {"happy": 10.0, "sad": 90.0}, {"Woman": 70.0, "Man": 30.0}) for f in faces]
+'''
+    
+    def setUp(self):
+        import cv2
+        self.temp_dir = tempfile.mkdtemp()
+        self.frames_dir = os.path.join(self.temp_dir, "frames")
+        os.makedirs(self.frames_dir)
+        for i in range(4):
+            cv2.imwrite(os.path.join(self.frames_dir, f"{i:03d}.png"), np.full((120, 160, 3), i * 40, dtype=np.uint8))
+        with open(os.path.join(self.temp_dir, "motores_bench.py"), "w") as f:
+            f.write(self.ENGINE_SOURCE)
+        sys.path.insert(0, self.temp_dir)
+    
+    def tearDown(self):
+        import shutil
+        sys.path.remove(self.temp_dir)
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+    
+    @unittest.skipUnless(BENCHMARK_AVAILABLE, "app.services.benchmark no disponible")
+    def test_report_latency_faces_and_agreement(self):
+        """Test: El reporte JSON trae percentiles, caras por motor y acuerdo entre motores"""
+        import json
+        output = os.path.join(self.temp_dir, "bench.json")
+        benchmark.main([self.frames_dir, "--engine", "motores_bench:Fija", "--engine", "motores_bench:Corrida",
+                        "--engine", "no-existe", "--width", "80", "--in-process", "--output", output])
+        with open(output, encoding="utf-8") as f:
+            report = json.load(f)
+        
+        self.assertEqual(set(report["engines"]), {"motores_bench:Fija", "motores_bench:Corrida"})
+        fija = report["engines"]["motores_bench:Fija"]
+        self.assertEqual(fija["frames"], 4)
+        self.assertEqual(fija["faces"], {"total": 4, "mean_per_frame": 1.0, "frames_with_faces": 4})
+        self.assertLessEqual(fija["latency_ms"]["p50"], fija["latency_ms"]["p99"])
+        self.assertNotIn("detections", fija)
+        pair = report["agreement"]["motores_bench:Fija vs motores_bench:Corrida"]
+        self.assertEqual(pair["matched_faces"], 4)
+        self.assertEqual(pair["face_f1"], 1.0)
+        self.assertEqual((pair["emotion_agreement"], pair["gender_agreement"]), (0.0, 1.0))
+        self.assertEqual(report["frame_width"], 80)
+
 def run_unit_tests():
     """Ejecutar todos los tests unitarios"""
     print("🧪 EJECUTANDO TESTS UNITARIOS RIGUROSOS")
@@ -304,7 +1533,24 @@ def run_unit_tests():
         TestUtilityFunctions,
         TestDataValidation,
         TestErrorHandling,
-        TestPerformance
+        TestPerformance,
+        TestFrameRing,
+        TestMjpegBroadcaster,
+        TestCameraRegistry,
+        TestFormatNegotiation,
+        TestReplaySources,
+        TestSceneChangeGate,
+        TestLowLatencyCapture,
+        TestCaptureStats,
+        TestSocketFramePush,
+        TestAnnotationStage,
+        TestSessionRecorder,
+        TestCameraSwitching,
+        TestInferenceEngines,
+        TestFaceTracking,
+        TestInferencePool,
+        TestAnalysisScheduler,
+        TestEngineBenchmark
     ]
     
     for test_class in test_classes:
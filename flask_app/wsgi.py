@@ -1,7 +1,10 @@
+import multiprocessing
 from app import create_app
 from app.extensions import socketio
 
-app = create_app()
+# Los procesos de inferencia (INFERENCE_WORKERS) reimportan este módulo al
+# iniciar: solo el proceso principal crea la aplicación
+app = create_app() if multiprocessing.parent_process() is None else None
 
 if __name__ == "__main__":
     print("===================================================================")